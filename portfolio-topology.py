@@ -36,10 +36,17 @@ DATA 2410: Mininet script to produce a network like the following:
 '''
 
 
+import argparse
+import json
+import os
+import shlex
+import sys
+import time
+
 from mininet.topo import Topo
 from mininet.net import Mininet
 from mininet.node import Node
-from mininet.log import setLogLevel, info
+from mininet.log import setLogLevel, info, output
 from mininet.cli import CLI
 from mininet.link import TCLink
 from mininet.node import OVSController
@@ -60,113 +67,345 @@ class LinuxRouter( Node ):
 
 
 
+#Network of the portfolio: a chain of routers (r1 - r2 - r3 - r4), each with the subnets (LANs) of its hosts. Every
+#router-to-router hop has its own bandwidth (Mbit/s), delay and queue size (packets); links to hosts are not limited.
+#A LAN with more than one host is connected to its router through a switch.
+DEFAULT_CONFIG = {
+    'routers': [
+        { 'lans': [ [ 'h1', 'h2', 'h3' ] ] },                     #r1: subnet A
+        { 'lans': [ [ 'h7' ] ] },                                 #r2
+        { 'lans': [ [ 'h8' ], [ 'h4', 'h5', 'h6' ] ] },           #r3: h8 and subnet E
+        { 'lans': [ [ 'h9' ] ] },                                 #r4
+    ],
+    'links': [
+        { 'bw': 40, 'delay': '10ms', 'max_queue_size': 67 },     #L1: r1 - r2
+        { 'bw': 30, 'delay': '20ms', 'max_queue_size': 100 },    #L2: r2 - r3
+        { 'bw': 20, 'delay': '10ms', 'max_queue_size': 33 },     #L3: r3 - r4
+    ],
+}
+OFFLOADS = ( 'tso', 'gso', 'lro', 'gro', 'ufo' )            #Turned off on hosts and links, so the links see real packets
+
+
+def scale_config( config, hosts ):
+    "Copy of a config with the given number of hosts (h1, h2, ...) spread over its LANs in turn."
+    lans = [ [] for router in config[ 'routers' ] for lan in router[ 'lans' ] ]
+    for i in range( hosts ):
+        lans[ i % len( lans ) ].append( 'h%d' % ( i + 1 ) )
+    lans.reverse()
+    routers = [ { 'lans': [ lans.pop() for lan in router[ 'lans' ] ] } for router in config[ 'routers' ] ]
+    return { 'routers': routers, 'links': config[ 'links' ] }
+
+
+def layout( config ):
+    """Works out the addresses of a config. Subnets 10.0.0.0/24, 10.0.1.0/24, ... are given out router by router: first
+    the router's LANs, then the link to the next router. Interfaces of a router are numbered in the same order, after
+    the link from the previous router. The router has .1 on its LANs, hosts have .2 and up; on a link the upstream
+    router has .1 and the downstream router .2. For the default config, this gives the original addresses of the network.
+
+    Returns a list with a dictionary per router: name, interfaces (list of (name, ip, subnet)), lans (list of (interface,
+    subnet, hosts)), up and down (the link to the previous/next router as (own interface, neighbour's ip, subnet), or None)."""
+
+    if len( config[ 'links' ] ) != len( config[ 'routers' ] ) - 1:
+        raise ValueError( 'there must be one link between each pair of neighbouring routers' )
+    routers = []
+    subnets = 0
+    def subnet():
+        nonlocal subnets
+        if subnets == 256:
+            raise ValueError( 'too many subnets for 10.0.0.0/16' )
+        subnets += 1
+        return '10.0.%d' % ( subnets - 1 )
+    for i, router in enumerate( config[ 'routers' ] ):
+        name = 'r%d' % ( i + 1 )
+        r = { 'name': name, 'interfaces': [], 'lans': [], 'up': None, 'down': None }
+        if routers:
+            up = routers[ -1 ][ 'down' ]
+            r[ 'interfaces' ].append( ( '%s-eth0' % name, up[ 2 ] + '.2', up[ 2 ] ) )
+            r[ 'up' ] = ( '%s-eth0' % name, up[ 2 ] + '.1', up[ 2 ] )
+        for hosts in router[ 'lans' ]:
+            if not 0 < len( hosts ) < 254:
+                raise ValueError( 'a LAN must have between 1 and 253 hosts' )
+            net = subnet()
+            intf = '%s-eth%d' % ( name, len( r[ 'interfaces' ] ) )
+            r[ 'interfaces' ].append( ( intf, net + '.1', net ) )
+            r[ 'lans' ].append( ( intf, net, hosts ) )
+        if i < len( config[ 'links' ] ):
+            net = subnet()
+            intf = '%s-eth%d' % ( name, len( r[ 'interfaces' ] ) )
+            r[ 'interfaces' ].append( ( intf, net + '.1', net ) )
+            r[ 'down' ] = ( intf, net + '.2', net )
+        routers.append( r )
+    return routers
+
+
+
 class PortfolioNetwork2410( Topo ):
 
-    def build( self, **_opts ):
-        #subnet A with three hosts (h1, h2, and h3), a switch, and a router (r1)
-        h1=self.addHost("h1",ip="10.0.0.2/24", defaultRoute='via 10.0.0.1')
-        h2=self.addHost("h2",ip="10.0.0.3/24", defaultRoute='via 10.0.0.1')
-        h3=self.addHost("h3",ip="10.0.0.4/24", defaultRoute='via 10.0.0.1')
-        s1 = self.addSwitch("s1")         
-        r1=self.addNode("r1",cls=LinuxRouter,ip='10.0.0.1/24', defaultRoute='via 10.0.1.2')
-        for h in (h1,h2,h3):
-            self.addLink(h,s1)
-        self.addLink(s1,r1,intfName2='r1-eth0',params2={ 'ip' : '10.0.0.1/24' })#,max_queue_size=834, use_htb=True)
-        
-        #subnet B - r1 - r2
-        
-        r2=self.addNode("r2",cls=LinuxRouter,ip='10.0.1.2/24') 
-        self.addLink(r1,r2,intfName1='r1-eth1', params1={ 'ip' : '10.0.1.1/24' }, bw=40, delay='10ms', max_queue_size=67, use_htb=True)#,max_queue_size=834, use_htb=True)
-        
-        
-        #subnet C  r2 - h7
-        h7=self.addHost("h7",ip="10.0.2.2/24", defaultRoute='via 10.0.2.1')
-        self.addLink(r2,h7,intfName1='r2-eth1', params1={ 'ip' : '10.0.2.1/24' })#,max_queue_size=834, use_htb=True)
-
-
-
-        #subnet D  r2 - r3
-        r3=self.addNode("r3",cls=LinuxRouter,ip='10.0.3.2/24') 
-        self.addLink(r2,r3,intfName1='r2-eth2', params1={ 'ip' : '10.0.3.1/24' }, bw=30, delay='20ms', max_queue_size=100, use_htb=True)#,max_queue_size=834, use_htb=True)
-        
-	
-	    #subnet    r3  - H8
-        h8=self.addHost("h8",ip="10.0.4.2/24", defaultRoute='via 10.0.4.1')
-        self.addLink(r3,h8,intfName1='r3-eth1', params1={ 'ip' : '10.0.4.1/24' })#,max_queue_size=834, use_htb=True)
-
-	
-    	# subnet E  r3 - H4-H7
-        h4=self.addHost("h4",ip="10.0.5.2/24", defaultRoute='via 10.0.5.1')
-        h5=self.addHost("h5",ip="10.0.5.3/24", defaultRoute='via 10.0.5.1')
-        h6=self.addHost("h6",ip="10.0.5.4/24", defaultRoute='via 10.0.5.1')
-        s2 = self.addSwitch("s2")         
-        for h in (h4,h5,h6):
-            self.addLink(h,s2)
-        self.addLink(s2,r3,intfName2='r3-eth2',params2={ 'ip' : '10.0.5.1/24' })#,max_queue_size=834, use_htb=True)
-	
-	
-	
-	    # subnet G r3 - r4
-
-        r4=self.addNode("r4",cls=LinuxRouter,ip='10.0.6.2/24', defaultRoute='via 10.0.6.1') 
-        self.addLink(r3,r4,intfName1='r3-eth3', params1={ 'ip' : '10.0.6.1/24' }, bw=20, delay='10ms', max_queue_size=33, use_htb=True)#,max_queue_size=834, use_htb=True)
-        
-	
-	    #subnet I: r4 - H9
-        h9=self.addHost("h9",ip="10.0.7.2/24", defaultRoute='via 10.0.7.1')
-        self.addLink(r4,h9,intfName1='r4-eth1', params1={ 'ip' : '10.0.7.1/24' })#,max_queue_size=834, use_htb=True)
-
-
-
-topo = PortfolioNetwork2410()
-net = Mininet( topo=topo, link=TCLink, controller = OVSController )
-net.start()
-
-#ip route add ipA via ipB dev INTERFACE
-#every packet going to ipA must first go to ipB using INTERFACE
-net["r2"].cmd("ip route add 10.0.0.0/24 via 10.0.1.1 dev r2-eth0")
-net["r2"].cmd("ip route add 10.0.4.0/24 via 10.0.3.2 dev r2-eth2")
-net["r2"].cmd("ip route add 10.0.5.0/24 via 10.0.3.2 dev r2-eth2")
-net["r2"].cmd("ip route add 10.0.6.0/24 via 10.0.3.2 dev r2-eth2")
-net["r2"].cmd("ip route add 10.0.7.0/24 via 10.0.3.2 dev r2-eth2")
-
-net["r3"].cmd("ip route add 10.0.0.0/24 via 10.0.3.1 dev r3-eth0")
-net["r3"].cmd("ip route add 10.0.1.0/24 via 10.0.3.1 dev r3-eth0")
-net["r3"].cmd("ip route add 10.0.2.0/24 via 10.0.3.1 dev r3-eth0")
-net["r3"].cmd("ip route add 10.0.7.0/24 via 10.0.6.2 dev r3-eth3")
-
-
-net["r1"].cmd("ethtool -K r1-eth1 tso off")
-net["r1"].cmd("ethtool -K r1-eth1 gso off")
-net["r1"].cmd("ethtool -K r1-eth1 lro off")
-net["r1"].cmd("ethtool -K r1-eth1 gro off")
-net["r1"].cmd("ethtool -K r1-eth1 ufo off")
-
-
-net["r2"].cmd("ethtool -K r2-eth2 tso off")
-net["r2"].cmd("ethtool -K r2-eth2 gso off")
-net["r2"].cmd("ethtool -K r2-eth2 lro off")
-net["r2"].cmd("ethtool -K r2-eth2 gro off")
-net["r2"].cmd("ethtool -K r2-eth2 ufo off")
-
-
-net["r3"].cmd("ethtool -K r3-eth3 tso off")
-net["r3"].cmd("ethtool -K r3-eth3 gso off")
-net["r3"].cmd("ethtool -K r3-eth3 lro off")
-net["r3"].cmd("ethtool -K r3-eth3 gro off")
-net["r3"].cmd("ethtool -K r3-eth3 ufo off")
-
-for i in range (1,10,1):
-    node = "h" + str(i)
-    iface = node + "-eth0" 
-    net[node].cmd("ethtool -K " + iface + " tso off")
-    net[node].cmd("ethtool -K " + iface + " gso off")
-    net[node].cmd("ethtool -K " + iface + " lro off")
-    net[node].cmd("ethtool -K " + iface + " gro off")
-    net[node].cmd("ethtool -K " + iface + " ufo off")
-
-
-
-net.pingAll()
-CLI( net )
-net.stop()
+    def build( self, config=DEFAULT_CONFIG, **_opts ):
+        routers = layout( config )
+        for r in routers:
+            #End routers send everything they are not connected to towards the rest of the chain; the routers in between
+            #get a route per subnet when the network is started (see configure_network())
+            default = None
+            if r[ 'up' ] is None and r[ 'down' ] is not None:
+                default = 'via ' + r[ 'down' ][ 1 ]
+            elif r[ 'down' ] is None and r[ 'up' ] is not None:
+                default = 'via ' + r[ 'up' ][ 1 ]
+            self.addNode( r[ 'name' ], cls=LinuxRouter, ip=r[ 'interfaces' ][ 0 ][ 1 ] + '/24', defaultRoute=default )
+
+        switches = 0
+        for i, r in enumerate( routers ):
+            #subnets of the router's hosts
+            for intf, net, hosts in r[ 'lans' ]:
+                for j, h in enumerate( hosts ):
+                    self.addHost( h, ip='%s.%d/24' % ( net, j + 2 ), defaultRoute='via %s.1' % net )
+                if len( hosts ) == 1:
+                    self.addLink( r[ 'name' ], hosts[ 0 ], intfName1=intf, params1={ 'ip' : net + '.1/24' } )
+                else:
+                    switches += 1
+                    s = self.addSwitch( 's%d' % switches )
+                    for h in hosts:
+                        self.addLink( h, s )
+                    self.addLink( s, r[ 'name' ], intfName2=intf, params2={ 'ip' : net + '.1/24' } )
+
+            #link to the next router
+            if r[ 'down' ] is not None:
+                nxt = routers[ i + 1 ]
+                self.addLink( r[ 'name' ], nxt[ 'name' ], intfName1=r[ 'down' ][ 0 ], params1={ 'ip' : r[ 'down' ][ 1 ][ :-1 ] + '1/24' },
+                              intfName2=nxt[ 'up' ][ 0 ], params2={ 'ip' : r[ 'down' ][ 1 ] + '/24' }, use_htb=True, **config[ 'links' ][ i ] )
+
+
+def node_commands( config ):
+    """Commands each node runs after the network is started: routes of the routers in the middle of the chain
+    (ip route add SUBNET via NEXT-HOP dev INTERFACE for every subnet the router is not connected to), and turning off
+    offloads on the hosts and on the interface of each router towards the next router. Returns a dictionary of lists."""
+
+    routers = layout( config )
+    commands = {}
+    for i, r in enumerate( routers ):
+        commands[ r[ 'name' ] ] = []
+        if r[ 'up' ] is not None and r[ 'down' ] is not None:
+            connected = { subnet for _, _, subnet in r[ 'interfaces' ] }
+            for j, other in enumerate( routers ):
+                hop = r[ 'up' ] if j < i else r[ 'down' ]
+                for _, _, subnet in other[ 'interfaces' ]:
+                    if subnet not in connected:
+                        connected.add( subnet )
+                        commands[ r[ 'name' ] ].append( 'ip route add %s.0/24 via %s dev %s' % ( subnet, hop[ 1 ], hop[ 0 ] ) )
+        if r[ 'down' ] is not None:
+            commands[ r[ 'name' ] ] += [ 'ethtool -K %s %s off' % ( r[ 'down' ][ 0 ], offload ) for offload in OFFLOADS ]
+        for _, _, hosts in r[ 'lans' ]:
+            for h in hosts:
+                commands[ h ] = [ 'ethtool -K %s-eth0 %s off' % ( h, offload ) for offload in OFFLOADS ]
+    return commands
+
+
+def configure_network( net, config ):
+    """Runs the commands of every node as one shell command line, and all nodes at once, instead of one round-trip to
+    the node's shell per command."""
+    commands = { name: lines for name, lines in node_commands( config ).items() if lines }
+    for name, lines in commands.items():
+        net[ name ].sendCmd( '{ ' + '; '.join( lines ) + '; } > /dev/null 2>&1' )
+    for name in commands:
+        net[ name ].waitOutput()
+
+
+def ping_parallel( net ):
+    """Checks that every node can reach every other node, like pingAll(), but with all pings at once: each node pings all
+    the others concurrently from one command line, and every node runs its command line at the same time. Returns the
+    percentage of pings dropped."""
+
+    output( '*** Ping: testing reachability of all nodes in parallel\n' )
+    nodes = net.hosts
+    for node in nodes:
+        targets = ' '.join( other.IP() for other in nodes if other is not node )
+        #Failed pings print their target; the subshell keeps job control messages out of the output
+        node.sendCmd( '( for ip in %s; do ( ping -c1 -W1 $ip > /dev/null 2>&1 || echo $ip ) & done; wait )' % targets )
+    dropped = 0
+    for node in nodes:
+        ips = { other.IP(): other.name for other in nodes if other is not node }
+        failed = [ ips[ word ] for word in node.waitOutput().split() if word in ips ]
+        if failed:
+            output( '%s -> X %s\n' % ( node.name, ' '.join( failed ) ) )
+        dropped += len( failed )
+    pings = len( nodes )*( len( nodes ) - 1 )
+    output( '*** Results: %d%% dropped (%d/%d received)\n' % ( 100*dropped/pings if pings else 0, pings - dropped, pings ) )
+    return 100*dropped/pings if pings else 0
+
+
+def start_network( config=DEFAULT_CONFIG ):
+    """Builds and starts the network of a config, sets up the routes between the subnets and turns off segmentation
+    offloads, so the links see real packets. Returns the running Mininet object."""
+
+    topo = PortfolioNetwork2410( config=config )
+    net = Mininet( topo=topo, link=TCLink, controller = OVSController )
+    net.start()
+    configure_network( net, config )
+    return net
+
+
+
+#Root of the repository: simpleperf and the measurement archive are found relative to this script
+ROOT = os.path.dirname( os.path.abspath( __file__ ) )
+SIMPLEPERF = os.path.join( ROOT, 'simpleperf', 'simpleperf.py' )
+FLOW_TYPES = ( 'throughput', 'latency' )
+SERVER_STARTUP = 1          #Seconds to wait for the simpleperf servers to listen before the first flow starts
+
+
+def load_plan( path ):
+    """Reads a test plan (JSON) and checks it, so a mistake is found before the network is started.
+
+    The plan has a list of tests, run one after another on the same network. Each test has a name (the directory in
+    the measurement archive), an optional run number (appended to the file names, as in test-case-4) and a list of
+    flows, started concurrently. A flow has a type ('throughput' runs a simpleperf client, 'latency' runs ping), a
+    client and a server node, and optionally: start (offset in seconds from the start of the test), args (extra
+    arguments of the client; default -t 25 for throughput), count (number of pings, default 25), port (default 8088),
+    server_ip (default the IP of the server node), server_args (extra arguments of the simpleperf server), label
+    (used in the file name instead of client-server) and output (file name)."""
+
+    with open( path ) as f:
+        plan = json.load( f )
+    if not isinstance( plan.get( 'tests' ), list ):
+        raise ValueError( 'the plan must have a list of tests' )
+    for test in plan[ 'tests' ]:
+        if 'name' not in test or not test.get( 'flows' ):
+            raise ValueError( 'every test must have a name and at least one flow' )
+        for flow in test[ 'flows' ]:
+            if flow.get( 'type' ) not in FLOW_TYPES:
+                raise ValueError( f"flow type must be one of {', '.join( FLOW_TYPES )} in test {test['name']}" )
+            if 'client' not in flow or 'server' not in flow:
+                raise ValueError( f"every flow must have a client and a server in test {test['name']}" )
+            if flow.get( 'start', 0 ) < 0:
+                raise ValueError( f"start offsets cannot be negative in test {test['name']}" )
+    return plan
+
+
+def flow_output( test, flow ):
+    "Name of the output file of a flow, following the naming of the measurement archive (e.g. throughput_h1-h4-2.txt)."
+    if 'output' in flow:
+        return flow[ 'output' ]
+    name = flow[ 'type' ] + '_' + flow.get( 'label', flow[ 'client' ] + '-' + flow[ 'server' ] )
+    if 'run' in test:
+        name += '-' + str( test[ 'run' ] )
+    return name + '.txt'
+
+
+def server_output( test, node, port ):
+    "Name of the output file of a simpleperf server started for a test (e.g. server_h4-8088-2.txt)."
+    name = 'server_' + node + '-' + port
+    if 'run' in test:
+        name += '-' + str( test[ 'run' ] )
+    return name + '.txt'
+
+
+def server_address( net, flow ):
+    "IP address and port the flow connects to."
+    return flow.get( 'server_ip', net[ flow[ 'server' ] ].IP() ), str( flow.get( 'port', 8088 ) )
+
+
+def flow_command( net, flow ):
+    "Command run on the client node of a flow."
+    ip, port = server_address( net, flow )
+    if flow[ 'type' ] == 'throughput':
+        return [ sys.executable, SIMPLEPERF, '-c', '-I', ip, '-p', port ] + shlex.split( flow.get( 'args', '-t 25' ) )
+    return [ 'ping', '-c', str( flow.get( 'count', 25 ) ) ] + shlex.split( flow.get( 'args', '' ) ) + [ ip ]
+
+
+def start_process( node, command, path ):
+    """Starts a command on a node with its standard output written to path and its standard error to the same path
+    with the extension .err, so messages never end up between the --json or --csv records of the output. Returns
+    the process and both files."""
+    out = open( path, 'w' )
+    err = open( os.path.splitext( path )[ 0 ] + '.err', 'w' )
+    return node.popen( command, stdout=out, stderr=err ), ( out, err )
+
+
+def run_test( net, test, root ):
+    """Runs one test of a plan: starts a simpleperf server for every server address used by its throughput flows,
+    starts every flow at its offset and waits for all of them, writing the output of each flow and of each server
+    to its file in the test's directory (and their messages to a .err file next to it). The servers are stopped
+    afterwards, so the next test starts from a clean network."""
+
+    directory = os.path.join( root, test[ 'name' ] )
+    os.makedirs( directory, exist_ok=True )
+    output( f"*** Running {test['name']}" + ( f" (run {test['run']})" if 'run' in test else '' ) + '\n' )
+
+    servers = {}
+    for flow in test[ 'flows' ]:
+        if flow[ 'type' ] == 'throughput':
+            ip, port = server_address( net, flow )
+            if ( flow[ 'server' ], ip, port ) not in servers:
+                #Unbuffered (-u), so the server's reports are in its file even though it is stopped with a signal
+                command = [ sys.executable, '-u', SIMPLEPERF, '-s', '-b', ip, '-p', port ] + shlex.split( flow.get( 'server_args', '' ) )
+                path = os.path.join( directory, server_output( test, flow[ 'server' ], port ) )
+                servers[ ( flow[ 'server' ], ip, port ) ] = start_process( net[ flow[ 'server' ] ], command, path )
+    if servers:
+        time.sleep( SERVER_STARTUP )
+
+    #Flows are started in order of their offsets from one loop, so independent flows run in parallel
+    running = []
+    start = time.time()
+    for flow in sorted( test[ 'flows' ], key=lambda flow: flow.get( 'start', 0 ) ):
+        time.sleep( max( 0, start + flow.get( 'start', 0 ) - time.time() ) )
+        path = os.path.join( directory, flow_output( test, flow ) )
+        output( f"*** {flow['client']} -> {flow['server']}: {flow['type']} -> {path}\n" )
+        running.append( start_process( net[ flow[ 'client' ] ], flow_command( net, flow ), path ) )
+    for process, files in running:
+        process.wait()
+        for f in files:
+            f.close()
+
+    for server, files in servers.values():
+        server.terminate()
+        server.wait()
+        for f in files:
+            f.close()
+
+
+def run_plan( net, plan, root ):
+    "Runs every test of a plan in order on the same network."
+    for test in plan[ 'tests' ]:
+        run_test( net, test, root )
+        time.sleep( plan.get( 'pause', 1 ) )        #Let the queues drain before the next test
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description='Starts the DATA2410 portfolio network and opens the Mininet CLI, or runs a test plan' )
+    parser.add_argument( '--plan', help='Runs the tests of a plan (JSON) instead of opening the CLI, then stops the network' )
+    parser.add_argument( '-o', '--output', help='Directory the results of a plan are written to (default: measurements)',
+                         default=os.path.join( ROOT, 'measurements' ) )
+    parser.add_argument( '--topology', help='Builds the network from a config (JSON, in the form of DEFAULT_CONFIG) instead of the portfolio network' )
+    parser.add_argument( '--hosts', help='Spreads the given number of hosts over the LANs of the network', type=int )
+    parser.add_argument( '--ping', help='Checks connectivity with all pings at once (parallel, default), one ping at a time (all), or not at all (none)',
+                         choices=( 'parallel', 'all', 'none' ), default='parallel' )
+    args = parser.parse_args()
+
+    try:
+        plan = load_plan( args.plan ) if args.plan else None   #Check the plan before the network is started
+    except ( OSError, ValueError, KeyError ) as e:
+        sys.exit( f'Error: invalid plan {args.plan}: {e}' )
+    try:
+        config = DEFAULT_CONFIG
+        if args.topology:
+            with open( args.topology ) as f:
+                config = json.load( f )
+        if args.hosts is not None:
+            if args.hosts < 1:
+                raise ValueError( 'there must be at least one host' )
+            config = scale_config( config, args.hosts )
+        layout( config )                                        #Check the config before the network is started
+    except ( OSError, ValueError, KeyError, TypeError ) as e:
+        sys.exit( f'Error: invalid topology: {e}' )
+    net = start_network( config )
+    try:
+        if args.ping == 'parallel':
+            ping_parallel( net )
+        elif args.ping == 'all':
+            net.pingAll()
+        if plan:
+            run_plan( net, plan, args.output )
+        else:
+            CLI( net )
+    finally:
+        net.stop()
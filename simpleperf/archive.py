@@ -0,0 +1,495 @@
+"""
+ARCHIVE: Ingestion and batch analysis of the measurement archive.
+The tool parses every result file under measurements/ (simpleperf tables or --json records, ping output and iperf UDP reports) into a columnar
+store, and computes aggregates across the whole archive: RTT statistics and throughput per test case and host pair, and a comparison of test cases.
+Parsed files are cached by modification time, so only new or changed files are parsed again.
+"""
+
+#Import libraries required for the program to work
+import argparse
+import sys
+import os
+import re
+import json
+import math
+from array import array
+
+
+#Create argparse object with program description
+parser = argparse.ArgumentParser(description='Ingest and analyse the simpleperf measurement archive')
+#Create optional arguments and assign flags. Help text describes each argument. Required input types are set, and default values set where necessary.
+parser.add_argument('command', help='ingest: parse new and changed files into the store; report: ingest, then print aggregates', choices=('ingest', 'report'))
+parser.add_argument('-d', '--dir', help='Specifies the root of the measurement archive', type=str,
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'measurements'))
+parser.add_argument('--store', help='Specifies the directory of the columnar store (default: .archive in the archive root)', type=str)
+parser.add_argument('--case', help='Only reports on test cases whose name contains the given text', type=str)
+parser.add_argument('--json', help='Writes the aggregates as one JSON document instead of tables', action='store_true')
+
+#Run the parser
+args = parser.parse_args()
+
+
+#COLUMNAR STORE
+#Every table is a set of columns of equal length, each held in a typed array from the array module (numpy is not a dependency of this project)
+#and saved as one binary file per column, so loading a column is a single read. Rows refer to their source file by its position in the index,
+#which holds the file metadata (test case, host pair, run, modification time) as JSON.
+STORE_VERSION = 1                                       #Must be increased whenever the layout of the store changes
+TABLES = {
+    #Throughput rows: source file, stream number in the file, role (ROLE_*), 1 for a final result and 0 for an interval, interval start and
+    #stop (s), bytes, rate (bits/s), and for UDP tests jitter (ms), lost and total datagrams and datagrams out of order (NaN for TCP tests)
+    'throughput': {'file': 'I', 'stream': 'I', 'role': 'b', 'final': 'b', 'start': 'd', 'stop': 'd', 'bytes': 'd', 'rate': 'd',
+                   'jitter': 'd', 'lost': 'd', 'total': 'd', 'out_of_order': 'd'},
+    #Round-trip times: source file, ICMP sequence number, round-trip time (ms)
+    'rtt': {'file': 'I', 'seq': 'I', 'rtt': 'd'},
+}
+ROLE_NONE = 0                                           #Only one side of the test was reported
+ROLE_SENDER = 1
+ROLE_RECEIVER = 2
+NAN = float('nan')
+
+#Names of result files: kind of test, optional tool/protocol, host pair or link, optional run number (e.g. throughput_udp_iperf_h1-h4.txt,
+#latency_h2-h5-1.txt, throughput_L1.txt)
+FILE_NAME = re.compile(r'(throughput|latency)(?:_(udp))?(?:_(iperf))?_(.+?)(?:-(\d+))?\.(?:txt|json)')
+#simpleperf table row: ID, interval, transfer, bandwidth, optional role
+SIMPLEPERF_ROW = re.compile(r'^\s*(\S.*?)\s+(\d+(?:\.\d+)?) - (\d+(?:\.\d+)?)\s+(\d+) (MB|KB|B)\s+(\d+(?:\.\d+)?) Mbps(?:\s+(sender|receiver))?')
+SIMPLEPERF_UDP = re.compile(r'([\d.]+) ms\s+(\d+)/(\d+) \([^)]*\)\s+(\d+)\s*$')
+SIMPLEPERF_UNITS = {'MB': 1e6, 'KB': 1e3, 'B': 1}
+#ping reply and summary
+PING_REPLY = re.compile(r'icmp_seq=(\d+) ttl=\d+ time=([\d.]+) ms')
+PING_SUMMARY = re.compile(r'(\d+) packets transmitted, (\d+) received')
+#iperf report row (client side, or server side with jitter and lost/total datagrams), and out-of-order count
+IPERF_ROW = re.compile(r'^\[\s*(\d+)\]\s+([\d.]+)-\s*([\d.]+) sec\s+([\d.]+) ([KMG]?)Bytes\s+([\d.]+) ([KMG]?)bits/sec'
+                       r'(?:\s+([\d.]+) ms\s+(\d+)/\s*(\d+))?')
+IPERF_OUT_OF_ORDER = re.compile(r'(\d+) datagrams received out-of-order')
+IPERF_BYTES = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30}    #iperf reports transfer in powers of 1024...
+IPERF_BITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9}      #...and bandwidth in powers of 1000
+
+
+#FUNCTION: Creates an empty table
+#ARGUMENTS:
+#name: Name of the table in TABLES
+#Returns a dictionary with one empty typed array per column.
+def new_table(name):
+    return {column: array(typecode) for column, typecode in TABLES[name].items()}
+
+
+#FUNCTION: Loads the store from disk
+#ARGUMENTS:
+#store: Directory of the store
+#Returns the index (list of file metadata dictionaries) and the tables. If there is no store yet, or it was written by another version of the
+#tool, an empty store is returned and every file is parsed again.
+def load_store(store):
+    tables = {name: new_table(name) for name in TABLES}
+    try:
+        with open(os.path.join(store, 'index.json')) as f:
+            index = json.load(f)
+        if index.get('version') != STORE_VERSION:
+            return [], tables
+        for name, columns in tables.items():
+            for column, values in columns.items():
+                with open(os.path.join(store, f'{name}.{column}.bin'), 'rb') as f:
+                    values.frombytes(f.read())
+    except (OSError, ValueError):
+        return [], {name: new_table(name) for name in TABLES}
+    return index['files'], tables
+
+
+#FUNCTION: Saves the store to disk
+#ARGUMENTS:
+#store: Directory of the store
+#files: List of file metadata dictionaries
+#tables: Dictionary of tables
+#Each column is written with array.tofile(). The index is written last, so an interrupted save leaves an index that does not match the columns
+#only if the columns were already replaced, in which case the lengths differ and the next run starts over.
+def save_store(store, files, tables):
+    os.makedirs(store, exist_ok=True)
+    for name, columns in tables.items():
+        for column, values in columns.items():
+            with open(os.path.join(store, f'{name}.{column}.bin'), 'wb') as f:
+                values.tofile(f)
+    with open(os.path.join(store, 'index.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'files': files}, f)
+
+
+#FUNCTION: Checks that all columns of every table have the same length
+#ARGUMENTS:
+#tables: Dictionary of tables
+def store_is_consistent(tables):
+    return all(len({len(values) for values in columns.values()}) == 1 for columns in tables.values())
+
+
+#FUNCTION: Keeps the rows of some files and renumbers them
+#ARGUMENTS:
+#tables: Dictionary of tables
+#mapping: List with the new position of each old file in the index, or -1 if its rows are dropped
+#Returns new tables with the rows of the dropped files left out, in one pass over each table.
+def remap_tables(tables, mapping):
+    remapped = {name: new_table(name) for name in tables}
+    for name, columns in tables.items():
+        keep = [i for i, file in enumerate(columns['file']) if mapping[file] >= 0]
+        for column, values in columns.items():
+            if column == 'file':
+                remapped[name][column].extend(mapping[values[i]] for i in keep)
+            else:
+                remapped[name][column].extend(values[i] for i in keep)
+    return remapped
+
+
+#FUNCTION: Obtains the metadata of a result file from its path
+#ARGUMENTS:
+#root: Root of the measurement archive
+#path: Path of the file
+#The test case is the name of the directory the file is in, the rest comes from the file name. Returns None if the name does not match a result file.
+def describe_file(root, path):
+    match = FILE_NAME.fullmatch(os.path.basename(path))
+    if match is None:
+        return None
+    kind, udp, iperf, pair, run = match.groups()
+    stat = os.stat(path)
+    return {'path': os.path.relpath(path, root), 'mtime': stat.st_mtime, 'size': stat.st_size,
+            'case': os.path.basename(os.path.dirname(path)), 'kind': kind, 'tool': 'iperf' if iperf else 'simpleperf',
+            'protocol': 'udp' if udp else 'tcp', 'pair': pair, 'run': int(run) if run else 1, 'transmitted': None}
+
+
+#FUNCTION: Appends one throughput row
+#ARGUMENTS:
+#table: The throughput table
+#file: Position of the source file in the index
+#values: Values of the row; UDP columns that are not given are NaN
+def add_throughput_row(table, file, stream, role, final, start, stop, bytes, rate, jitter=NAN, lost=NAN, total=NAN, out_of_order=NAN):
+    for column, value in (('file', file), ('stream', stream), ('role', role), ('final', final), ('start', start), ('stop', stop),
+                          ('bytes', bytes), ('rate', rate), ('jitter', jitter), ('lost', lost), ('total', total),
+                          ('out_of_order', out_of_order)):
+        table[column].append(value)
+
+
+#FUNCTION: Parses a simpleperf client or server table
+#ARGUMENTS:
+#text: Contents of the file
+#file: Position of the file in the index
+#tables: Dictionary of tables the rows are appended to
+#Rows are matched by their columns, so tables from every version of simpleperf are read (including tables printed by each parallel connection
+#separately, and tables with sender/receiver or UDP columns). SUM rows are left out, since they can be calculated from the stream rows.
+#Interval rows (-i) are told apart from final results by their position: if a stream has intervals, its final result is the last row that covers
+#the whole test; otherwise every row is a final result (older versions printed one table per connection, all with the same ID).
+def parse_simpleperf(text, file, tables):
+    rows = []
+    streams = {}                                        #Stream number of each ID, in order of appearance
+    for line in text.splitlines():
+        match = SIMPLEPERF_ROW.match(line)
+        if match is None or match[1] == 'SUM':
+            continue
+        id, start, stop, transfer, unit, rate, role = match.groups()
+        udp = SIMPLEPERF_UDP.search(line)
+        rows.append([streams.setdefault(id, len(streams)), {'sender': ROLE_SENDER, 'receiver': ROLE_RECEIVER}.get(role, ROLE_NONE), 1,
+                     float(start), float(stop), int(transfer)*SIMPLEPERF_UNITS[unit], float(rate)*1e6,
+                     *((float(value) for value in udp.groups()) if udp else (NAN,)*4)])
+    #Mark the intervals, per stream and role
+    groups = {}
+    for row in rows:
+        groups.setdefault((row[0], row[1]), []).append(row)
+    for group in groups.values():
+        if any(row[3] > 0 for row in group):
+            end = max(row[4] for row in group)
+            final = [row for row in group if row[3] == 0 and row[4] == end]
+            for row in group:
+                row[2] = 1 if final and row is final[-1] else 0
+    for row in rows:
+        add_throughput_row(tables['throughput'], file, *row)
+
+
+#FUNCTION: Parses simpleperf --json records
+#ARGUMENTS:
+#text: Contents of the file
+#file: Position of the file in the index
+#tables: Dictionary of tables the rows are appended to
+#Interval and stream records become throughput rows (with exact byte counts and rates); other records are skipped. Jitter is recorded in seconds.
+#Lines which are not records (such as messages written to the same file) are skipped as well.
+def parse_simpleperf_json(text, file, tables):
+    streams = {}                                        #Stream number of each ID, in order of appearance
+    for line in text.splitlines():
+        if not line.startswith('{'):
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get('type') not in ('interval', 'stream'):
+            continue
+        add_throughput_row(tables['throughput'], file, streams.setdefault(record['id'], len(streams)),
+                           {'sender': ROLE_SENDER, 'receiver': ROLE_RECEIVER}.get(record.get('role'), ROLE_NONE),
+                           1 if record['type'] == 'stream' else 0, record['start'], record['stop'], record['bytes'], record['bits_per_second'],
+                           record.get('jitter', NAN)*1e3, record.get('lost', NAN), record.get('datagrams', NAN) + record.get('lost', NAN),
+                           record.get('out_of_order', NAN))
+
+
+#FUNCTION: Parses ping output
+#ARGUMENTS:
+#text: Contents of the file
+#file: Position of the file in the index
+#tables: Dictionary of tables the rows are appended to
+#Returns the number of packets transmitted from the summary line (None if ping was interrupted before printing it), so loss can be calculated.
+def parse_ping(text, file, tables):
+    table = tables['rtt']
+    for seq, rtt in PING_REPLY.findall(text):
+        table['file'].append(file)
+        table['seq'].append(int(seq))
+        table['rtt'].append(float(rtt))
+    summary = PING_SUMMARY.search(text)
+    return int(summary[1]) if summary else None
+
+
+#FUNCTION: Parses an iperf report
+#ARGUMENTS:
+#text: Contents of the file
+#file: Position of the file in the index
+#tables: Dictionary of tables the rows are appended to
+#The client's own row is the sender row. The row after 'Server Report:' has the jitter and lost/total datagrams measured by the server and is the
+#receiver row; the out-of-order count on the following line is added to it.
+def parse_iperf(text, file, tables):
+    role = ROLE_SENDER
+    for line in text.splitlines():
+        if 'Server Report:' in line:
+            role = ROLE_RECEIVER
+            continue
+        match = IPERF_ROW.match(line)
+        if match is None:
+            out_of_order = IPERF_OUT_OF_ORDER.search(line)
+            if out_of_order and tables['throughput']['file'] and tables['throughput']['file'][-1] == file:
+                tables['throughput']['out_of_order'][-1] = float(out_of_order[1])
+            continue
+        stream, start, stop, transfer, byte_unit, rate, bit_unit, jitter, lost, total = match.groups()
+        add_throughput_row(tables['throughput'], file, int(stream), role, 1, float(start), float(stop),
+                           float(transfer)*IPERF_BYTES[byte_unit], float(rate)*IPERF_BITS[bit_unit],
+                           float(jitter) if jitter else NAN, float(lost) if lost else NAN, float(total) if total else NAN)
+
+
+#FUNCTION: Parses one result file into the tables
+#ARGUMENTS:
+#root: Root of the measurement archive
+#meta: Metadata of the file (from describe_file()), updated with anything learned from the contents
+#file: Position of the file in the index
+#tables: Dictionary of tables the rows are appended to
+#The format is recognised from the contents, not the file name. A file is read as simpleperf --json records if any of its lines is a record, so
+#messages above or between the records do not hide them. Returns False if no results were found in the file.
+def parse_file(root, meta, file, tables):
+    with open(os.path.join(root, meta['path']), errors='replace') as f:
+        text = f.read()
+    rows = len(tables['throughput']['file']) + len(tables['rtt']['file'])
+    if text.startswith('PING'):
+        meta['transmitted'] = parse_ping(text, file, tables)
+        if meta['transmitted'] is not None:
+            return True                                 #A ping where every packet was lost is a result too
+    elif 'Server Report:' in text or text.startswith('-'*60 + '\nClient connecting to'):
+        meta['tool'] = 'iperf'
+        parse_iperf(text, file, tables)
+    elif any(line.startswith('{') for line in text.splitlines()):
+        parse_simpleperf_json(text, file, tables)
+    else:
+        parse_simpleperf(text, file, tables)
+    return len(tables['throughput']['file']) + len(tables['rtt']['file']) > rows
+
+
+#FUNCTION: Brings the store up to date with the archive
+#ARGUMENTS:
+#root: Root of the measurement archive
+#store: Directory of the store
+#Files whose size and modification time match the index keep their rows; rows of changed and deleted files are dropped, and new and changed files
+#are parsed. The store is only written if something changed. A warning is printed for every parsed file without results. Returns the index, the
+#tables, and the numbers of files parsed (with and without results) and reused.
+def ingest(root, store):
+    files, tables = load_store(store)
+    if not store_is_consistent(tables):
+        files, tables = [], {name: new_table(name) for name in TABLES}
+    cached = {meta['path']: (position, meta) for position, meta in enumerate(files)}
+    found = []                                          #Metadata of every result file in the archive
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith('.'))   #Skip the store itself
+        for name in sorted(names):
+            meta = describe_file(root, os.path.join(directory, name))
+            if meta is not None:
+                found.append(meta)
+    #Keep the cached files that have not changed, in their old order, so their rows only need renumbering
+    kept = []
+    mapping = [-1]*len(files)                           #New position of each old file, or -1 if its rows are dropped
+    fresh = []
+    for meta in found:
+        position, old = cached.get(meta['path'], (None, None))
+        if old is not None and old['mtime'] == meta['mtime'] and old['size'] == meta['size']:
+            mapping[position] = len(kept)
+            kept.append(old)
+        else:
+            fresh.append(meta)
+    if not fresh and len(kept) == len(files):
+        return files, tables, 0, 0, len(kept)           #Nothing changed
+    tables = remap_tables(tables, mapping)
+    empty = 0                                           #Number of parsed files without results
+    for meta in fresh:
+        if not parse_file(root, meta, len(kept), tables):
+            print(f"Warning: no results found in {meta['path']}", file=sys.stderr)
+            empty += 1
+        kept.append(meta)
+    save_store(store, kept, tables)
+    return kept, tables, len(fresh) - empty, empty, len(kept) - len(fresh)
+
+
+#FUNCTION: Calculates a percentile of sorted values
+#ARGUMENTS:
+#values: Sorted list of values
+#percentile: Percentile between 0 and 100
+#Interpolates linearly between the two closest values. Returns NaN for an empty list.
+def percentile(values, percentile):
+    if not values:
+        return NAN
+    position = (len(values) - 1)*percentile/100
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low])*(position - low)
+
+
+#FUNCTION: Summarises a list of values
+#ARGUMENTS:
+#values: List of values (sorted in place)
+#Returns the count, minimum, mean, median, 90th and 99th percentile and maximum in a dictionary.
+def summarise(values):
+    values.sort()
+    return {'count': len(values), 'min': values[0] if values else NAN, 'mean': sum(values)/len(values) if values else NAN,
+            'median': percentile(values, 50), 'p90': percentile(values, 90), 'p99': percentile(values, 99),
+            'max': values[-1] if values else NAN}
+
+
+#FUNCTION: Computes the aggregates of the archive
+#ARGUMENTS:
+#files: List of file metadata dictionaries
+#tables: Dictionary of tables
+#Each table is read once, column by column, and its values are grouped by (test case, host pair) through the file column. Throughput is the
+#total rate of all streams of a run, from the receiver rows if the run has them (goodput) and otherwise from the final rows. Returns the RTT
+#statistics and throughput per test case and host pair, and a comparison of the test cases, in a dictionary.
+def aggregate(files, tables):
+    selected = [args.case is None or args.case in meta['case'] for meta in files]
+    keys = [(meta['case'], meta['pair']) for meta in files]
+
+    #RTT: one pass over the samples
+    rtt_groups = {}
+    rtt_files, rtt_values = tables['rtt']['file'], tables['rtt']['rtt']
+    for i in range(len(rtt_values)):
+        file = rtt_files[i]
+        if selected[file]:
+            rtt_groups.setdefault(keys[file], []).append(rtt_values[i])
+    transmitted = {}                                    #Packets transmitted per group, for the loss
+    for file, meta in enumerate(files):
+        if selected[file] and meta['kind'] == 'latency':
+            transmitted[keys[file]] = transmitted.get(keys[file], 0) + (meta['transmitted'] or 0)
+
+    #Throughput: one pass over the final rows, adding up the streams of each run
+    table = tables['throughput']
+    has_receiver = set(table['file'][i] for i in range(len(table['file'])) if table['role'][i] == ROLE_RECEIVER and table['final'][i])
+    run_rate = {}                                       #Total rate of each run (file)
+    run_udp = {}                                        #Lost/total datagrams and jitter of each UDP run
+    for i in range(len(table['file'])):
+        file = table['file'][i]
+        if not selected[file] or not table['final'][i]:
+            continue
+        if (table['role'][i] == ROLE_RECEIVER) != (file in has_receiver):
+            continue                                    #Use the receiver rows if there are any, otherwise the other rows
+        run_rate[file] = run_rate.get(file, 0) + table['rate'][i]
+        if not math.isnan(table['total'][i]):
+            udp = run_udp.setdefault(file, [0, 0, []])
+            udp[0] += table['lost'][i]
+            udp[1] += table['total'][i]
+            udp[2].append(table['jitter'][i])
+    throughput_groups = {}
+    for file, rate in run_rate.items():
+        group = throughput_groups.setdefault(keys[file], {'rates': [], 'lost': 0, 'total': 0, 'jitter': [], 'tool': files[file]['tool']})
+        group['rates'].append(rate/1e6)
+        if file in run_udp:
+            group['lost'] += run_udp[file][0]
+            group['total'] += run_udp[file][1]
+            group['jitter'] += run_udp[file][2]
+
+    rtt = []
+    for key in sorted(rtt_groups):
+        stats = summarise(rtt_groups[key])
+        sent = transmitted.get(key, 0)
+        stats['loss'] = 100*(1 - stats['count']/sent) if sent else NAN
+        rtt.append({'case': key[0], 'pair': key[1], **stats})
+    throughput = []
+    for key in sorted(throughput_groups):
+        group = throughput_groups[key]
+        stats = summarise(group['rates'])
+        stats['loss'] = 100*group['lost']/group['total'] if group['total'] else NAN
+        stats['jitter'] = sum(group['jitter'])/len(group['jitter']) if group['jitter'] else NAN
+        throughput.append({'case': key[0], 'pair': key[1], 'tool': group['tool'], **stats})
+    #Test cases: median RTT over all samples of the case, and mean throughput per run over all its pairs
+    cases = []
+    for case in sorted({key[0] for key in list(rtt_groups) + list(throughput_groups)}):
+        samples = [value for key, values in rtt_groups.items() if key[0] == case for value in values]
+        rates = [rate for key, group in throughput_groups.items() if key[0] == case for rate in group['rates']]
+        cases.append({'case': case, 'pairs': len({key[1] for key in list(rtt_groups) + list(throughput_groups) if key[0] == case}),
+                      'runs': len(rates), 'throughput_mean': sum(rates)/len(rates) if rates else NAN,
+                      'rtt_median': summarise(samples)['median'], 'rtt_p99': percentile(samples, 99)})
+    return {'rtt': rtt, 'throughput': throughput, 'cases': cases}
+
+
+#FUNCTION: Prints a table to screen
+#ARGUMENTS:
+#title: Title printed above the table
+#headings: Column headings
+#rows: List of rows (lists of values already formatted as strings)
+#Uses the same layout as simpleperf: each column is right-aligned with width 20.
+def display_table(title, headings, rows):
+    print(f'\n{title}')
+    for row in [headings] + rows:
+        print(' '.join('{: >20}'.format(column) for column in row))
+
+
+#FUNCTION: Formats a value for display_table()
+#ARGUMENTS:
+#value: The value
+#unit: Unit shown after the value
+#digits: Number of decimals
+#Values that could not be calculated (NaN) are shown as an empty column.
+def format_value(value, unit, digits=1):
+    return '' if math.isnan(value) else f'{value:.{digits}f} {unit}'
+
+
+#FUNCTION: Prints the aggregates as tables
+#ARGUMENTS:
+#results: Dictionary returned by aggregate()
+#RTTs are shown in ms and throughput in Mbps.
+def display_report(results):
+    display_table('Round-trip time per test case and host pair', ['Case', 'Pair', 'Samples', 'Loss', 'Min/Mean/Max', 'Median', 'p90', 'p99'],
+                  [[row['case'], row['pair'], f"{row['count']}", format_value(row['loss'], '%'), f"{row['min']:.1f}/{row['mean']:.1f}/{row['max']:.1f} ms",
+                    f"{row['median']:.1f} ms", f"{row['p90']:.1f} ms", f"{row['p99']:.1f} ms"] for row in results['rtt']])
+    display_table('Throughput per test case and host pair (total of all streams of a run)',
+                  ['Case', 'Pair', 'Tool', 'Runs', 'Mean', 'Median', 'Min/Max', 'UDP loss/jitter'],
+                  [[row['case'], row['pair'], row['tool'], f"{row['count']}", f"{row['mean']:.2f} Mbps", f"{row['median']:.2f} Mbps",
+                    f"{row['min']:.2f}/{row['max']:.2f}", '' if math.isnan(row['loss']) else f"{row['loss']:.2f}%/{row['jitter']:.3f} ms"]
+                   for row in results['throughput']])
+    display_table('Test cases', ['Case', 'Pairs', 'Throughput runs', 'Mean throughput', 'Median RTT', 'p99 RTT'],
+                  [[row['case'], f"{row['pairs']}", f"{row['runs']}", format_value(row['throughput_mean'], 'Mbps', 2),
+                    format_value(row['rtt_median'], 'ms'), format_value(row['rtt_p99'], 'ms')] for row in results['cases']])
+
+
+#MAIN FUNCTION
+def main():
+    root = os.path.normpath(args.dir)
+    if not os.path.isdir(root):
+        sys.exit(f'Error: {root} is not a directory')
+    store = args.store or os.path.join(root, '.archive')
+    files, tables, parsed, empty, reused = ingest(root, store)
+    if args.command == 'ingest':
+        print(f'{len(files)} files in the archive: {parsed} parsed, {empty} without results, {reused} unchanged '
+              f'({len(tables["throughput"]["file"])} throughput rows, {len(tables["rtt"]["file"])} RTT samples)')
+        return
+    results = aggregate(files, tables)
+    if args.json:
+        #NaN is not valid JSON, so values that could not be calculated are written as null
+        print(json.dumps({name: [{key: None if isinstance(value, float) and math.isnan(value) else value for key, value in row.items()}
+                                 for row in rows] for name, rows in results.items()}))
+    else:
+        display_report(results)
+
+
+if __name__ == '__main__':
+    main()                                                      #Execution of module begins with main()
@@ -0,0 +1,164 @@
+"""
+BENCHMARK: Loopback self-benchmark of simpleperf.
+The benchmark runs a simpleperf server and client end to end over the loopback interface, where the network is not the bottleneck, so the
+throughput measured is the ceiling of the tool itself. It sweeps block size, number of parallel connections and threads vs processes (-M), and
+reports throughput, CPU time per GB transferred and peak memory use of each combination. Results can be saved as a baseline, and later runs
+fail if the maximum throughput drops below the baseline by more than a threshold.
+"""
+
+#Import libraries required for the program to work
+import argparse
+import sys
+import os
+import json
+import subprocess
+import itertools
+
+
+#Create argparse object with program description
+parser = argparse.ArgumentParser(description='Loopback self-benchmark of simpleperf')
+#Create optional arguments and assign flags. Help text describes each argument. Required input types are set, and default values set where necessary.
+parser.add_argument('-l', '--len', help='Comma-separated block sizes to test, as B, KB or MB', type=str, default='1KB,64KB,1MB')
+parser.add_argument('-P', '--parallel', help='Comma-separated numbers of parallel connections to test', type=str, default='1,4')
+parser.add_argument('-m', '--modes', help='Comma-separated client modes to test: thread (default client) and/or process (-M)', type=str,
+                    default='thread,process')
+parser.add_argument('-t', '--time', help='Duration of each test in seconds', type=int, default=3)
+parser.add_argument('-r', '--repeat', help='Number of times each test is run; the best run is kept', type=int, default=1)
+parser.add_argument('-p', '--port', help='First port used; each test uses the next one, so sockets in TIME_WAIT are not reused', type=int, default=8188)
+parser.add_argument('-b', '--baseline', help='Baseline file the results are compared with', type=str,
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-baseline.json'))
+parser.add_argument('--save', help='Saves the results as the new baseline', action='store_true')
+parser.add_argument('--threshold', help='Fails if the maximum throughput is more than this percentage below the baseline', type=float, default=10)
+
+#Run the parser
+args = parser.parse_args()
+
+
+SIMPLEPERF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simpleperf.py')
+BASELINE_VERSION = 1                                    #Must be increased whenever the layout of the baseline changes
+HEADINGS = ['Block size', 'Streams', 'Mode', 'Rate', 'CPU per GB', 'Peak RSS', 'Baseline']
+
+
+#FUNCTION: Runs a process to the end and obtains its resource usage
+#ARGUMENTS:
+#process: A subprocess.Popen object
+#Uses os.wait4(), which returns the CPU time and peak resident set size of the process itself and of the processes it waited for (the
+#connections of -M), where getrusage(RUSAGE_CHILDREN) would add up all tests. Returns the CPU time in seconds and the peak RSS in KB.
+def wait_usage(process):
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+#FUNCTION: Runs one test
+#ARGUMENTS:
+#block: Block size, as given to -l
+#streams: Number of parallel connections
+#mode: 'thread' or 'process'
+#port: Port of the server
+#Starts a server, waits for it to listen, runs a client with --json and stops the server. Throughput is taken from the receiver results the
+#server sends back, so data still in socket buffers is not counted. Returns a dictionary with the rate (Gbit/s), CPU time of client and server
+#per GB, and the peak RSS (MB) of the largest process.
+def run_test(block, streams, mode, port):
+    server = subprocess.Popen([sys.executable, '-u', SIMPLEPERF, '-s', '-p', str(port), '--json'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in server.stderr:                      #Messages go to stderr with --json
+            if 'listening' in line:
+                break
+        else:
+            raise RuntimeError(f'the server did not start on port {port}')
+        command = [sys.executable, SIMPLEPERF, '-c', '-p', str(port), '-t', str(args.time), '-l', block, '-P', str(streams), '--json']
+        if mode == 'process':
+            command.append('-M')
+        client = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        output = client.stdout.read()
+        client_cpu, client_rss = wait_usage(client)
+    finally:
+        server.terminate()
+        server_cpu, server_rss = wait_usage(server)
+        server.stderr.close()
+    if client.returncode != 0:
+        raise RuntimeError(f'the client failed with exit code {client.returncode}')
+    records = [json.loads(line) for line in output.splitlines()]
+    received = [record for record in records if record['type'] == 'stream' and record.get('role') == 'receiver']
+    if not received:
+        raise RuntimeError('the client reported no results')
+    bytes = sum(record['bytes'] for record in received)
+    return {'block': block, 'streams': streams, 'mode': mode, 'rate': sum(record['bits_per_second'] for record in received)/1e9,
+            'cpu_per_gb': (client_cpu + server_cpu)/(bytes/1e9) if bytes else float('inf'), 'rss': max(client_rss, server_rss)/1024}
+
+
+#FUNCTION: Loads the baseline
+#ARGUMENTS:
+#path: Path of the baseline file
+#Returns the baseline as a dictionary, or None if there is none (or it was written by another version).
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return baseline if baseline.get('version') == BASELINE_VERSION else None
+
+
+#FUNCTION: Prints one row of the results table
+#ARGUMENTS:
+#columns: Values of the columns
+#Uses the same layout as simpleperf: each column is right-aligned with width 20.
+def display_row(columns):
+    print(' '.join('{: >20}'.format(column) for column in columns))
+
+
+#MAIN FUNCTION
+def main():
+    try:
+        sweep = list(itertools.product(args.len.split(','), [int(streams) for streams in args.parallel.split(',')], args.modes.split(',')))
+    except ValueError:
+        sys.exit('Error: -P must be a comma-separated list of integers')
+    if any(mode not in ('thread', 'process') for _, _, mode in sweep):
+        sys.exit('Error: modes must be thread and/or process')
+    if args.time < 1 or args.repeat < 1:
+        sys.exit('Error: time and repeat must be at least 1')
+
+    baseline = load_baseline(args.baseline)
+    previous = {(result['block'], result['streams'], result['mode']): result for result in baseline['results']} if baseline else {}
+    print(f'Benchmarking simpleperf over loopback: {len(sweep)} tests of {args.time} s' + (f', {args.repeat} runs each' if args.repeat > 1 else ''))
+    display_row(HEADINGS)
+    results = []
+    port = args.port
+    for block, streams, mode in sweep:
+        runs = []
+        for _ in range(args.repeat):
+            try:
+                runs.append(run_test(block, streams, mode, port))
+            except (RuntimeError, OSError) as e:
+                sys.exit(f'Error: test with -l {block} -P {streams} ({mode}) failed: {e}')
+            port += 1
+        result = max(runs, key=lambda run: run['rate'])
+        results.append(result)
+        old = previous.get((block, streams, mode))
+        display_row([block, streams, mode, f"{result['rate']:.2f} Gbps", f"{result['cpu_per_gb']:.2f} s", f"{result['rss']:.1f} MB",
+                     f"{100*(result['rate']/old['rate'] - 1):+.1f}%" if old else ''])
+
+    best = max(results, key=lambda result: result['rate'])
+    print(f"\nMaximum throughput: {best['rate']:.2f} Gbps (-l {best['block']} -P {best['streams']}, {best['mode']})")
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'version': BASELINE_VERSION, 'time': args.time, 'results': results}, f, indent=4)
+        print(f'Saved as baseline to {args.baseline}')
+    elif baseline:
+        #Only tests that are in the baseline are compared, so a smaller sweep is compared with the same tests of the baseline
+        common = [result for result in results if (result['block'], result['streams'], result['mode']) in previous]
+        if not common:
+            print('None of the tests are in the baseline')
+            return
+        old = max(previous[(result['block'], result['streams'], result['mode'])]['rate'] for result in common)
+        change = 100*(max(result['rate'] for result in common)/old - 1)
+        print(f"Baseline maximum of the same tests: {old:.2f} Gbps ({change:+.1f}%)")
+        if change < -args.threshold:
+            sys.exit(f'Error: maximum throughput regressed by {-change:.1f}% (threshold: {args.threshold:g}%)')
+
+
+if __name__ == '__main__':
+    main()                                                      #Execution of module begins with main()
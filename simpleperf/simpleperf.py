@@ -15,6 +15,17 @@ import time
 import re
 import _thread as thread
 import threading
+import os
+import tempfile
+import mmap
+import struct
+import random
+import multiprocessing
+import asyncio
+import signal
+import selectors
+import json
+import csv
 
 
 #Create argparse object with program description
@@ -29,10 +40,122 @@ parser.add_argument('-I', '--serverip', help='Takes the server IP address in dec
 parser.add_argument('-t', '--time', help='Total duration in seconds for which data should be generated and sent', type=int, default=25)
 parser.add_argument('-i', '--interval', help='Prints statistics per <value> seconds', type=int)
 parser.add_argument('-P', '--parallel', help='Specifies number of parallel connections to open', type=int, default=1)  
+parser.add_argument('-M', '--multiprocess', help='Runs each parallel connection (-P) in its own process instead of a thread', action='store_true')
+parser.add_argument('-A', '--affinity', help='Pins each parallel connection (client) or worker (server) to its own CPU core', action='store_true')
+parser.add_argument('-w', '--workers', help='Specifies number of server processes accepting connections', type=int, default=1)
+parser.add_argument('-e', '--eventloop', help='Runs the server as an event loop (asyncio) instead of one thread per connection', action='store_true')
+parser.add_argument('--backlog', help='Specifies the length of the queue of pending connections on the server socket', type=int, default=SOMAXCONN)
+parser.add_argument('--max-clients', help='Specifies the maximum number of connections served at once by each event-loop server process (-e)', type=int, default=1000)
 parser.add_argument('-n', '--num', help='Specifies fixed number of bytes to transfer, cannot be used in conjunction with -t', type=str) 
+parser.add_argument('-l', '--length', help='Specifies the size of each block to send (client) or of the read buffer (server) as B, KB or MB (default: 1000B client, 128KB server, max: 1MB)', type=str)
+parser.add_argument('-Z', '--zerocopy', help='Sends data with sendfile() from a zero-filled file instead of from a user-space buffer', action='store_true')
+parser.add_argument('-F', '--file', help='Sends the contents of a file, split evenly over the parallel connections, and reports how fast it can be read from storage', type=str)
+parser.add_argument('--output-dir', help='Writes the data received on each connection to a file in the given directory with large aligned writes, and reports storage throughput (server)', type=str)
+parser.add_argument('--splice', help='Discards received data in the kernel with splice() to /dev/null instead of reading it into simpleperf (server, Linux only)', action='store_true')
+parser.add_argument('-u', '--udp', help='Sends UDP datagrams at a target bitrate (-r) instead of a TCP stream', action='store_true')
+parser.add_argument('-r', '--rate', '--bandwidth', help='Specifies the target bitrate of each stream in bits per second, with optional K, M or G suffix (default: 1M for UDP, unlimited for TCP)', type=str)
+parser.add_argument('--burst', help='Specifies the size of the token bucket which paces each stream to the target bitrate as B, KB or MB (default: 10ms of data, at least one block)', type=str)
+parser.add_argument('--pacing-offload', help='Paces TCP streams in the kernel with SO_MAX_PACING_RATE instead of in simpleperf, including streams sent by the server with -R or --bidir (client, Linux only)', action='store_true')
+parser.add_argument('-R', '--reverse', help='Runs the test in reverse: the server sends and the client receives', action='store_true')
+parser.add_argument('--bidir', help='Runs the test in both directions at once, on a pair of connections per parallel stream', action='store_true')
+parser.add_argument('--tcpinfo', help='Adds kernel TCP statistics (cwnd, RTT, retransmits, bytes in flight, delivery and pacing rate) to each row of a TCP test', action='store_true')
+parser.add_argument('--json', help='Writes results as JSON Lines records (one per interval, per stream and per summary) instead of tables', action='store_true')
+parser.add_argument('--csv', help='Writes results as CSV records (one per interval, per stream and per summary) instead of tables', action='store_true')
+parser.add_argument('-L', '--latency', help='Measures round-trip latency with small request/response probes instead of throughput (TCP, or UDP with -u)', action='store_true')
+parser.add_argument('--probe', help='Measures round-trip latency on an extra connection while the throughput test is running', action='store_true')
+parser.add_argument('--probe-interval', help='Specifies the time in seconds between latency probes (default: 0.1)', type=float, default=0.1)
+parser.add_argument('--rr', help='Measures the rate of request/response transactions on persistent connections instead of throughput', action='store_true')
+parser.add_argument('--crr', help='Measures the rate of transactions which each open a new connection (connect, request, response, close) instead of throughput', action='store_true')
+parser.add_argument('--request-size', help='Specifies the size of each request in a --rr or --crr test as B, KB or MB (default: 1B)', type=str, default='1B')
+parser.add_argument('--response-size', help='Specifies the size of each response in a --rr or --crr test as B, KB or MB (default: 1B)', type=str, default='1B')
+parser.add_argument('--pool', help='Specifies the number of connections each --rr or --crr stream keeps busy at once (default: 1)', type=int, default=1)
 
 #Run the parser
 args = parser.parse_args()
+start_barrier = None                                    #Barrier which lets all parallel client streams start sending together (set in main)
+output_lock = threading.Lock()                          #Keeps records written by different threads from being mixed up
+
+
+#CONTROL PROTOCOL
+#Every test starts with a fixed-length header sent from client to server, and ends with a fixed-length results message sent from server to client.
+#Both are packed with struct in network byte order and start with a magic value and a version number, so that a mismatched peer is detected
+#instead of being misread. Test modes tell the server which kind of test the client is running.
+PROTOCOL_MAGIC = b'SPRF'                                #Identifies simpleperf control messages
+PROTOCOL_VERSION = 6                                    #Must be increased whenever the layout of any control message changes
+MODE_TIME = 0                                           #Send data for a given duration (-t)
+MODE_NUM = 1                                            #Send a given number of bytes (-n)
+MODE_UDP = 2                                            #Send UDP datagrams at a target bitrate (-u), for a duration or a number of bytes
+MODE_LATENCY = 3                                        #Server echoes latency probes on the TCP connection (-L or --probe)
+MODE_UDP_LATENCY = 4                                    #Server echoes latency probes sent as UDP datagrams (-L or --probe with -u)
+MODE_REVERSE = 5                                        #Server sends data to the client, for a duration or a number of bytes (-R or --bidir)
+MODE_RR = 6                                             #Server answers each request with a response on a persistent connection (--rr)
+MODE_CRR = 7                                            #Server answers one request with a response and closes the connection (--crr)
+#Names of the test modes in machine-readable records
+MODE_NAMES = {MODE_TIME: 'time', MODE_NUM: 'num', MODE_UDP: 'udp', MODE_LATENCY: 'latency', MODE_UDP_LATENCY: 'udp_latency', MODE_REVERSE: 'reverse',
+              MODE_RR: 'rr', MODE_CRR: 'crr'}
+STATUS_OK = 0                                           #Test completed
+STATUS_UNSUPPORTED = 1                                  #Server does not support the requested test mode
+FLAG_PACING_OFFLOAD = 1                                 #Header flag: streams sent by the server are paced in the kernel (--pacing-offload)
+#Header: magic, version, test mode, duration (s), byte target, block size, stream ID, parallel-group ID, client start time, target bitrate (bits/s,
+#0 for unlimited) and token-bucket size (bytes, 0 for the default) of streams sent by the server, interval (s) of the receive statistics the
+#server sends back (0 for none), response size (bytes) of transaction tests, and flags (FLAG_*). In transaction tests the block size is the
+#request size.
+HEADER = struct.Struct('!4sBBdQIIIddIdIB')
+#Results: magic, version, status, bytes received, server duration (s), number of intervals that follow the results (and UDP results)
+RESULTS = struct.Struct('!4sBBQdI')
+#Interval: start and stop (s from the start of the test on the server), bytes received in the interval
+INTERVAL = struct.Struct('!ddQ')
+#UDP tests use the TCP connection for control only. The server answers the header with the port of a UDP socket opened for the test, the client
+#sends the number of datagrams it sent once it has finished, and the results message is followed by the receive statistics of the datagrams.
+#UDP ready: UDP port of the server
+UDP_READY = struct.Struct('!H')
+#UDP trailer: number of datagrams sent
+UDP_TRAILER = struct.Struct('!Q')
+#UDP results: datagrams received, datagrams lost, datagrams received out of order, jitter (s)
+UDP_RESULTS = struct.Struct('!QQQd')
+#Every datagram starts with: parallel-group ID, stream ID, sequence number, send time (client time.monotonic())
+DATAGRAM = struct.Struct('!IIQd')
+RECV_BUFFER = 131072                                    #Default size of the read buffer when receiving a TCP stream
+FILE_BLOCK = int(1e6)                                   #Default block size with -F: sendfile() calls are cheap, so blocks are as large as -l allows
+STORAGE_BUFFER = 1 << 20                                #Size of each read of the -F read pass and of each write with --output-dir (a multiple of any disk block size)
+SPLICE_PIPE = 1 << 20                                   #Size of the pipe data is spliced through with --splice
+UDP_GRACE = 0.1                                         #Seconds the server keeps receiving after the client has finished, for datagrams still in flight
+ASYNC_SLICE = 0.001                                     #Seconds a sending connection may run in the event-loop server (-e) before it yields to the others
+#Latency probes have the same layout as datagrams. The server sends every probe back unchanged, so the client can match replies to requests.
+PROBE = DATAGRAM
+PROBE_TIMEOUT = 1.0                                     #Seconds the client waits for the reply to a UDP probe before counting it as lost
+PACER_QUANTUM = 0.01                                    #Default size of the token bucket, in seconds of data at the target bitrate
+SO_MAX_PACING_RATE = 47                                 #Linux socket option, not exported by the socket module
+
+
+#KERNEL TCP STATISTICS
+#Layout of struct tcp_info on Linux, up to and including tcpi_delivery_rate: 8 single-byte fields, 24 32-bit fields (tcpi_rto to tcpi_total_retrans),
+#4 64-bit fields (tcpi_pacing_rate to tcpi_bytes_received), 6 32-bit fields (tcpi_segs_out to tcpi_data_segs_out) and tcpi_delivery_rate.
+TCPI = struct.Struct('=8B24I4Q6IQ')
+TCPI_HEADINGS = ['Cwnd', 'RTT/RTTvar', 'Retrans', 'In-flight', 'Delivery', 'Pacing']
+TCPI_UNLIMITED = 2**64 - 1                              #Pacing rate reported when the socket is not paced
+
+
+#MACHINE-READABLE OUTPUT
+#With --json or --csv, every result is written to standard output as one record, as soon as it is produced. Numbers are not rounded or converted
+#to the -f format: bytes are byte counts, times are in seconds, rates are in bits per second, and round-trip times and TCP RTTs are in microseconds.
+#Timestamps are time.monotonic(), which is the same clock in all processes of a run. CSV records have all fields in the order below, with the
+#fields that do not apply to the record left empty.
+RECORD_FIELDS = ['type', 'side', 'timestamp', 'id', 'direction', 'role', 'start', 'stop', 'bytes', 'seconds', 'bits_per_second', 'partial',
+                 'datagrams', 'lost', 'out_of_order', 'jitter',
+                 'cwnd', 'rtt', 'rttvar', 'retrans', 'in_flight', 'delivery_rate', 'pacing_rate',
+                 'probes', 'transactions', 'transactions_per_second', 'min', 'mean', 'max', 'p50', 'p90', 'p99', 'p99.9',
+                 'mode', 'duration', 'num', 'block_size', 'stream_id', 'group_id', 'start_time', 'parallel', 'rate', 'burst',
+                 'request_size', 'response_size', 'pool']
+
+
+#LATENCY HISTOGRAM
+#Round-trip times are recorded in microseconds in a fixed number of buckets, so memory use does not grow with the length of the test. Values below
+#2^HIST_SUB_BITS each have their own bucket. Above that, every power of two is split into 2^(HIST_SUB_BITS-1) buckets of equal width, so the
+#relative error of a recorded value is at most 1/2^(HIST_SUB_BITS-1) (about 3%) at any magnitude, as in an HDR histogram.
+HIST_SUB_BITS = 6
+HIST_MAX_VALUE = 2**32 - 1                              #Largest value that can be recorded (about 71 minutes); larger values are clamped
+HIST_BUCKETS = (32 - HIST_SUB_BITS + 2) << (HIST_SUB_BITS - 1)     #Number of buckets needed up to HIST_MAX_VALUE
 
 
 #FUNCTION: Check if server port is in the correct range
@@ -59,46 +182,72 @@ def validate_ip(ip_string):
         sys.exit()
 
 
+#FUNCTION: Check if block size is in the correct range
+#ARGUMENTS:
+#length: block size in bytes
+#If the if statement fails, an error message prints to screen and the program is exited so the user can try again.
+def check_length(length):
+    if length < 1 or length > int(1e6):
+        print('Error: block size must be in range 1B-1MB')
+        sys.exit()
+
+
+#FUNCTION: Obtains the file that messages are printed to
+#ARGUMENTS: None
+#With --json or --csv, standard output only carries records, so messages and errors go to standard error instead.
+def get_message_file():
+    return sys.stderr if args.json or args.csv else sys.stdout
+
+
 #FUNCTION: Prints message to screen between two dashed lines 
 #ARGUMENTS:
 #msg: Message to be enclosed
 #The function prints a row equal in length to the length of the message, then prints the message, then prints another dashed line of equal length.
 def print_msg(msg):
-    print('-'*len(msg))
-    print(msg)
-    print('-'*len(msg))
+    file = get_message_file()
+    print('-'*len(msg), file=file)
+    print(msg, file=file)
+    print('-'*len(msg), file=file)
 
 
 #FUNCTION: Generates an empty table with the correct headings (client and server tables have different headings)
-#ARGUMENTS: None
-#The function checks which mode it is being called from and returns an empty table with just the appropriate headings in the first row.
+#ARGUMENTS:
+#udp: True if the table holds the results of a UDP test, which have extra columns for the receive statistics of the datagrams
+#sending: True if the table holds the results of the sending side. By default this is the client, but in reverse mode (-R) the server sends.
+#tcpinfo: True if the table has extra columns for the kernel TCP statistics of each connection (--tcpinfo)
+#roles: True if the table has both sender and receiver rows, with a Role column to tell them apart
+#The function checks which side of the test it is being called from and returns an empty table with just the appropriate headings in the first row.
 #Data rows are appended in a separate function. The table is only printed when a call is explicitly made, after all data rows are added.
-def generate_table():
-    if args.server:
-        return [
-            ['ID', 'Interval', 'Received', 'Rate']
-        ]
-
+def generate_table(udp=False, sending=None, tcpinfo=False, roles=False):
+    if sending is None:
+        sending = not args.server
+    if not sending:
+        headings = ['ID', 'Interval', 'Received', 'Rate']
     else:
-        return [
-            ['ID', 'Interval', 'Transfer', 'Bandwidth']
-        ]
+        headings = ['ID', 'Interval', 'Transfer', 'Bandwidth']
+    if roles:
+        headings += ['Role']
+    if udp:
+        headings += ['Jitter', 'Lost/Total', 'Out-of-order']
+    if tcpinfo:
+        headings += TCPI_HEADINGS
+    return [headings]
     
 
 #FUNCTION: Generates a row of data based on values provided by the program after a successful transmission
 #ARGUMENTS:
 #bytes: Number of bytes sent/received (depends on mode)
 #duration: In client mode, this will be the -t value. In server mode, this is the difference in the actual stop/start times recorded by the server.
-#ip: In client mode: server IP address. In server mode: client IP address
-#port: In client mode: server port. In server mode: client's remote port
+#id: Label for the ID column. In client mode: server IP:port (prefixed with the stream number if -P is greater than 1, or SUM for the total).
+#In server mode: client IP:remote port
 #start: Recorded start time
 #stop: Recoded stop time
-#table: The empty table which has been created above and which the data row should be appended to
+#table: The empty table which has been created above and which the data row should be appended to (None if the row should only be returned)
 #The function first converts the number of bytes into the format specified by the user with -f flag (X). The rate is then calculated by dividing the 
 #number of bytes by duration and converting into Mb (Y). These calculated values, as well as the other args passed into the function, are then used to
-#populate the data row. If the -i flag has been activated in client mode, this row is returned by itself, so that a new row can be printed to screen 
-#after each interval; otherwise the row is appended to the table so the table can be printed in its entirety.
-def generate_row(bytes, duration, ip, port, start, stop, table):
+#populate the data row. The row is always returned, so that a new row can be printed to screen after each interval with -i; if a table is given,
+#the row is also appended to the table so the table can be printed in its entirety.
+def generate_row(bytes, duration, id, start, stop, table):
     if args.format == 'MB':
         X = bytes/1e6
     elif args.format == 'KB':
@@ -106,22 +255,174 @@ def generate_row(bytes, duration, ip, port, start, stop, table):
     else:
         X = bytes
     
-    Y = (bytes/duration)*8e-6
+    Y = (bytes/duration)*8e-6 if duration > 0 else 0
 
-    if args.interval:
-        return [f'{ip}:{port}', f'{start:.1f} - {stop:.1f}', f'{round(X)} {args.format}', f'{Y:.2f} Mbps']
+    row = [id, f'{start:.1f} - {stop:.1f}', f'{round(X)} {args.format}', f'{Y:.2f} Mbps']
+    if table is not None:
+        table.append(row)
+    return row
+
+
+#FUNCTION: Generates the extra columns of a UDP results row
+#ARGUMENTS:
+#udp: Dictionary with the receive statistics of the datagrams (datagrams received, lost, out of order, and jitter in seconds)
+#Returns the jitter in ms, lost/total datagrams with the loss percentage, and the number of datagrams received out of order, ready to be added to a row.
+def generate_udp_columns(udp):
+    total = udp['datagrams'] + udp['lost']
+    loss = 100*udp['lost']/total if total else 0
+    return [f"{udp['jitter']*1e3:.3f} ms", f"{udp['lost']}/{total} ({loss:.2g}%)", f"{udp['out_of_order']}"]
+
+
+#FUNCTION: Reads the kernel TCP statistics of a connection (only used in conjunction with --tcpinfo)
+#ARGUMENTS:
+#sock: A connected TCP socket
+#One getsockopt() call copies struct tcp_info out of the kernel, so the statistics can be sampled at every interval without slowing down the test.
+#Older kernels return a shorter struct, in which case the missing fields are read as 0. Returns a dictionary with the congestion window (segments),
+#smoothed RTT and RTT variation (microseconds), total number of retransmitted segments, bytes in flight, and delivery and pacing rate (bytes per
+#second), or None if the statistics cannot be read (for example because the connection is already closed).
+def read_tcp_info(sock):
+    try:
+        raw = sock.getsockopt(IPPROTO_TCP, TCP_INFO, TCPI.size)
+    except OSError:
+        return None
+    fields = TCPI.unpack(raw.ljust(TCPI.size, b'\0'))
+    snd_mss, unacked, sacked, lost, retrans = fields[10], fields[12], fields[13], fields[14], fields[15]
+    return {'cwnd': fields[26], 'rtt': fields[23], 'rttvar': fields[24], 'retrans': fields[31],
+            'in_flight': max(unacked - sacked - lost + retrans, 0)*snd_mss,   #Same calculation as tcp_packets_in_flight() in the kernel
+            'delivery_rate': fields[42], 'pacing_rate': fields[32]}
+
+
+#FUNCTION: Generates the extra columns of a row with kernel TCP statistics
+#ARGUMENTS:
+#info: Dictionary returned by read_tcp_info() (None if the statistics could not be read)
+#Returns the congestion window, RTT/RTT variation in ms, retransmits, bytes in flight (in the -f format), and delivery and pacing rate in Mbps.
+def generate_tcpinfo_columns(info):
+    if info is None:
+        return ['-']*len(TCPI_HEADINGS)
+    if args.format == 'MB':
+        in_flight = f"{info['in_flight']/1e6:.2f} MB"
+    elif args.format == 'KB':
+        in_flight = f"{info['in_flight']/1e3:.0f} KB"
     else:
-        table.append(
-            [f'{ip}:{port}', f'{start:.1f} - {stop:.1f}', f'{round(X)} {args.format}', f'{Y:.2f} Mbps']
-        )
+        in_flight = f"{info['in_flight']} B"
+    pacing = '-' if info['pacing_rate'] == TCPI_UNLIMITED else f"{info['pacing_rate']*8e-6:.2f} Mbps"
+    return [f"{info['cwnd']}", f"{info['rtt']/1e3:.2f}/{info['rttvar']/1e3:.2f} ms", f"{info['retrans']}", in_flight,
+            f"{info['delivery_rate']*8e-6:.2f} Mbps", pacing]
+
+
+#FUNCTION: Creates an empty latency histogram
+#ARGUMENTS: None
+#Returns a dictionary with the bucket counts and the exact count, sum, minimum and maximum of the recorded values (in microseconds).
+def new_histogram():
+    return {'counts': [0]*HIST_BUCKETS, 'count': 0, 'sum': 0, 'min': HIST_MAX_VALUE, 'max': 0}
+
+
+#FUNCTION: Finds the bucket of a value in a latency histogram
+#ARGUMENTS:
+#value: Value in microseconds (0 to HIST_MAX_VALUE)
+#Small values are their own bucket. For larger values, the value is shifted right until it has HIST_SUB_BITS bits, and the number of shifts selects
+#the group of buckets while the remaining bits select the bucket within the group.
+def hist_bucket(value):
+    shift = max(value.bit_length() - HIST_SUB_BITS, 0)
+    return (shift << (HIST_SUB_BITS - 1)) + (value >> shift)
+
+
+#FUNCTION: Finds the range of values in a bucket of a latency histogram
+#ARGUMENTS:
+#bucket: Index of the bucket
+#Reverses hist_bucket(). Returns the lowest value in the bucket and the width of the bucket.
+def hist_bucket_range(bucket):
+    half = 1 << (HIST_SUB_BITS - 1)
+    if bucket < 2*half:
+        return bucket, 1
+    shift = bucket//half - 1
+    return (bucket - shift*half) << shift, 1 << shift
+
+
+#FUNCTION: Records a value in a latency histogram
+#ARGUMENTS:
+#hist: Histogram created by new_histogram()
+#value: Value in microseconds
+def hist_record(hist, value):
+    value = min(max(int(value), 0), HIST_MAX_VALUE)
+    hist['counts'][hist_bucket(value)] += 1
+    hist['count'] += 1
+    hist['sum'] += value
+    hist['min'] = min(hist['min'], value)
+    hist['max'] = max(hist['max'], value)
+
+
+#FUNCTION: Adds the values of one latency histogram to another
+#ARGUMENTS:
+#hist: Histogram which is updated
+#other: Histogram which is added
+def hist_merge(hist, other):
+    hist['counts'] = [a + b for a, b in zip(hist['counts'], other['counts'])]
+    hist['count'] += other['count']
+    hist['sum'] += other['sum']
+    hist['min'] = min(hist['min'], other['min'])
+    hist['max'] = max(hist['max'], other['max'])
+
+
+#FUNCTION: Obtains a percentile from a latency histogram
+#ARGUMENTS:
+#hist: Histogram created by new_histogram()
+#percentile: Percentile between 0 and 100
+#Walks the buckets until the requested share of values has been counted, and returns the middle of that bucket, limited to the exact minimum and
+#maximum. Returns 0 if the histogram is empty.
+def hist_percentile(hist, percentile):
+    if hist['count'] == 0:
+        return 0
+    target = max(1, -(-hist['count']*percentile//100))  #Number of values at or below the percentile (rounded up)
+    seen = 0
+    for bucket, count in enumerate(hist['counts']):
+        seen += count
+        if seen >= target:
+            low, width = hist_bucket_range(bucket)
+            return min(max(low + (width - 1)/2, hist['min']), hist['max'])
+    return hist['max']
+
+
+#FUNCTION: Generates an empty latency table with the correct headings
+#ARGUMENTS: None
+def generate_latency_table():
+    return [
+        ['ID', 'Probes', 'Min/Avg/Max', 'p50', 'p90', 'p99', 'p99.9']
+    ]
+
+
+#FUNCTION: Generates a row of latency data and appends it to a latency table
+#ARGUMENTS:
+#hist: Histogram with the round-trip times of the stream in microseconds
+#lost: Number of probes without a reply
+#id: Label for the ID column
+#table: The latency table which the row should be appended to
+#All times are shown in ms.
+def generate_latency_row(hist, lost, id, table):
+    row = [id, f"{hist['count']} ({lost} lost)"] + generate_hist_columns(hist)
+    table.append(row)
+    return row
+
+
+#FUNCTION: Generates the round-trip time columns of a latency or transaction row
+#ARGUMENTS:
+#hist: Histogram with the round-trip times in microseconds
+#Returns the min/avg/max and the p50, p90, p99 and p99.9 percentiles in ms, ready to be added to a row.
+def generate_hist_columns(hist):
+    avg = hist['sum']/hist['count'] if hist['count'] else 0
+    low = hist['min'] if hist['count'] else 0
+    return [f"{low/1e3:.2f}/{avg/1e3:.2f}/{hist['max']/1e3:.2f} ms"] + [f'{hist_percentile(hist, percentile)/1e3:.3f} ms' for percentile in (50, 90, 99, 99.9)]
 
 
 #FUNCTION: Prints a new row to screen (only used in conjunction with -i)
 #ARGUMENTS:
 #row: The row that has been generated above
-#Prints the row to screen with the following formatting: each column is right-aligned with width 20
+#Prints the row to screen with the following formatting: each column is right-aligned with width 20. Nothing is printed with --json or --csv,
+#where the results are written as records instead.
 def display_row(row):
-    print("{: >20} {: >20} {: >20} {: >20}".format(*row))
+    if args.json or args.csv:
+        return
+    print(' '.join('{: >20}'.format(column) for column in row))
 
 
 #FUNCTION: Prints a complete table to screen 
@@ -129,9 +430,64 @@ def display_row(row):
 #table: The empty table that was generated above and any rows that have been appended to it
 #Prints the table to screen with the following formatting: for each row, each column is right-aligned with width 20
 def display_results(table):
+    if args.json or args.csv:
+        return
     print('\n')
     for row in table:
-        print("{: >20} {: >20} {: >20} {: >20}".format(*row))
+        display_row(row)
+
+
+#FUNCTION: Writes one machine-readable record (only used in conjunction with --json or --csv)
+#ARGUMENTS:
+#record: Dictionary with the fields of the record (see RECORD_FIELDS)
+#The side (client or server) and a timestamp are added if the record does not have them. The record is written as one line and flushed at once,
+#so that a long test can be followed live; the lock keeps lines from threads of the same process whole.
+def emit_record(record):
+    record.setdefault('side', 'server' if args.server else 'client')
+    record.setdefault('timestamp', time.monotonic())
+    with output_lock:
+        if args.json:
+            sys.stdout.write(json.dumps(record) + '\n')
+        else:
+            csv.DictWriter(sys.stdout, RECORD_FIELDS, extrasaction='ignore').writerow(record)
+        sys.stdout.flush()
+
+
+#FUNCTION: Prints the storage throughput of a file transfer (only used in conjunction with -F or --output-dir)
+#ARGUMENTS:
+#id: Label for the ID column (the file name on the client, client IP:remote port on the server)
+#bytes: Number of bytes read from or written to storage
+#seconds: Time spent reading or writing
+#direction: 'read' for the client's read pass over the file, 'write' for data the server writes to a file
+#The storage throughput is shown in a table of its own under the network results, so that a slow disk can be told apart from a slow network. The
+#time is the time spent in storage calls only, so the Time column takes the place of the interval. With --json or --csv, a storage record is written.
+def display_storage_results(id, bytes, seconds, direction):
+    if args.json or args.csv:
+        emit_result('storage', id, bytes, seconds, 0, seconds, direction=direction)
+        return
+    table = [['ID', 'Time', 'Read' if direction == 'read' else 'Written', 'Storage rate']]
+    row = generate_row(bytes, seconds, id, 0, seconds, table)
+    row[1] = f'{seconds:.2f} s'
+    display_results(table)
+
+
+#FUNCTION: Writes a throughput record (only used in conjunction with --json or --csv)
+#ARGUMENTS:
+#type: 'interval', 'stream' (final result of one connection) or 'summary' (SUM of all connections in one direction)
+#id: Label of the stream, as in the ID column
+#bytes: Number of bytes sent/received
+#seconds: Time over which the bytes were sent/received
+#start, stop: Position of the interval in the test (seconds), as in the Interval column
+#udp: Receive statistics of the datagrams in a UDP test (None for TCP tests)
+#tcpinfo: Kernel TCP statistics from read_tcp_info() (None if --tcpinfo is not selected)
+#fields: Any other fields of the record
+def emit_result(type, id, bytes, seconds, start, stop, udp=None, tcpinfo=None, **fields):
+    record = {'type': type, 'timestamp': time.monotonic(), 'id': id, 'start': start, 'stop': stop, 'bytes': bytes, 'seconds': seconds,
+              'bits_per_second': bytes*8/seconds if seconds > 0 else 0}
+    record.update(udp or {})
+    record.update(tcpinfo or {})
+    record.update(fields)
+    emit_record(record)
  
 
 #FUNCTION: Obtains the number of bytes to send from the -n input value
@@ -151,126 +507,2043 @@ def get_bytes_to_send(num):
         return(int(num_split[1]))
 
 
+#FUNCTION: Obtains the block size from the -l input value
+#ARGUMENTS: None
+#-l takes a string in the same format as -n, so the value is converted with get_bytes_to_send(). If -l is not given, the default is 1000 bytes
+#per send in client mode, 1470 bytes per datagram in UDP mode, 1MB per send with -F, and 128KB per read in server mode (a large read size means fewer calls per byte
+#received). The block size is checked before it is returned.
+def get_block_size():
+    if args.length is None:
+        if args.server:
+            return RECV_BUFFER
+        if args.file is not None:
+            return FILE_BLOCK
+        return 1470 if args.udp else 1000
+    length = get_bytes_to_send(args.length)
+    check_length(length)
+    if args.udp:
+        check_datagram_size(length)
+    return length
+
+
+#FUNCTION: Obtains the size of requests or responses from the --request-size or --response-size input value
+#ARGUMENTS:
+#size: The string value of --request-size or --response-size
+#Takes a string in the same format as -n and -l, and checks it with check_length() before it is returned.
+def get_message_size(size):
+    length = get_bytes_to_send(size)
+    check_length(length)
+    return length
+
+
+#FUNCTION: Check if datagram size is in the correct range (only used in conjunction with -u)
+#ARGUMENTS:
+#length: datagram size in bytes
+#Each datagram must have room for the datagram header and fit in one IPv4 UDP datagram. If the if statement fails, an error message prints to
+#screen and the program is exited so the user can try again.
+def check_datagram_size(length):
+    if length < DATAGRAM.size or length > 65507:
+        print(f'Error: datagram size must be in range {DATAGRAM.size}B-65507B')
+        sys.exit()
+
+
+#FUNCTION: Obtains the target bitrate in bits per second from the -r input value
+#ARGUMENTS:
+#rate: The string value of -r input in client mode
+#-r takes a number followed by an optional K, M or G suffix (powers of 1000). If the value cannot be read, an error message prints to screen and the
+#program is exited so the user can try again.
+def get_rate(rate):
+    rate_split = re.fullmatch(r'(\d+(?:\.\d+)?)([KMG]?)', rate)
+    if rate_split is None or float(rate_split[1]) <= 0:
+        print('Error: rate must be a positive number with optional K, M or G suffix, e.g. 10M')
+        sys.exit()
+    return float(rate_split[1]) * {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9}[rate_split[2]]
+
+
+#FUNCTION: Obtains the target bitrate of each stream
+#ARGUMENTS: None
+#Returns the -r value in bits per second, or if -r is not given, 1 Mbps for UDP tests and None (send as fast as possible) for TCP tests.
+def get_target_rate():
+    if args.rate is None:
+        return 1e6 if args.udp else None
+    return get_rate(args.rate)
+
+
+#FUNCTION: Obtains the token-bucket size from the --burst input value
+#ARGUMENTS: None
+#--burst takes a string in the same format as -n. Returns the size in bytes, or None if --burst is not given (the pacer then picks the default).
+#The size is sent to the server in a 32-bit header field, so it must be below 4 GiB.
+def get_burst():
+    if args.burst is None:
+        return None
+    burst = get_bytes_to_send(args.burst)
+    if burst <= 0 or burst > 2**32 - 1:
+        print(f'Error: burst size must be in range 1B-{2**32 - 1}B')
+        sys.exit()
+    return burst
+
+
+#FUNCTION: Creates a token-bucket pacer
+#ARGUMENTS:
+#rate: Target bitrate in bits per second
+#block_size: Size in bytes of each block that is sent
+#burst: Size of the bucket in bytes (None for PACER_QUANTUM seconds of data). The bucket always holds at least one block.
+#smooth: True to send each block as soon as there are enough tokens for it (UDP, where bursts of datagrams overflow queues); False to sleep until
+#the bucket is half full and then send the blocks back-to-back, so a slow TCP stream wakes up about 200 times a second instead of once per block
+#Tokens (bytes) are added at the target rate as time passes, up to the size of the bucket. Because tokens are counted from the clock rather than
+#from the length of each sleep, a sleep that lasts too long is made up for by the following blocks, as long as the bucket has room for the
+#tokens that built up in the meantime. Returns the state of the pacer in a dictionary, used by pacer_wait().
+def new_pacer(rate, block_size, burst=None, smooth=False):
+    rate = rate/8                                       #Bytes per second
+    burst = max(burst or rate*PACER_QUANTUM, block_size)
+    return {'rate': rate, 'burst': burst, 'tokens': block_size, 'last': time.monotonic(),
+            'wake': block_size if smooth else max(burst/2, block_size)}
+
+
+#FUNCTION: Asks the pacer if a block may be sent
+#ARGUMENTS:
+#pacer: Dictionary returned by new_pacer()
+#n: Size of the block in bytes
+#If there are enough tokens, the tokens for the block are taken and 0 is returned, so the block can be sent. Otherwise nothing is taken and the
+#number of seconds to sleep before asking again is returned. The caller does the sleeping, so that it can also wake up for the end of the test.
+def pacer_wait(pacer, n):
+    now = time.monotonic()
+    pacer['tokens'] = min(pacer['tokens'] + (now - pacer['last'])*pacer['rate'], pacer['burst'])    #Add tokens for the time since the last call
+    pacer['last'] = now
+    if pacer['tokens'] >= n:
+        pacer['tokens'] -= n
+        return 0
+    return (max(pacer['wake'], n) - pacer['tokens'])/pacer['rate']
+
+
+#FUNCTION: Sets up pacing for a TCP stream
+#ARGUMENTS:
+#sock: A connected TCP socket
+#rate: Target bitrate in bits per second (None to send as fast as possible)
+#block_size: Size in bytes of each block that is sent
+#burst: Size of the token bucket in bytes (None for the default)
+#offload: True to pace in the kernel (--pacing-offload on the client, which the server learns from the header for streams it sends)
+#With offload, the rate is handed to the kernel with SO_MAX_PACING_RATE, which spaces out the packets of the socket itself (in bytes per second,
+#limited to 32 bits on older kernels). If that fails, or without offload, a token-bucket pacer is returned. Returns None if the stream is not
+#paced in user space.
+def get_pacer(sock, rate, block_size, burst, offload=False):
+    if rate is None:
+        return None
+    if offload:
+        try:
+            sock.setsockopt(SOL_SOCKET, SO_MAX_PACING_RATE, min(int(rate/8), 2**32 - 1))
+            return None
+        except OSError as e:
+            print(f'Warning: SO_MAX_PACING_RATE failed ({e}), pacing in simpleperf instead', file=get_message_file())
+    return new_pacer(rate, block_size, burst)
+
+
+#FUNCTION: Prepares the send engine for a client socket
+#ARGUMENTS:
+#clientSocket: A client-side socket with an established connection to the server
+#block_size: Size in bytes of each block that is sent
+#file: Path of a file whose contents are sent (-F) and the offset to start at, or None to send zeroes
+#Returns a function send_block(n) which sends n bytes (at most block_size) and returns the number of bytes sent. Only one buffer of block_size bytes is
+#ever allocated: by default it is a zero-filled bytearray that is sent through a memoryview, so neither the full block nor a shortened last block is copied.
+#If -Z is selected, the buffer is a sparse zero-filled temporary file instead, and blocks are sent with os.sendfile() so the data never passes through
+#user space. The temporary file is attached to the returned function so that it stays open for as long as the function is in use.
+#With a file, each block is the next part of the file. Blocks are sent with os.sendfile() where available, and otherwise from a read-only memory map
+#of the file, which the socket reads straight from the page cache.
+def get_sender(clientSocket, block_size, file=None):
+    if file is not None:
+        path, position = file
+        source = open(path, 'rb')
+        out_fd = clientSocket.fileno()
+        offset = [position]                             #Position of the next block in the file
+        if hasattr(os, 'sendfile'):
+            in_fd = source.fileno()
+
+            def send_block(n=block_size):
+                end = offset[0] + n
+                #sendfile() may send fewer bytes than requested, so repeat until the whole block is sent
+                while offset[0] < end:
+                    sent = os.sendfile(out_fd, in_fd, offset[0], end - offset[0])
+                    if sent == 0:
+                        raise ValueError(f'{path} became shorter during the test')
+                    offset[0] += sent
+                return n
+        else:
+            view = memoryview(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+
+            def send_block(n=block_size):
+                clientSocket.sendall(view[offset[0]:offset[0] + n])    #Slicing a memoryview of the map does not copy the data
+                offset[0] += n
+                return n
+
+        send_block.source = source                      #Keep a reference to the file so it is not closed while sending
+    elif args.zerocopy:
+        zero_file = tempfile.TemporaryFile()            #Unnamed temporary file that is removed when closed
+        zero_file.truncate(block_size)                  #Extend file to block_size bytes (reads back as zeroes without using disk space)
+        in_fd = zero_file.fileno()
+        out_fd = clientSocket.fileno()
+
+        def send_block(n=block_size):
+            offset = 0
+            #sendfile() may send fewer bytes than requested, so repeat until the whole block is sent
+            while offset < n:
+                offset += os.sendfile(out_fd, in_fd, offset, n - offset)
+            return n
+
+        send_block.source = zero_file                   #Keep a reference to the file so it is not closed while sending
+    else:
+        view = memoryview(bytearray(block_size))        #Preallocated zero-filled buffer, reused for every block
+
+        def send_block(n=block_size):
+            clientSocket.sendall(view if n == block_size else view[:n])    #Slicing a memoryview does not copy the buffer
+            return n
+
+    return send_block
+
+
+#FUNCTION: Receives a message of an exact length
+#ARGUMENTS:
+#sock: A connected socket
+#size: Number of bytes to receive
+#recv() may return fewer bytes than requested, so the function keeps reading into a buffer of the requested size until it is full. If the peer
+#closes the connection before the whole message has arrived, a ConnectionError is raised. Returns the message as a bytearray.
+def recv_exact(sock, size):
+    message = bytearray(size)                           #Buffer which holds exactly one message
+    view = memoryview(message)
+    received = 0                                        #Initialize counter for number of bytes received so far
+    while received < size:
+        n = sock.recv_into(view[received:])             #Read the remaining part of the message into the buffer
+        if n == 0:
+            raise ConnectionError('connection closed before the whole message was received')
+        received += n
+    return message
+
+
+#FUNCTION: Sends the control header for a test from client to server
+#ARGUMENTS:
+#clientSocket: A client-side socket with an established connection to the server
+#mode: Test mode (one of the MODE_ constants)
+#block_size: Size in bytes of each block that is sent
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#start_time: Recorded start time
+#num: Byte target of this connection (None to take it from -n)
+#The header carries all test parameters in one fixed-length message, so the server never needs to parse strings.
+def send_header(clientSocket, mode, block_size, stream_id, group_id, start_time, num=None):
+    clientSocket.sendall(pack_header(mode, block_size, stream_id, group_id, start_time, num))
+
+
+#FUNCTION: Packs the control header for a test on the client
+#ARGUMENTS:
+#mode, block_size, stream_id, group_id, start_time, num: As for send_header()
+#The other fields are taken from the command line. Returns the packed header, so that it can also be sent together with other data (--crr).
+def pack_header(mode, block_size, stream_id, group_id, start_time, num=None):
+    if num is not None:
+        bytes_to_send = num
+    else:
+        bytes_to_send = get_bytes_to_send(args.num) if args.num is not None else 0
+    rate = get_target_rate() or 0                       #Target bitrate of a reverse stream (0 for unlimited)
+    response_size = get_message_size(args.response_size) if args.rr or args.crr else 0
+    flags = FLAG_PACING_OFFLOAD if args.pacing_offload else 0
+    return HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, mode, args.time, bytes_to_send, block_size, stream_id, group_id, start_time,
+                       rate, get_burst() or 0, args.interval or 0, response_size, flags)
+
+
+#FUNCTION: Unpacks a control header
+#ARGUMENTS:
+#message: Exactly HEADER.size bytes received from the client
+#If the magic value or version does not match, a ValueError is raised so the connection can be dropped. Returns the test parameters in a dictionary.
+def parse_header(message):
+    magic, version, mode, duration, num, block_size, stream_id, group_id, start_time, rate, burst, interval, response_size, flags = HEADER.unpack(message)
+    if magic != PROTOCOL_MAGIC or version != PROTOCOL_VERSION:
+        raise ValueError(f'unsupported control header (magic {magic!r}, version {version})')
+    return {'mode': mode, 'duration': duration, 'num': num, 'block_size': block_size,
+            'stream_id': stream_id, 'group_id': group_id, 'start_time': start_time, 'rate': rate or None, 'burst': burst or None,
+            'interval': interval, 'response_size': response_size, 'pacing_offload': bool(flags & FLAG_PACING_OFFLOAD)}
+
+
+#FUNCTION: Checks that the server can run the test described by a control header
+#ARGUMENTS:
+#header: Test parameters returned by parse_header()
+#The server sizes its buffers and loops from the header, so a mode it does not know, or a block, datagram or response size the client itself would
+#not allow, is rejected before any handler runs (a block size of 0 would make an --rr or -R server send forever without reading). A ValueError
+#with the reason is raised, so the server can answer with STATUS_UNSUPPORTED and drop the connection.
+def check_header(header):
+    if header['mode'] not in MODE_NAMES:
+        raise ValueError(f"unknown test mode {header['mode']}")
+    if header['mode'] == MODE_UDP:
+        low, high = DATAGRAM.size, 65507                #Same range as check_datagram_size()
+    else:
+        low, high = 1, int(1e6)                         #Same range as check_length()
+    if not low <= header['block_size'] <= high:
+        raise ValueError(f"block size {header['block_size']} is not in range {low}B-{high}B")
+    if header['mode'] in (MODE_RR, MODE_CRR) and not 1 <= header['response_size'] <= int(1e6):
+        raise ValueError(f"response size {header['response_size']} is not in range 1B-1000000B")
+
+
+#FUNCTION: Packs the results message sent from server to client at the end of a test
+#ARGUMENTS:
+#status: STATUS_OK, or an error status if the test could not be run
+#bytes_received: Number of bytes received by the server
+#server_duration: Duration of the test measured by the server
+#udp: Receive statistics of the datagrams in a UDP test, which are packed after the results (None for TCP tests)
+#intervals: List of (start, stop, bytes received) for each interval, which are packed last (empty if the client has not selected -i)
+def pack_results(status, bytes_received=0, server_duration=0, udp=None, intervals=()):
+    message = RESULTS.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, status, bytes_received, server_duration, len(intervals))
+    if udp is not None:
+        message += UDP_RESULTS.pack(udp['datagrams'], udp['lost'], udp['out_of_order'], udp['jitter'])
+    message += b''.join(INTERVAL.pack(*interval) for interval in intervals)
+    return message
+
+
+#FUNCTION: Receives the results message at the end of a test on the client
+#ARGUMENTS:
+#clientSocket: A client-side socket with an established connection to the server
+#udp: True if the test is a UDP test, in which case the receive statistics of the datagrams are read as well
+#Waits for the server's results message, which also acts as the acknowledgement that the server has received all data. If the magic value or
+#version does not match, or the server reports an error, a ValueError is raised. Returns the results in a dictionary, with the server's receive
+#statistics per interval as a list of (start, stop, bytes) under 'intervals'.
+def recv_results(clientSocket, udp=False):
+    magic, version, status, bytes_received, duration, count = RESULTS.unpack(recv_exact(clientSocket, RESULTS.size))
+    if magic != PROTOCOL_MAGIC or version != PROTOCOL_VERSION:
+        raise ValueError(f'unsupported results message (magic {magic!r}, version {version})')
+    if status != STATUS_OK:
+        raise ValueError(f'server could not run the test (status {status})')
+    results = {'bytes': bytes_received, 'duration': duration}
+    if udp:
+        datagrams, lost, out_of_order, jitter = UDP_RESULTS.unpack(recv_exact(clientSocket, UDP_RESULTS.size))
+        results['udp'] = {'datagrams': datagrams, 'lost': lost, 'out_of_order': out_of_order, 'jitter': jitter}
+    results['intervals'] = list(INTERVAL.iter_unpack(recv_exact(clientSocket, count*INTERVAL.size))) if count else []
+    return results
+
+
+#FUNCTION: Prints one interval row
+#ARGUMENTS:
+#sample: Function which returns the number of bytes sent/received so far
+#id: Label for the ID column
+#start_time: Time the test started (time.monotonic())
+#last: List holding the time (time.monotonic()), byte count and position in the test (seconds) at the end of the previous interval, which is updated
+#stop: Position in the test (seconds) at the end of this interval
+#sock: Socket whose kernel TCP statistics are added to the row (None if --tcpinfo is not selected)
+#fields: Other fields of the interval record, such as the stream and group ID, direction and role (only used in conjunction with --json or --csv)
+#The rate is calculated over the actual time since the previous sample, while the interval column shows the nominal interval boundaries. With
+#--json or --csv, an interval record is written instead of the row.
+def display_interval(sample, id, start_time, last, stop, sock=None, fields=None):
+    now = time.monotonic()
+    bytes = sample()
+    info = read_tcp_info(sock) if sock is not None else None    #Sample the kernel TCP statistics at the end of the interval
+    if args.json or args.csv:
+        emit_result('interval', id, bytes - last[1], now - last[0], last[2], stop, tcpinfo=info, timestamp=now, **(fields or {}))
+    else:
+        row = generate_row(bytes - last[1], now - last[0], id, last[2], stop, None)
+        if sock is not None:
+            row += generate_tcpinfo_columns(info)
+        display_row(row)
+    last[:] = [now, bytes, stop]
+
+
+#FUNCTION: Timer which ends a test after -t seconds and prints a row after each -i interval
+#ARGUMENTS:
+#sample: Function which returns the number of bytes sent/received so far
+#id: Label for the ID column
+#start_time: Time the test started (time.monotonic())
+#done: threading.Event which is set when the test is over, either by the timer (after duration) or by the thread doing the test
+#duration: Length of the test in seconds (None if the test ends when the sending/receiving thread sets done)
+#sock: Socket whose kernel TCP statistics are added to each row (None if --tcpinfo is not selected)
+#fields: Other fields of the interval records (see display_interval())
+#The timer sleeps until the next deadline, which is always calculated from start_time, so interval boundaries do not drift however long printing
+#a row takes. At each boundary it samples the byte counter and prints a row; at the end of the test it sets done and prints a row for the last,
+#possibly shorter, interval. This keeps all clock calls and printing out of the send/receive loop, which only has to check done.
+def run_timer(sample, id, start_time, done, duration=None, sock=None, fields=None):
+    interval = args.interval
+    end = start_time + duration if duration is not None else float('inf')     #Time the test should stop
+    last = [start_time, 0, 0]                           #Time, byte count and position at the end of the previous interval
+    k = 1                                               #Number of the next interval boundary
+    while True:
+        boundary = min(start_time + k*interval, end) if interval else end
+        #Sleep until the deadline, or until the sending/receiving thread ends the test
+        if done.wait(max(boundary - time.monotonic(), 0)):
+            stop = time.monotonic() - start_time        #Test ended before the deadline
+        else:
+            stop = boundary - start_time
+            if boundary >= end:
+                done.set()                              #Duration reached - tell the sending thread to stop
+        finished = done.is_set()
+        #Print a row for the interval (the last interval is skipped if it is too short to give a meaningful rate)
+        if interval and (not finished or stop - last[2] >= 0.01*interval):
+            display_interval(sample, id, start_time, last, stop, sock, fields)
+        if finished:
+            return
+        k += 1
+
+
+#FUNCTION: Starts the timer for a test in its own thread
+#ARGUMENTS:
+#sample, id, start_time, done, duration, sock, fields: See run_timer()
+#Returns the thread, or None if there is nothing for the timer to do (no -i and no duration).
+def start_timer(sample, id, start_time, done, duration=None, sock=None, fields=None):
+    if args.interval is None and duration is None:
+        return None
+    timer = threading.Thread(target=run_timer, args=(sample, id, start_time, done, duration, sock, fields), daemon=True)
+    timer.start()
+    return timer
+
+
+#FUNCTION: Sends a TCP stream of data
+#ARGUMENTS:
+#sock: A connected socket
+#block_size: Size in bytes of each block that is sent
+#bytes_to_send: Number of bytes to send (None to send for a given duration)
+#duration: Number of seconds to send for if bytes_to_send is None
+#id: Label for the ID column of interval rows
+#rate: Target bitrate in bits per second (None to send as fast as possible)
+#burst: Size of the token bucket in bytes (None for the default)
+#file: Path and start offset of the file to send with -F (None to send zeroes)
+#fields: Other fields of the interval records (see display_interval())
+#pacing_offload: True to pace the stream in the kernel (see get_pacer())
+#Used by the client in normal mode and by the server in reverse mode. With a byte target, blocks are sent until the target is reached; otherwise
+#blocks are sent until the timer thread signals that the duration has passed. The send loop only sends and adds to a running byte count (the data
+#itself is never stored); the timer thread reads the count and prints a row after each interval with -i (with the kernel TCP statistics of sock
+#if --tcpinfo is selected). With a target bitrate, the loop sleeps whenever the pacer runs out of tokens; the unpaced loop is kept separate so
+#that it does no extra work per block. Returns the number of bytes sent and the time sending started (time.monotonic()).
+def send_stream(sock, block_size, bytes_to_send, duration, id, rate=None, burst=None, file=None, fields=None, pacing_offload=False):
+    tcpinfo = sock if args.tcpinfo else None            #Socket sampled by the timer with --tcpinfo
+    send_block = get_sender(sock, block_size, file)     #Send engine which sends one block at a time
+    pacer = get_pacer(sock, rate, block_size, burst, pacing_offload)    #Token-bucket pacer (None if the stream is not paced in simpleperf)
+    counter = [0]                                       #Running count of bytes sent, shared with the timer thread
+    done = threading.Event()                            #Set when the test is over
+    start_time = time.monotonic()                       #Record time that sending starts
+    #If a byte target is given (-n), send given number of bytes:
+    if bytes_to_send is not None:
+        timer = start_timer(lambda: counter[0], id, start_time, done, sock=tcpinfo, fields=fields)    #Prints interval rows with -i
+        #Until desired number of bytes reached:
+        while counter[0] < bytes_to_send:
+            n = min(bytes_to_send - counter[0], block_size)     #Last block is shortened so exactly -n bytes are sent
+            delay = pacer_wait(pacer, n) if pacer is not None else 0
+            if delay:
+                time.sleep(delay)                       #Sleep until the pacer has tokens for the block
+                continue
+            counter[0] += send_block(n)                 #Send block
+        done.set()                                      #Tell the timer that the test is over
+    #Otherwise send for the specified length of time (25s if -t not set explicitly):
+    else:
+        timer = start_timer(lambda: counter[0], id, start_time, done, duration, tcpinfo, fields)    #Ends the test after the duration and prints interval rows with -i
+        if pacer is None:
+            while not done.is_set():
+                counter[0] += send_block()              #Send block and add its size to the counter
+        else:
+            while not done.is_set():
+                delay = pacer_wait(pacer, block_size)
+                if delay:
+                    done.wait(delay)                    #Sleep until the pacer has tokens for the block, or until the timer ends the test
+                else:
+                    counter[0] += send_block()          #Send block and add its size to the counter
+    if timer is not None:
+        timer.join()                                    #Wait for the timer to print the last interval row
+    return counter[0], start_time
+
+
 #FUNCTION: Sends data from client to server
 #ARGUMENTS:
 #clientSocket: A client-side socket with an established connection to the server
-#In all cases the function sends the duration (-t value) and start time from the client to the server. If/elif statements handle the code if
-#-n or -i tags are selected; otherwise a general code takes effect for all other cases.
-def send_data(clientSocket):
-    #Initial conditions in all cases
-    chunk = bytes(1000)                                 #Packet of 1000 bytes
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#In all cases the function sends the control header (test mode, duration, byte target, block size and start time) from the client to the server,
+#then sends the data with send_stream() and half-closes the connection. The final results are not printed here but returned in a dictionary,
+#together with the server's results (bytes received, receiver duration and, with -i, the bytes received per interval), so that the sender and
+#receiver results of all parallel connections can be printed in one table (see print_stream_results()).
+#With -F, the connection sends its part of the file (see get_file_range()) as a test with a byte target.
+def send_data(clientSocket, stream_id=0, group_id=0):
+    block_size = get_block_size()                       #Size of each block that is sent (-l value)
     duration = args.time                                #Total time of transfer (-t value)
-    formatted_duration = '{:0>3}'.format(duration)      #Format -t value as a 3-digit string (with leading zeroes if value is smaller than 3 digits)
-    clientSocket.sendall(formatted_duration.encode('utf-8'))     #Send -t to server as a fixed-length message
-    bytes_sent = bytearray()                            #Initialize an empty byte array to keep track of number of bytes sent
-    start_time = time.time()                            #Record time that sending starts
-    clientSocket.sendall(f'{start_time:7f}'.encode('utf-8').ljust(18,b'\0'))   #Send start time to server as a fixed-length message (with trailing zeroes if fewer than 7 d.p.)
-    send_time = start_time + duration                   #Record time that sending should stop 
-    
-    #If -n selected (send given number of bytes):
-    if args.num is not None:
-        clientSocket.sendall('NUM'.encode('utf-8'))     #Send message to server
-        #Until desired number of bytes reached:
-        while len(bytes_sent) < get_bytes_to_send(args.num):
-            clientSocket.sendall(chunk)                 #Send packet
-            bytes_sent.extend(chunk)                    #Add packets to byte array (length of array gives number of bytes sent)
-        clientSocket.sendall('BYE'.encode())            #Finished sending data - send BYE message to server
-        if b'ACK' in clientSocket.recv(8):              #When ACK received from server:
-            stop_time = time.time()                     #Record stop time 
-        client_duration = stop_time - start_time        #Calculate client duration        
-        results = generate_table()                      #Create empty table ready to hold data rows
-        generate_row(len(bytes_sent), client_duration, args.serverip, args.port, 0, client_duration, results)   #Display stats with actual client duration
-        display_results(results)                        #Print complete table
+    mode = MODE_NUM if args.num is not None else MODE_TIME     #Test mode sent to the server
+    bytes_to_send = get_bytes_to_send(args.num) if args.num is not None else None    #Total number of bytes to send with -n
+    file = None                                         #Part of the file to send with -F
+    if args.file is not None:
+        mode = MODE_NUM
+        offset, bytes_to_send = get_file_range(stream_id)
+        file = (args.file, offset)
+    id = get_stream_label(stream_id)                    #Label for the ID column
+    send_header(clientSocket, mode, block_size, stream_id, group_id, time.time(), bytes_to_send)   #Send test parameters to server as one fixed-length message
+    fields = {'stream_id': stream_id, 'group_id': group_id, 'direction': 'send', 'role': 'sender'}    #Fields of the interval records
+    bytes_sent, start_time = send_stream(clientSocket, block_size, bytes_to_send, duration, id, get_target_rate(), get_burst(), file, fields,
+                                         args.pacing_offload)
+    clientSocket.shutdown(SHUT_WR)                      #Finished sending data - half-close the connection to signal end of test to server
+    server_results = recv_results(clientSocket)         #Wait for results message from server (acts as ACK)
+    client_duration = time.monotonic() - start_time     #Calculate client duration when results recvd
+    tcpinfo = read_tcp_info(clientSocket) if args.tcpinfo else None     #Final kernel TCP statistics, once all data has been acknowledged
+    clientSocket.close()                                #Close client socket when data transmission finished
+    #With -n, show the actual client duration in the interval column; otherwise show -t
+    return {'id': id, 'stream_id': stream_id, 'group_id': group_id, 'bytes': bytes_sent, 'duration': client_duration,
+            'stop': client_duration if mode == MODE_NUM else duration, 'reverse': False, 'tcpinfo': tcpinfo, 'receiver': server_results}
+
+
+#FUNCTION: Receives data sent by the server (only used in conjunction with -R or --bidir)
+#ARGUMENTS:
+#clientSocket: A client-side socket with an established connection to the server
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#The header asks the server to send for -t seconds (or -n bytes) in blocks of -l bytes. The client receives with receive_data() until the server
+#half-closes the connection, then sends its own results (bytes received and duration) to the server, so that the server, as the sending side,
+#knows when all data has arrived. Returns the results in a dictionary like send_data(). The kernel TCP statistics of the client's socket would only
+#describe the direction that carries ACKs, so --tcpinfo is not sampled here; the server prints the sender's statistics with its own --tcpinfo.
+def receive_reverse(clientSocket, stream_id=0, group_id=0):
+    id = get_stream_label(stream_id)                    #Label for the ID column
+    counter = [0]                                       #Running count of bytes received, shared with the timer thread
+    done = threading.Event()                            #Set when the test is over
+    send_header(clientSocket, MODE_REVERSE, get_block_size(), stream_id, group_id, time.time())  #Ask server to send
+    start_time = time.monotonic()                       #Record time that receiving starts
+    fields = {'stream_id': stream_id, 'group_id': group_id, 'direction': 'receive', 'role': 'receiver'}    #Fields of the interval records
+    timer = start_timer(lambda: counter[0], id, start_time, done, fields=fields)    #Prints interval rows with -i
+    receive_data(clientSocket, RECV_BUFFER, counter)    #Receive and count data until the server half-closes the connection
+    done.set()                                          #Tell the timer that the test is over
+    if timer is not None:
+        timer.join()                                    #Wait for the timer to print the last interval row
+    client_duration = time.monotonic() - start_time     #Calculate client duration
+    clientSocket.sendall(pack_results(STATUS_OK, counter[0], client_duration))    #Client sends results to server (acts as ACK)
+    clientSocket.close()
+    return {'id': id, 'stream_id': stream_id, 'group_id': group_id, 'bytes': counter[0], 'duration': client_duration,
+            'stop': client_duration if args.num is not None else args.time, 'reverse': True, 'tcpinfo': None}
+
+
+#FUNCTION: Sends UDP datagrams from client to server at the target bitrate (only used in conjunction with -u)
+#ARGUMENTS:
+#clientSocket: A client-side TCP socket with an established connection to the server, used for control messages
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#After the header, the server replies with the port of a UDP socket opened for this test. Each datagram carries a sequence number and the time it
+#was sent, so the server can count lost and reordered datagrams and calculate jitter. Datagrams are paced by a token-bucket pacer which lets each
+#datagram go as soon as there are tokens for it, so they are spread out evenly, while short delays in sleep() are caught up on and the average
+#rate does not drift. The test runs for -t seconds, or until -n bytes have been sent. The client then sends the number of datagrams it sent and returns the results together with the server's
+#receive statistics.
+def send_udp(clientSocket, stream_id=0, group_id=0):
+    block_size = get_block_size()                       #Size of each datagram (-l value)
+    id = get_stream_label(stream_id)                    #Label for the ID column
+    bytes_to_send = get_bytes_to_send(args.num) if args.num is not None else None    #Total number of bytes to send with -n
+    send_header(clientSocket, MODE_UDP, block_size, stream_id, group_id, time.time())   #Send test parameters to server
+    port, = UDP_READY.unpack(recv_exact(clientSocket, UDP_READY.size))     #Port of the server's UDP socket for this test
+    udpSocket = socket(AF_INET, SOCK_DGRAM)             #Prepare a UDP (SOCK_DGRAM) client socket using IPv4 (AF_INET)
+    udpSocket.connect((args.serverip, port))            #Fix the destination of the datagrams
+    datagram = bytearray(block_size)                    #Preallocated datagram, only the header at the start is rewritten for each datagram
+    view = memoryview(datagram)
+    seq = 0                                             #Sequence number of the next datagram
+    bytes_sent = 0                                      #Initialize counter to keep track of number of bytes sent
+    interval_bytes = 0                                  #Bytes sent since the last interval row (only used in conjunction with -i)
+    start_time = time.monotonic()                       #Record time that sending starts
+    pacer = new_pacer(get_target_rate(), block_size, get_burst(), smooth=True)     #Token-bucket pacer for the target bitrate
+    next_report = start_time + args.interval if args.interval else float('inf')     #End of the current interval
+    send_time = start_time + args.time if bytes_to_send is None else float('inf')    #Record time that sending should stop (-n ignores -t)
+
+    while True:
+        now = time.monotonic()
+        #Print a row at the end of each interval with -i
+        if now >= next_report:
+            interval_start = next_report - args.interval - start_time
+            if args.json or args.csv:
+                emit_result('interval', id, interval_bytes, args.interval, interval_start, interval_start + args.interval,
+                            stream_id=stream_id, group_id=group_id, direction='send', role='sender')
+            else:
+                display_row(generate_row(interval_bytes, args.interval, id, interval_start, interval_start + args.interval, None))
+            interval_bytes = 0
+            next_report += args.interval
+        #Stop after -n bytes, or after -t seconds
+        if bytes_to_send is not None:
+            if bytes_sent >= bytes_to_send:
+                break
+        elif now >= send_time:
+            break
+        #Wait until the pacer has tokens for the next datagram
+        delay = pacer_wait(pacer, block_size)
+        if delay:
+            time.sleep(max(min(now + delay, send_time, next_report) - now, 0))
+            continue
+        DATAGRAM.pack_into(datagram, 0, group_id, stream_id, seq, now)    #Write header with sequence number and send time
+        #EXCEPTION HANDLING
+        try:
+            udpSocket.send(view)                        #Send datagram
+        except (ConnectionRefusedError, BlockingIOError):
+            pass                                        #Datagram is dropped, the server will count it as lost
+        seq += 1
+        bytes_sent += block_size
+        interval_bytes += block_size
+    client_duration = time.monotonic() - start_time     #Calculate client duration
+    udpSocket.close()
+    clientSocket.sendall(UDP_TRAILER.pack(seq))         #Tell the server how many datagrams were sent
+    clientSocket.shutdown(SHUT_WR)                      #Finished sending - half-close the connection to signal end of test to server
+    server_results = recv_results(clientSocket, udp=True)    #Wait for results message with the receive statistics from server
+    clientSocket.close()
+    stop = client_duration if bytes_to_send is not None else args.time
+    return {'id': id, 'stream_id': stream_id, 'group_id': group_id, 'bytes': bytes_sent, 'duration': client_duration, 'stop': stop,
+            'udp': server_results['udp'], 'reverse': False, 'receiver': server_results}
+
+
+#FUNCTION: Measures round-trip latency with request/response probes (only used in conjunction with -L or --probe)
+#ARGUMENTS:
+#clientSocket: A client-side socket with an established connection to the server
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#Every --probe-interval seconds for -t seconds, a small probe with a sequence number and the send time is sent to the server, which sends it back.
+#The round-trip time is recorded in a histogram, so memory use stays the same however long the test runs. Probes go over the TCP connection
+#(with Nagle's algorithm disabled so they are not delayed), or with -u as UDP datagrams to a port opened by the server for the test. A UDP probe
+#without a reply within PROBE_TIMEOUT seconds is counted as lost, and late replies to earlier probes are skipped. Returns the histogram and the
+#number of lost probes in a dictionary.
+def measure_latency(clientSocket, stream_id=0, group_id=0):
+    mode = MODE_UDP_LATENCY if args.udp else MODE_LATENCY
+    clientSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  #Send each probe at once
+    send_header(clientSocket, mode, PROBE.size, stream_id, group_id, time.time())   #Send test parameters to server
+    if args.udp:
+        port, = UDP_READY.unpack(recv_exact(clientSocket, UDP_READY.size))     #Port of the server's UDP socket for this test
+        probeSocket = socket(AF_INET, SOCK_DGRAM)       #Prepare a UDP (SOCK_DGRAM) client socket using IPv4 (AF_INET)
+        probeSocket.connect((args.serverip, port))
+        probeSocket.settimeout(PROBE_TIMEOUT)
+    else:
+        probeSocket = clientSocket
+    hist = new_histogram()                              #Round-trip times in microseconds
+    lost = 0                                            #Initialize counter for probes without a reply
+    probe = bytearray(PROBE.size)                       #Preallocated probe and reply buffers
+    reply = memoryview(bytearray(PROBE.size))
+    seq = 0                                             #Sequence number of the next probe
+    start_time = time.monotonic()                       #Record time that probing starts
+    next_probe = start_time                             #Deadline of the next probe
+    send_time = start_time + args.time                  #Record time that probing should stop
+
+    while True:
+        now = time.monotonic()
+        if now >= send_time:
+            break
+        #Wait until the deadline of the next probe
+        if now < next_probe:
+            time.sleep(min(next_probe, send_time) - now)
+            continue
+        sent = time.perf_counter()
+        PROBE.pack_into(probe, 0, group_id, stream_id, seq, sent)
+        if args.udp:
+            probeSocket.send(probe)
+            #Wait for the reply to this probe, skipping late replies to earlier probes
+            while True:
+                #EXCEPTION HANDLING
+                try:
+                    probeSocket.recv_into(reply)
+                except timeout:
+                    lost += 1                           #No reply in time - probe is lost
+                    break
+                if PROBE.unpack_from(reply)[2] == seq:
+                    hist_record(hist, (time.perf_counter() - sent)*1e6)
+                    break
+        else:
+            probeSocket.sendall(probe)
+            reply[:] = recv_exact(probeSocket, PROBE.size)     #Replies arrive in order on a TCP connection
+            hist_record(hist, (time.perf_counter() - sent)*1e6)
+        seq += 1
+        next_probe += args.probe_interval               #Next deadline is relative to the previous one, not to the actual send time
+    if args.udp:
+        probeSocket.close()
+        clientSocket.sendall(UDP_TRAILER.pack(seq))     #Tell the server how many probes were sent
+    clientSocket.shutdown(SHUT_WR)                      #Finished probing - half-close the connection to signal end of test to server
+    recv_results(clientSocket, udp=args.udp)            #Wait for results message from server (acts as ACK)
+    clientSocket.close()
+    return {'id': get_stream_label(stream_id), 'stream_id': stream_id, 'group_id': group_id, 'hist': hist, 'lost': lost}
+
+
+#FUNCTION: Prints the results of all latency streams in one table
+#ARGUMENTS:
+#latency_results: List of dictionaries returned by measure_latency() (None for streams that failed)
+#Prints one row per stream and, if there is more than one stream, a SUM row calculated from all round-trip times together. With --json or --csv,
+#a latency record is written for each stream and a latency_summary record for all of them instead.
+def print_latency_results(latency_results):
+    latency_results = [result for result in latency_results if result is not None]   #Leave out streams that failed
+    if not latency_results:
+        return
+    if args.json or args.csv:
+        total = new_histogram()
+        for result in latency_results:
+            emit_latency('latency', result['hist'], result['lost'], result['id'], stream_id=result['stream_id'], group_id=result['group_id'])
+            hist_merge(total, result['hist'])
+        emit_latency('latency_summary', total, sum(result['lost'] for result in latency_results), 'SUM', group_id=latency_results[0]['group_id'])
+        return
+    results = generate_latency_table()                  #Create empty table ready to hold data rows
+    for result in latency_results:
+        generate_latency_row(result['hist'], result['lost'], result['id'], results)
+    if len(latency_results) > 1:
+        total = new_histogram()
+        for result in latency_results:
+            hist_merge(total, result['hist'])
+        generate_latency_row(total, sum(result['lost'] for result in latency_results), 'SUM', results)
+    display_results(results)                            #Print complete table
+
+
+#FUNCTION: Writes a latency record (only used in conjunction with --json or --csv)
+#ARGUMENTS:
+#type: 'latency' for one stream, or 'latency_summary' for all streams
+#hist: Histogram with the round-trip times in microseconds
+#lost: Number of probes without a reply
+#id: Label of the stream, as in the ID column
+#fields: Other fields of the record (stream and group ID)
+#All times are in microseconds; the minimum, mean and maximum are exact, the percentiles have the resolution of the histogram.
+def emit_latency(type, hist, lost, id, **fields):
+    emit_record({'type': type, 'id': id, 'probes': hist['count'], 'lost': lost, **get_hist_fields(hist), **fields})
+
+
+#FUNCTION: Obtains the round-trip time fields of a latency or transaction record
+#ARGUMENTS:
+#hist: Histogram with the round-trip times in microseconds
+#Returns the minimum, mean, maximum and percentiles in a dictionary.
+def get_hist_fields(hist):
+    fields = {'min': hist['min'] if hist['count'] else 0, 'mean': hist['sum']/hist['count'] if hist['count'] else 0, 'max': hist['max']}
+    for percentile in (50, 90, 99, 99.9):
+        fields[f'p{percentile:g}'] = hist_percentile(hist, percentile)
+    return fields
+
+
+#FUNCTION: Client-side code for a transaction test (only used in conjunction with --rr or --crr)
+#ARGUMENTS:
+#clientSocket: A client-side socket with an established connection to the server (None with --crr, where every transaction opens its own connection)
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#For -t seconds, requests of --request-size bytes are sent to the server, which answers each with a response of --response-size bytes. The time from
+#sending the request (with --crr: from starting to connect) until the whole response has arrived is recorded in a histogram. With --rr the
+#transactions run on --pool persistent connections, each with one transaction outstanding at a time. With --crr each transaction opens a new
+#connection, sends the header and the request in one message, and reads the response until the server closes the connection; the server closes
+#first, so the TIME_WAIT state is held by the server and the client does not run out of ports. --pool such transactions are in progress at once.
+#All connections of the stream are non-blocking and served by one selector, so a pool costs no extra threads. Transactions in progress at the end
+#of the test are completed and counted. Returns the number of transactions, the duration and the histogram in a dictionary.
+def run_transactions(clientSocket, stream_id=0, group_id=0):
+    request = bytes(get_message_size(args.request_size))
+    response_size = get_message_size(args.response_size)
+    view = memoryview(bytearray(response_size))         #Preallocated receive buffer, reused for every response
+    address = (args.serverip, args.port)
+    selector = selectors.DefaultSelector()
+    hist = new_histogram()                              #Transaction times in microseconds
+    transactions = 0                                    #Initialize counter for number of transactions completed
+    if args.crr:
+        message = memoryview(pack_header(MODE_CRR, len(request), stream_id, group_id, time.time()) + request)
+        slots = [{'sock': None} for _ in range(args.pool)]
+    else:
+        message = memoryview(request)
+        slots = [{'sock': clientSocket}]
+        for _ in range(args.pool - 1):
+            sock = socket(AF_INET, SOCK_STREAM)
+            sock.connect(address)
+            slots.append({'sock': sock})
+        for slot in slots:
+            slot['sock'].setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  #Send each request at once
+            send_header(slot['sock'], MODE_RR, len(request), stream_id, group_id, time.time())     #Send test parameters to server
+            slot['sock'].setblocking(False)
+            selector.register(slot['sock'], selectors.EVENT_READ, slot)
+
+    #FUNCTION: Sends as much of the message of a transaction as the socket takes without blocking
+    #Waits for the socket to become writable if the message is not sent completely, and for the response once it is.
+    def send_message(slot):
+        try:
+            slot['sent'] += slot['sock'].send(message[slot['sent']:])
+        except BlockingIOError:
+            pass
+        events = selectors.EVENT_READ if slot['sent'] == len(message) else selectors.EVENT_WRITE
+        if events != slot['events']:
+            selector.modify(slot['sock'], events, slot)
+            slot['events'] = events
+
+    #FUNCTION: Starts a new transaction in a slot
+    def start_transaction(slot):
+        slot['start'] = time.perf_counter()
+        slot['sent'] = 0
+        slot['received'] = 0
+        if args.crr:
+            sock = socket(AF_INET, SOCK_STREAM)
+            sock.setblocking(False)
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            sock.connect_ex(address)                    #Connects in the background; the socket becomes writable once it is connected
+            slot['sock'] = sock
+            slot['events'] = selectors.EVENT_WRITE
+            selector.register(sock, selectors.EVENT_WRITE, slot)
+        else:
+            slot['events'] = selectors.EVENT_READ
+            send_message(slot)
 
-    #If -i selected (print stats every z seconds):
-    elif args.interval is not None:
-        interval = args.interval                        #Length of interval
-        interval_number = int(duration/interval)        #Total time/length of interval = no. of intervals
-        total_bytes_sent = 0                            #Initialize counter for total bytes sent
-        total_time_taken = 0                            #Initialize counter for total time taken
-        results = generate_table()                      #Create empty table ready to hold data rows
-        display_results(results)                        #Print headers in empty table
-        #For each interval:
-        for i in range(interval_number):
-            #While time is less than total send time and within interval time:
-            while time.time() < start_time + interval and time.time() < send_time:                  
-                clientSocket.sendall(chunk)             #Send packet
-                bytes_sent.extend(chunk)                #Add packets to byte array (length of array gives number of bytes sent)
-            checkpoint = time.time()                    #Record time at end of interval               
-            client_duration = checkpoint - start_time   #Calculate client duration for interval
-            #Create a row for the interval and save to new_row variable
-            new_row = generate_row(len(bytes_sent), client_duration, args.serverip, args.port, i*interval, (i+1)*interval, results)
-            display_row(new_row)                        #Print the new row in the existing table
-            total_bytes_sent += len(bytes_sent)         #Update counter with number of bytes sent during interval (to calculate total)
-            total_time_taken += client_duration         #Update counter with time taken during interval (to calculate total)
-            start_time = time.time()                    #Reset start time for next interval
-            bytes_sent = bytearray()                    #Reset byte array for next interval
-        clientSocket.sendall('BYE'.encode())            #Finished sending data - send BYE message to server
-        if b'ACK' in clientSocket.recv(8):              #When ACK received from server:
-            stop_time = time.time()                     #Record stop time at end of total duration
-        delay = stop_time - start_time                  #Time between final interval finishing and receiving ACK from server
-        #Calculate totals for each column and save to total variable
-        total = generate_row(total_bytes_sent, total_time_taken + delay, args.serverip, args.port, 0, duration, results) 
+    start_time = time.monotonic()                       #Record time that the test starts
+    send_time = start_time + args.time                  #Record time that no new transactions should be started
+    try:
+        for slot in slots:
+            start_transaction(slot)
+        busy = len(slots)                               #Number of slots with a transaction in progress
+        while busy:
+            for key, events in selector.select():
+                slot = key.data
+                sock = slot['sock']
+                if events & selectors.EVENT_WRITE:
+                    if args.crr and slot['sent'] == 0:
+                        error = sock.getsockopt(SOL_SOCKET, SO_ERROR)
+                        if error:
+                            raise ConnectionError(f'connect failed: {os.strerror(error)}')
+                    send_message(slot)
+                    continue
+                if args.crr:
+                    n = sock.recv_into(view[min(slot['received'], response_size - 1):])    #Read until end of stream; a longer response is an error
+                    if n > 0:
+                        slot['received'] += n
+                        if slot['received'] > response_size:
+                            raise ConnectionError('the server sent a longer response than requested')
+                        continue
+                    if slot['received'] < response_size:
+                        raise ConnectionError('connection closed before the whole response was received')
+                    selector.unregister(sock)
+                    sock.close()
+                    slot['sock'] = None
+                else:
+                    n = sock.recv_into(view[slot['received']:])
+                    if n == 0:
+                        raise ConnectionError('connection closed by the server')
+                    slot['received'] += n
+                    if slot['received'] < response_size:
+                        continue
+                #Response complete
+                hist_record(hist, (time.perf_counter() - slot['start'])*1e6)
+                transactions += 1
+                if time.monotonic() < send_time:
+                    start_transaction(slot)
+                else:
+                    busy -= 1
+                    if not args.crr:
+                        selector.unregister(sock)
+        duration = time.monotonic() - start_time
+    finally:
+        selector.close()
+        if args.crr:
+            for slot in slots:
+                if slot['sock'] is not None:
+                    slot['sock'].close()
+    #Finish the persistent connections: half-close each of them and wait for the server's results (acts as ACK)
+    if not args.crr:
+        for slot in slots:
+            slot['sock'].setblocking(True)
+            slot['sock'].shutdown(SHUT_WR)
+            recv_results(slot['sock'])
+            slot['sock'].close()
+    return {'id': get_stream_label(stream_id), 'stream_id': stream_id, 'group_id': group_id, 'transactions': transactions, 'duration': duration,
+            'hist': hist}
+
+
+#FUNCTION: Prints the results of all transaction streams in one table
+#ARGUMENTS:
+#transaction_results: List of dictionaries returned by run_transactions() (None for streams that failed)
+#Prints one row per stream and, if there is more than one stream, a SUM row with the total number of transactions over the longest stream duration
+#and the transaction times of all streams together. With --json or --csv, a transactions record is written for each stream and a
+#transactions_summary record for all of them instead.
+def print_transaction_results(transaction_results):
+    transaction_results = [result for result in transaction_results if result is not None]     #Leave out streams that failed
+    if not transaction_results:
+        return
+    rows = [(result['id'], result['stream_id'], result['transactions'], result['duration'], result['hist']) for result in transaction_results]
+    if len(transaction_results) > 1 or args.json or args.csv:
+        total = new_histogram()
+        for result in transaction_results:
+            hist_merge(total, result['hist'])
+        rows.append(('SUM', None, sum(result['transactions'] for result in transaction_results),
+                     max(result['duration'] for result in transaction_results), total))
+    if args.json or args.csv:
+        for index, (id, stream_id, transactions, duration, hist) in enumerate(rows):
+            emit_record({'type': 'transactions_summary' if index == len(transaction_results) else 'transactions', 'id': id,
+                         'transactions': transactions, 'seconds': duration, 'transactions_per_second': transactions/duration if duration > 0 else 0,
+                         'parallel': len(transaction_results), **get_hist_fields(hist),
+                         **({'stream_id': stream_id} if stream_id is not None else {}), 'group_id': transaction_results[0]['group_id']})
+        return
+    results = [['ID', 'Interval', 'Transactions', 'Rate', 'Min/Avg/Max', 'p50', 'p90', 'p99', 'p99.9']]
+    for id, _, transactions, duration, hist in rows:
+        results.append([id, f'0.0 - {duration:.1f}', f'{transactions}', f'{transactions/duration if duration > 0 else 0:.1f} trans/s']
+                       + generate_hist_columns(hist))
+    display_results(results)                            #Print complete table
+
+
+#FUNCTION: Obtains the label for the ID column of a client stream
+#ARGUMENTS:
+#stream_id: Number of the connection within the -P group
+#With a single connection the label is the server IP:port as before. With -P greater than 1, or with --bidir, the stream number is added in front
+#so the rows of each connection can be told apart.
+def get_stream_label(stream_id):
+    if args.parallel > 1 or args.bidir:
+        return f'[{stream_id}] {args.serverip}:{args.port}'
+    return f'{args.serverip}:{args.port}'
+
+
+#FUNCTION: Obtains the part of the -F file that a client stream sends
+#ARGUMENTS:
+#stream_id: Number of the connection within the -P group
+#The file is split into -P parts of (almost) equal size, one per connection, so that together the parallel connections send the file once.
+#Returns the offset of the part in the file and its size in bytes.
+def get_file_range(stream_id):
+    size = os.path.getsize(args.file)
+    start = size*stream_id//args.parallel
+    return start, size*(stream_id + 1)//args.parallel - start
+
+
+#FUNCTION: Measures how fast the -F file can be read from storage (only used in conjunction with -F)
+#ARGUMENTS:
+#path: Path of the file
+#Reads the whole file once in STORAGE_BUFFER reads into one buffer before the test starts. The file is first dropped from the page cache with
+#posix_fadvise(), so that the read comes from storage and not from memory, and dropped again afterwards, so that the transfer also reads the file
+#from storage (posix_fadvise() is only advice: pages in use elsewhere stay cached). Returns the number of bytes read and the time in seconds.
+def measure_file_read(path):
+    view = memoryview(bytearray(STORAGE_BUFFER))        #Preallocated read buffer, reused for every read
+    bytes_read = 0
+    with open(path, 'rb', buffering=0) as f:
+        drop_file_cache(f.fileno())
+        start = time.perf_counter()
+        while True:
+            n = f.readinto(view)
+            if not n:                                   #0 bytes means end of file
+                break
+            bytes_read += n
+        seconds = time.perf_counter() - start
+        drop_file_cache(f.fileno())
+    return bytes_read, seconds
+
+
+#FUNCTION: Drops a file from the page cache (only used in conjunction with -F)
+#ARGUMENTS:
+#fd: File descriptor of the file
+#On platforms without posix_fadvise() the function does nothing.
+def drop_file_cache(fd):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+#FUNCTION: Pins the calling thread or process to one CPU core (only used in conjunction with -A)
+#ARGUMENTS:
+#index: Number of the stream or worker; streams/workers are spread round-robin over the cores this program is allowed to run on
+#sched_setaffinity() with pid 0 applies to the calling thread, so the same function works in thread mode and process mode. On platforms without
+#sched_setaffinity() the function does nothing.
+def pin_cpu(index):
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))          #Cores available to this program
+        os.sched_setaffinity(0, {cpus[index % len(cpus)]})
+
+
+#FUNCTION: Sets the start barrier in a worker process (only used in conjunction with -M)
+#ARGUMENTS:
+#barrier: multiprocessing.Barrier shared by all parallel streams
+#Used as the initializer of the process pool, so every worker process has the barrier before it runs a stream.
+def set_start_barrier(barrier):
+    global start_barrier
+    start_barrier = barrier
+
+
+#FUNCTION: Runs one client stream from connection to results
+#ARGUMENTS:
+#stream_id: Number of this connection within the -P group
+#group_id: Random number shared by all connections opened by the same client run
+#kind: 'send' for a throughput stream from client to server, 'reverse' for a throughput stream from server to client (-R or --bidir),
+#'latency' for a latency stream (-L or --probe), or 'transactions' for a transaction stream (--rr or --crr)
+#The function is the unit of work for both thread mode and process mode (-M). It connects a new client socket, waits at start_barrier until every
+#parallel stream is connected, so that all streams start sending together, and then runs send_data(). Returns the results of send_data(), which in
+#process mode are sent back to the parent process by the pool. If the connection to the server fails, an error message is printed and None is
+#returned, so the other streams can still be reported. A stream which cannot connect aborts the barrier, so the streams waiting there stop as
+#well instead of waiting forever. A --crr stream opens a new connection for every transaction, so it does not connect here.
+def run_stream(stream_id, group_id, kind='send'):
+    if args.affinity:
+        pin_cpu(stream_id)                              #Pin stream to its own core
+    clientSocket = None
+    #EXCEPTION HANDLING
+    try:
+        if not (kind == 'transactions' and args.crr):
+            clientSocket = socket(AF_INET, SOCK_STREAM)     #Prepare a TCP (SOCK_STREAM) client socket using IPv4 (AF_INET)
+            clientSocket.connect((args.serverip,args.port)) #Connect client socket to specified server IP/port and initiate three-way handshake
+            print(f'Client {clientSocket.getsockname()} connected with server {args.serverip}, port {args.port}', file=get_message_file())    #Print message when client successfully connected
+        #Wait until all parallel connections are established. Exactly one stream gets index 0 back, and with -i it prints the table headings.
+        if start_barrier.wait() == 0 and args.interval is not None and not args.latency and kind != 'transactions':
+            display_results(generate_table(args.udp, sending=not args.reverse, tcpinfo=args.tcpinfo and not args.reverse))    #Print headers in empty table, interval rows are printed underneath as they come in
+        if kind == 'latency':
+            return measure_latency(clientSocket, stream_id, group_id)
+        if kind == 'transactions':
+            return run_transactions(clientSocket, stream_id, group_id)
+        if kind == 'reverse':
+            return receive_reverse(clientSocket, stream_id, group_id)
+        if args.udp:
+            return send_udp(clientSocket, stream_id, group_id)
+        return send_data(clientSocket, stream_id, group_id)
+    except threading.BrokenBarrierError:
+        print(f'Error: stream {stream_id} stopped, because another stream could not connect', file=get_message_file())
+    except (OSError, ValueError) as e:
+        print(f'Error: stream {stream_id} failed ({e})', file=get_message_file())       #Print error message if the connection failed or the server reported an error
+        start_barrier.abort()                           #Release the streams still waiting at the barrier (harmless once all have passed it)
+    if clientSocket is not None:
+        clientSocket.close()
+    return None
+
+
+#FUNCTION: Prints the results of all client streams in one table
+#ARGUMENTS:
+#stream_results: List of dictionaries returned by send_data(), one per parallel connection (None for streams that failed)
+#Prints one row per stream and, if there is more than one stream, a SUM row with the total number of bytes over the longest stream duration.
+#With -i the interval rows have already been printed under the table headings, so only the totals are printed below a dashed line.
+#With --bidir, the streams in each direction are printed in a table of their own, with their own headings and SUM row.
+def print_stream_results(stream_results):
+    stream_results = [result for result in stream_results if result is not None]     #Leave out streams that failed
+    for reverse in (False, True):
+        direction_results = [result for result in stream_results if result['reverse'] == reverse]
+        if direction_results:
+            print_direction_results(direction_results, reverse)
+
+
+#FUNCTION: Prints the results of the client streams in one direction in one table
+#ARGUMENTS:
+#stream_results: List of dictionaries returned by send_data(), send_udp() or receive_reverse() for streams in the same direction
+#reverse: True if the streams were sent by the server
+#When the client is the sender, the server's results are shown under the client's own, as in iperf3: a sender row with the bytes sent over the
+#client's duration, and a receiver row with the bytes that actually arrived over the server's duration. Data still in socket buffers when the
+#client finishes only counts in the sender row, so the receiver row gives the true goodput. With -i, the server's intervals are printed as
+#receiver rows above the totals. UDP receive statistics go in the receiver rows, kernel TCP statistics in the sender rows. Streams sent by the
+#server have no kernel TCP statistics on the client (see receive_reverse()), so their table has no columns for them.
+#With --json or --csv, stream records are written for each stream and summary records for all of them, instead of the table.
+def print_direction_results(stream_results, reverse):
+    direction = 'receive' if reverse else 'send'
+    tcpinfo = args.tcpinfo and not reverse              #True if the table has columns for kernel TCP statistics
+    roles = all(result.get('receiver') is not None for result in stream_results)     #True if the server's results are known
+    total_bytes = sum(result['bytes'] for result in stream_results)
+    total_duration = max(result['duration'] for result in stream_results)
+    total_stop = max(result['stop'] for result in stream_results)
+    total_udp = None
+    if args.udp:
+        #Datagram counts are added up, jitter is averaged over the streams
+        total_udp = {key: sum(result['udp'][key] for result in stream_results) for key in ('datagrams', 'lost', 'out_of_order')}
+        total_udp['jitter'] = sum(result['udp']['jitter'] for result in stream_results)/len(stream_results)
+    #Only the retransmits are added up; the other kernel TCP statistics are per connection
+    total_retrans = sum(result['tcpinfo']['retrans'] for result in stream_results if result.get('tcpinfo') is not None)
+    if roles:
+        received_bytes = sum(result['receiver']['bytes'] for result in stream_results)
+        received_duration = max(result['receiver']['duration'] for result in stream_results)
+
+    #With --json or --csv, write stream records and summary records (also for a single stream). Every record has the stream and group ID, direction
+    #and role, so the sender and receiver records of a stream can be matched with each other and with the server's records.
+    if args.json or args.csv:
+        group_id = stream_results[0]['group_id']        #Shared by all streams of the run
+        for result in stream_results:
+            ids = {'stream_id': result['stream_id'], 'group_id': group_id, 'direction': direction}
+            if roles:
+                for start, stop, bytes in result['receiver']['intervals']:
+                    emit_result('interval', result['id'], bytes, stop - start, start, stop, role='receiver', **ids)
+                emit_result('stream', result['id'], result['bytes'], result['duration'], 0, result['stop'], None, result.get('tcpinfo'),
+                            role='sender', **ids)
+                emit_result('stream', result['id'], result['receiver']['bytes'], result['receiver']['duration'], 0, result['stop'], result.get('udp'),
+                            role='receiver', **ids)
+            else:
+                emit_result('stream', result['id'], result['bytes'], result['duration'], 0, result['stop'], result.get('udp'), result.get('tcpinfo'),
+                            role='receiver' if reverse else 'sender', **ids)
+        if roles:
+            emit_result('summary', 'SUM', total_bytes, total_duration, 0, total_stop, None, {'retrans': total_retrans} if tcpinfo else None,
+                        direction=direction, role='sender', group_id=group_id, parallel=len(stream_results))
+            emit_result('summary', 'SUM', received_bytes, received_duration, 0, total_stop, total_udp,
+                        direction=direction, role='receiver', group_id=group_id, parallel=len(stream_results))
+        else:
+            emit_result('summary', 'SUM', total_bytes, total_duration, 0, total_stop, total_udp, {'retrans': total_retrans} if tcpinfo else None,
+                        direction=direction, role='receiver' if reverse else 'sender', group_id=group_id, parallel=len(stream_results))
+        return
+
+    results = generate_table(args.udp, sending=not reverse, tcpinfo=tcpinfo, roles=roles)     #Create empty table ready to hold data rows
+    udp_blank = ['']*3 if args.udp else []              #Sender rows leave the UDP columns empty
+    #With -i, the server's intervals come first
+    if roles and args.interval is not None:
+        for result in stream_results:
+            for start, stop, bytes in result['receiver']['intervals']:
+                generate_row(bytes, stop - start, result['id'], start, stop, results).append('receiver')
+    for result in stream_results:
+        row = generate_row(result['bytes'], result['duration'], result['id'], 0, result['stop'], results)
+        if roles:
+            row += ['sender'] + udp_blank
+        elif args.udp:
+            row += generate_udp_columns(result['udp'])  #Add the server's receive statistics of the datagrams
+        if tcpinfo:
+            row += generate_tcpinfo_columns(result['tcpinfo'])  #Add the final kernel TCP statistics of the connection
+        if roles:
+            row = generate_row(result['receiver']['bytes'], result['receiver']['duration'], result['id'], 0, result['stop'], results)
+            row += ['receiver']
+            if args.udp:
+                row += generate_udp_columns(result['udp'])
+    if len(stream_results) > 1:
+        row = generate_row(total_bytes, total_duration, 'SUM', 0, total_stop, results)
+        if roles:
+            row += ['sender'] + udp_blank
+        elif args.udp:
+            row += generate_udp_columns(total_udp)
+        if tcpinfo:
+            row += ['', '', f'{total_retrans}']
+        if roles:
+            row = generate_row(received_bytes, received_duration, 'SUM', 0, total_stop, results)
+            row += ['receiver']
+            if args.udp:
+                row += generate_udp_columns(total_udp)
+    if args.interval is not None:
         print('\n' + '-'*85 + '\n')                     #Print dashed line underneath intervals
-        display_row(total)                              #Print totals at bottom of table
-    
-    #If neither -n or -i is selected:
+        #Print totals at bottom of table (with headings if the columns differ from the interval rows, or if both directions are shown)
+        for row in results if args.bidir or roles else results[1:]:
+            display_row(row)
     else:
-        #For the specified length of time (25s if -t not set explicitly):
-        results = generate_table()                      #Create empty table ready to hold data rows
-        while time.time() < send_time:                  
-            clientSocket.sendall(chunk)                 #Send packets
-            bytes_sent.extend(chunk)                    #Add packets to byte array (length of array gives number of bytes sent)
-        clientSocket.sendall('BYE'.encode())            #Finished sending data - send BYE message to server
-        if b'ACK' in clientSocket.recv(8):              #When ACK received from server:
-            stop_time = time.time()                     #Stop timer when ACK recvd
-        client_duration = stop_time - start_time        #Calculate client duration 
-        generate_row(len(bytes_sent), client_duration, args.serverip, args.port, 0, duration, results)  #Display stats with -t as duration
         display_results(results)                        #Print complete table
-            
-    clientSocket.close()                                #Close client socket when data transmission finished
+
+
+#FUNCTION: Receives data until the client has finished sending
+#ARGUMENTS:
+#connectionSocket: An active socket object with a connection to a client
+#block_size: Size in bytes of the receive buffer (-l value)
+#One buffer of block_size bytes is allocated and every read goes straight into it with recv_into(), so the data is counted but never stored.
+#The client signals the end of the test by shutting down its side of the connection (half-close), which makes recv_into() return 0. Unlike a
+#marker in the data stream, this cannot be split across two reads or be confused with payload. The running byte count is kept in counter, so
+#that the timer thread can read it with -i. Returns the number of bytes received.
+def receive_data(connectionSocket, block_size, counter):
+    view = memoryview(bytearray(block_size))            #Preallocated receive buffer, reused for every read
+    #Until the client closes its side of the connection:
+    while True:
+        n = connectionSocket.recv_into(view)            #Read as many bytes as are available (up to block_size) into the buffer
+        if n == 0:                                      #0 bytes means end of stream
+            return counter[0]
+        counter[0] += n                                 #Add size of read to the counter
+
+
+#FUNCTION: Receives a data stream on the server and writes it to a file (only used in conjunction with --output-dir)
+#ARGUMENTS:
+#connectionSocket: A socket with a connection to a client
+#path: Path of the file the data is written to
+#counter: As for receive_data()
+#Data is received into one buffer of STORAGE_BUFFER bytes, and the buffer is written to the file when it is full, so the disk only gets large
+#writes. The file is opened with O_DIRECT where the file system supports it, so that the writes go to storage instead of to the page cache;
+#O_DIRECT needs an aligned buffer, and anonymous memory from mmap is aligned to a page. The last, shorter, write may not be aligned, so O_DIRECT
+#is turned off for it. The time spent in writes and in the final fsync() is measured on its own, so the storage throughput can be reported apart
+#from the network throughput. Returns the number of bytes received and the time spent writing them in seconds.
+def receive_to_file(connectionSocket, path, counter):
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    direct = getattr(os, 'O_DIRECT', 0)                 #O_DIRECT only exists on Linux
+    try:
+        fd = os.open(path, flags | direct, 0o644)
+    except OSError:
+        direct = 0
+        fd = os.open(path, flags, 0o644)                #The file system does not support O_DIRECT (e.g. tmpfs)
+    buffer = mmap.mmap(-1, STORAGE_BUFFER)              #Page-aligned write buffer
+    view = memoryview(buffer)
+    filled = 0                                          #Number of bytes in the buffer
+    storage_time = 0.0                                  #Time spent writing to the file
+    try:
+        #Until the client closes its side of the connection:
+        while True:
+            n = connectionSocket.recv_into(view[filled:])
+            if n == 0:                                  #0 bytes means end of stream
+                break
+            filled += n
+            counter[0] += n                             #Add size of read to the counter
+            if filled == STORAGE_BUFFER:
+                start = time.perf_counter()
+                write_all(fd, view)
+                storage_time += time.perf_counter() - start
+                filled = 0
+        start = time.perf_counter()
+        if filled:
+            if direct:
+                import fcntl                            #Only needed, and only available, where O_DIRECT is
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~direct)
+            write_all(fd, view[:filled])
+        os.fsync(fd)                                    #The data is only on storage once fsync() returns
+        storage_time += time.perf_counter() - start
+    finally:
+        view.release()
+        buffer.close()
+        os.close(fd)
+    return counter[0], storage_time
+
+
+#FUNCTION: Writes a whole buffer to a file descriptor
+#ARGUMENTS:
+#fd: A file descriptor open for writing
+#view: memoryview of the data to write
+#os.write() may write less than it is given, so it is repeated until the whole buffer is written.
+def write_all(fd, view):
+    while view:
+        view = view[os.write(fd, view):]
+
+
+#FUNCTION: Receives a data stream on the server and discards it in the kernel (only used in conjunction with --splice)
+#ARGUMENTS:
+#connectionSocket: A socket with a connection to a client
+#counter: As for receive_data()
+#splice() moves data between a file descriptor and a pipe without copying it to user space, so the data goes from the socket into a pipe and
+#from the pipe to /dev/null, and simpleperf only sees the byte counts. This shows how fast the network can deliver data when the receiver does
+#not have to copy it. The pipe is made SPLICE_PIPE bytes large if the kernel allows it, so that each call moves more data. Returns the number of
+#bytes received.
+def receive_splice(connectionSocket, counter):
+    read_end, write_end = os.pipe()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        try:
+            import fcntl
+            fcntl.fcntl(write_end, fcntl.F_SETPIPE_SZ, SPLICE_PIPE)
+        except (ImportError, AttributeError, OSError):
+            pass                                        #Keep the default pipe size
+        #Until the client closes its side of the connection:
+        while True:
+            n = os.splice(connectionSocket.fileno(), write_end, SPLICE_PIPE)
+            if n == 0:                                  #0 bytes means end of stream
+                return counter[0]
+            counter[0] += n                             #Add size of read to the counter
+            #Empty the pipe before the next read from the socket
+            while n:
+                n -= os.splice(read_end, devnull, n)
+    finally:
+        for fd in (read_end, write_end, devnull):
+            os.close(fd)
+
+
+#FUNCTION: Starts printing interval rows for a connection on the server (only used in conjunction with -i)
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received so far
+#id: Client IP:remote port
+#sock: Socket whose kernel TCP statistics are added to each row (None if --tcpinfo is not selected, or for UDP tests)
+#fields: Other fields of the interval records (see get_server_fields())
+#Prints the table headings and starts a timer thread which prints a row after each interval until the returned event is set. Returns the event
+#and the thread, or None if -i is not selected.
+def start_server_intervals(sample, id, sock=None, fields=None):
+    if args.interval is None:
+        return None
+    display_results(generate_table(tcpinfo=sock is not None))  #Print headers in empty table, interval rows are printed underneath as they come in
+    done = threading.Event()
+    return done, start_timer(sample, id, time.monotonic(), done, sock=sock, fields=fields)
+
+
+#FUNCTION: Records the bytes received in each interval, to be sent back to the client (only used if the client has selected -i)
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received so far
+#start_time: Time the test started (time.monotonic())
+#interval: Length of each interval in seconds (the client's -i value)
+#done: threading.Event which is set when the test is over
+#series: List which (start, stop, bytes) is appended to after each interval
+#Works like run_timer(), but collects the intervals instead of printing them, so the client can show the receiver's view of the test as well as
+#its own. The last, possibly shorter, interval is added when done is set.
+def record_intervals(sample, start_time, interval, done, series):
+    last = [0, 0]                                       #Byte count and position at the end of the previous interval
+    k = 1                                               #Number of the next interval boundary
+    while not done.wait(max(start_time + k*interval - time.monotonic(), 0)):
+        bytes = sample()
+        series.append((last[1], k*interval, bytes - last[0]))
+        last = [bytes, k*interval]
+        k += 1
+    stop = time.monotonic() - start_time
+    if stop - last[1] >= 0.01*interval:
+        series.append((last[1], stop, sample() - last[0]))
+
+
+#FUNCTION: Starts recording the bytes received in each interval for the client
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received so far
+#header: Test parameters received from the client
+#Returns the list the intervals are recorded in, and the event and thread to pass to stop_server_intervals() (None if the client has not
+#selected -i, in which case the list stays empty).
+def start_recorder(sample, header):
+    series = []
+    if not header['interval']:
+        return series, None
+    done = threading.Event()
+    recorder = threading.Thread(target=record_intervals, args=(sample, time.monotonic(), header['interval'], done, series), daemon=True)
+    recorder.start()
+    return series, (done, recorder)
+
+
+#FUNCTION: Stops printing interval rows for a connection on the server
+#ARGUMENTS:
+#intervals: Value returned by start_server_intervals() (or the second value returned by start_recorder())
+#Sets the event and waits for the timer to print (or record) the last interval. Stopping the timer again has no effect.
+def stop_server_intervals(intervals):
+    if intervals is not None:
+        done, timer = intervals
+        done.set()
+        timer.join()
+
+
+#FUNCTION: Obtains the fields which identify the records of a connection on the server (only used in conjunction with --json or --csv)
+#ARGUMENTS:
+#header: Test parameters received from the client
+#Returns the stream and group ID from the header, and the direction and role of the server: it receives the data, except in reverse mode. These are
+#the same fields as in the client's records, so the records of both sides of a stream can be joined.
+def get_server_fields(header):
+    reverse = header['mode'] == MODE_REVERSE
+    return {'stream_id': header['stream_id'], 'group_id': header['group_id'], 'direction': 'send' if reverse else 'receive',
+            'role': 'sender' if reverse else 'receiver'}
+
+
+#FUNCTION: Prints the server-side results of one connection
+#ARGUMENTS:
+#header: Test parameters received from the client
+#bytes_received: Number of bytes received
+#server_duration: Duration measured by the server
+#id: Client IP:remote port
+#partial: True if the test was cut short because the server is shutting down
+#udp: Receive statistics of the datagrams in a UDP test (None for TCP tests)
+#tcpinfo: Final kernel TCP statistics of the connection (None if --tcpinfo is not selected, or for UDP tests)
+#With -n, or if the test was cut short, the actual server duration is shown in the interval column; otherwise the -t duration is shown. In reverse
+#mode the server is the sending side, so the table has the client's headings. With --json or --csv, a stream record is written instead.
+def display_server_results(header, bytes_received, server_duration, id, partial=False, udp=None, tcpinfo=None):
+    if args.json or args.csv:
+        stop = server_duration if header['num'] > 0 or partial else header['duration']
+        emit_result('stream', id, bytes_received, server_duration, 0, stop, udp, tcpinfo, partial=partial, **get_server_fields(header))
+        return
+    results = generate_table(udp is not None, sending=header['mode'] == MODE_REVERSE, tcpinfo=tcpinfo is not None)     #Create empty table ready to hold data rows
+    #If client has selected -n, or the test did not run to the end:
+    if header['num'] > 0 or partial:
+        row = generate_row(bytes_received, server_duration, id, 0, server_duration, results)     #Display stats with actual server duration
+    else:   
+        row = generate_row(bytes_received, server_duration, id, 0, header['duration'], results)  #Otherwise display -t duration
+    if udp is not None:
+        row += generate_udp_columns(udp)                #Add receive statistics of the datagrams
+    if tcpinfo is not None:
+        row += generate_tcpinfo_columns(tcpinfo)        #Add final kernel TCP statistics
+    display_results(results)                            #Print complete table
+
+
+#FUNCTION: Creates the receive statistics of a UDP test
+#ARGUMENTS:
+#header: Test parameters received from the client
+#Returns a dictionary with all counters at zero. 'bytes', 'header' and 'start' (server time.monotonic() at the start of the test) are kept under the
+#same keys as for TCP tests, so that tests still in progress can be reported the same way at shutdown.
+def new_udp_stats(header):
+    return {'header': header, 'bytes': 0, 'start': time.monotonic(), 'datagrams': 0, 'lost': 0, 'out_of_order': 0, 'jitter': 0.0,
+            'max_seq': -1, 'transit': None, 'first': None, 'last': None}
+
+
+#FUNCTION: Updates the receive statistics of a UDP test with one datagram
+#ARGUMENTS:
+#stats: Dictionary created by new_udp_stats()
+#view: Buffer holding the datagram
+#n: Size of the datagram in bytes
+#arrival: Time the datagram was received (server time.monotonic())
+#Datagrams from other tests (wrong group/stream ID) or too short to hold a header are ignored. A datagram with a sequence number lower than the
+#highest seen so far is counted as out of order. Jitter is the smoothed mean deviation of the transit time as in RFC 3550: J += (|D| - J)/16, where D
+#is the change in transit time (arrival - send time) between two datagrams. The client and server clocks do not need to be synchronized, because
+#the offset between them cancels out in D.
+def record_datagram(stats, view, n, arrival):
+    if n < DATAGRAM.size:
+        return
+    group_id, stream_id, seq, sent = DATAGRAM.unpack_from(view)
+    header = stats['header']
+    if group_id != header['group_id'] or stream_id != header['stream_id']:
+        return
+    stats['datagrams'] += 1
+    stats['bytes'] += n
+    if seq < stats['max_seq']:
+        stats['out_of_order'] += 1
+    else:
+        stats['max_seq'] = seq
+    transit = arrival - sent
+    if stats['transit'] is not None:
+        stats['jitter'] += (abs(transit - stats['transit']) - stats['jitter'])/16
+    stats['transit'] = transit
+    if stats['first'] is None:
+        stats['first'] = arrival
+    stats['last'] = arrival
+
+
+#FUNCTION: Completes the receive statistics of a UDP test once the client has finished
+#ARGUMENTS:
+#stats: Dictionary created by new_udp_stats()
+#datagrams_sent: Number of datagrams the client reports it has sent
+#Calculates the number of lost datagrams and returns the server duration, which is the time between the first and the last datagram received.
+def finish_udp_stats(stats, datagrams_sent):
+    stats['lost'] = max(datagrams_sent - stats['datagrams'], 0)
+    if stats['first'] is None:
+        return 0
+    return stats['last'] - stats['first']
+
+
+#FUNCTION: Server-side code for a UDP test (only used for clients running with -u)
+#ARGUMENTS:
+#connectionSocket, addr: The control connection with the client and the client's host/port
+#header: Test parameters received from the client
+#Opens a UDP socket on a free port for this test only and sends the port to the client. Datagrams are received into one preallocated buffer. The
+#thread waits on both sockets with a selector, and each time the UDP socket is ready it reads datagrams until none are left, so the selector is not
+#called once per datagram. When the client sends its trailer on the control connection, the interval rows stop (so the grace period does not show
+#up as an empty last interval), and the server keeps receiving for UDP_GRACE seconds after the last datagram, then sends the results and the
+#receive statistics to the client. In a UDP latency test, every datagram is a probe which is sent
+#straight back to the client. If the control connection fails, an error message is printed and the datagrams received so far are reported as a
+#partial test.
+def udp_connHandler(connectionSocket, addr, header):
+    id = f'{addr[0]}:{addr[1]}'                         #Label for the ID column
+    echo = header['mode'] == MODE_UDP_LATENCY           #Send probes back in a latency test
+    udpSocket = socket(AF_INET, SOCK_DGRAM)             #Prepare a UDP (SOCK_DGRAM) server socket using IPv4 (AF_INET)
+    udpSocket.bind((args.bind, 0))                      #Bind to any free port
+    udpSocket.setblocking(False)
+    stats = new_udp_stats(header)
+    view = memoryview(bytearray(65536))                 #Preallocated receive buffer large enough for any datagram
+    selector = selectors.DefaultSelector()
+    selector.register(udpSocket, selectors.EVENT_READ)
+    selector.register(connectionSocket, selectors.EVENT_READ)
+    datagrams_sent = None                               #Set when the client's trailer has been received
+    partial = False                                     #Set if the control connection fails
+    intervals = start_server_intervals(lambda: stats['bytes'], id, fields=get_server_fields(header))     #Prints interval rows with -i
+    series, recorder = start_recorder(lambda: stats['bytes'], header)   #Records intervals for the client if it has selected -i
+    #EXCEPTION HANDLING
+    try:
+        connectionSocket.sendall(UDP_READY.pack(udpSocket.getsockname()[1]))    #Tell client which port to send datagrams to
+        #Until the client has finished and no datagram has arrived for UDP_GRACE seconds:
+        while True:
+            events = selector.select(UDP_GRACE if datagrams_sent is not None else None)
+            if not events:
+                break
+            for key, _ in events:
+                if key.fileobj is udpSocket:
+                    #Read datagrams until none are left
+                    while True:
+                        try:
+                            n, peer = udpSocket.recvfrom_into(view)
+                        except BlockingIOError:
+                            break
+                        record_datagram(stats, view, n, time.monotonic())
+                        if echo:
+                            udpSocket.sendto(view[:n], peer)
+                else:
+                    datagrams_sent, = UDP_TRAILER.unpack(recv_exact(connectionSocket, UDP_TRAILER.size))  #Client has finished sending
+                    selector.unregister(connectionSocket)
+                    stop_server_intervals(intervals)    #The last interval ends here, not after the grace period
+                    stop_server_intervals(recorder)
+    except (ConnectionError, OSError, struct.error) as e:
+        print(f'Error: connection with client {id} failed ({e})', file=get_message_file())
+        partial = True
+    stop_server_intervals(intervals)
+    stop_server_intervals(recorder)
+    selector.close()
+    udpSocket.close()
+    server_duration = finish_udp_stats(stats, datagrams_sent if datagrams_sent is not None else stats['datagrams'])     #Losses are unknown without the trailer
+    if not partial:
+        try:
+            connectionSocket.sendall(pack_results(STATUS_OK, stats['bytes'], server_duration, stats, series))    #Server sends results and statistics to client
+        except OSError as e:
+            print(f'Error: connection with client {id} failed ({e})', file=get_message_file())
+            partial = True
+    connectionSocket.close()
+    display_server_results(header, stats['bytes'], server_duration, id, partial=partial, udp=stats)
+
+
+#FUNCTION: Server-side code for a TCP latency test (only used for clients running with -L or --probe)
+#ARGUMENTS:
+#connectionSocket, addr: The connection with the client and the client's host/port
+#header: Test parameters received from the client
+#Sends every probe straight back to the client until the client half-closes the connection, then sends the results.
+def latency_connHandler(connectionSocket, addr, header):
+    connectionSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  #Send each reply at once
+    probe = memoryview(bytearray(PROBE.size))           #Preallocated probe buffer
+    probes = 0                                          #Initialize counter for number of probes echoed
+    start_time = time.monotonic()
+    #Until the client closes its side of the connection:
+    while True:
+        received = 0
+        while received < PROBE.size:
+            n = connectionSocket.recv_into(probe[received:])
+            if n == 0:
+                break
+            received += n
+        if received < PROBE.size:                       #End of stream
+            break
+        connectionSocket.sendall(probe)                 #Send probe back unchanged
+        probes += 1
+    server_duration = time.monotonic() - start_time
+    connectionSocket.sendall(pack_results(STATUS_OK, probes*PROBE.size, server_duration))    #Server sends results to client
+    connectionSocket.close()
+    display_server_results(header, probes*PROBE.size, server_duration, f'{addr[0]}:{addr[1]}')
+
+
+#FUNCTION: Server-side code for a transaction test on a persistent connection (only used for clients running with --rr)
+#ARGUMENTS:
+#connectionSocket, addr: The connection with the client and the client's host/port
+#header: Test parameters received from the client
+#Answers every request (of the block size in the header) with a response of the size in the header, until the client half-closes the connection,
+#then sends the results. If the connection fails, an error message is printed and the connection is dropped.
+def rr_connHandler(connectionSocket, addr, header):
+    request = memoryview(bytearray(header['block_size']))    #Preallocated request buffer
+    response = bytes(header['response_size'])
+    transactions = 0                                    #Initialize counter for number of transactions answered
+    start_time = time.monotonic()
+    #EXCEPTION HANDLING
+    try:
+        connectionSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  #Send each response at once
+        #Until the client closes its side of the connection:
+        while True:
+            received = 0
+            while received < len(request):
+                n = connectionSocket.recv_into(request[received:])
+                if n == 0:
+                    break
+                received += n
+            if received < len(request):                 #End of stream
+                break
+            connectionSocket.sendall(response)
+            transactions += 1
+        server_duration = time.monotonic() - start_time
+        connectionSocket.sendall(pack_results(STATUS_OK, transactions*len(request), server_duration))     #Server sends results to client
+    except OSError as e:
+        print(f'Error: connection with client {addr[0]}:{addr[1]} failed ({e})', file=get_message_file())
+        return
+    finally:
+        connectionSocket.close()
+    display_server_transactions(header, transactions, server_duration, f'{addr[0]}:{addr[1]}')
+
+
+#FUNCTION: Prints the results of a --rr test on the server
+#ARGUMENTS:
+#header: Test parameters received from the client
+#transactions: Number of requests answered
+#server_duration: Duration of the test measured by the server
+#id: Client IP:remote port
+#With --json or --csv, a transactions record is written instead.
+def display_server_transactions(header, transactions, server_duration, id):
+    rate = transactions/server_duration if server_duration > 0 else 0
+    if args.json or args.csv:
+        emit_record({'type': 'transactions', 'id': id, 'transactions': transactions, 'seconds': server_duration, 'transactions_per_second': rate,
+                     'stream_id': header['stream_id'], 'group_id': header['group_id']})
+        return
+    display_results([['ID', 'Interval', 'Transactions', 'Rate'], [id, f'0.0 - {server_duration:.1f}', f'{transactions}', f'{rate:.1f} trans/s']])
+
+
+#FUNCTION: Server-side code for a reverse test (only used for clients running with -R or --bidir)
+#ARGUMENTS:
+#connectionSocket, addr: The connection with the client and the client's host/port
+#header: Test parameters received from the client
+#Sends data to the client with send_stream(), for the duration or number of bytes in the header and in blocks of the size in the header, then
+#half-closes the connection and waits for the client's results, which tell the server that all data has arrived.
+def reverse_connHandler(connectionSocket, addr, header):
+    id = f'{addr[0]}:{addr[1]}'                         #Label for the ID column
+    if args.interval is not None:
+        display_results(generate_table(sending=True, tcpinfo=args.tcpinfo))    #Print headers in empty table, interval rows are printed underneath as they come in
+    bytes_to_send = header['num'] if header['num'] > 0 else None
+    bytes_sent, start_time = send_stream(connectionSocket, header['block_size'], bytes_to_send, header['duration'], id, header['rate'], header['burst'],
+                                         fields=get_server_fields(header), pacing_offload=header['pacing_offload'])
+    connectionSocket.shutdown(SHUT_WR)                  #Finished sending data - half-close the connection to signal end of test to client
+    recv_results(connectionSocket)                      #Wait for results message from client (acts as ACK)
+    server_duration = time.monotonic() - start_time
+    tcpinfo = read_tcp_info(connectionSocket) if args.tcpinfo else None     #Final kernel TCP statistics, once all data has been acknowledged
+    connectionSocket.close()
+    display_server_results(header, bytes_sent, server_duration, id, tcpinfo=tcpinfo)
 
 
 #FUNCTION: Connection handler - contains server-side code to be performed for each active connection
 #ARGUMENTS:
 #connectionSocket, addr: The value returned by socket.accept() in the main function, where connectionSocket is an active socket object and addr
 #is the host/port bound to that socket object
-#This function handles the code that is performed server side for each connection that is established
-def connHandler(connectionSocket,addr):
-    data = bytearray()                                  #Initialize an empty byte array to keep track of number of bytes received 
-    duration_from_client = connectionSocket.recv(3)     #Server receives duration (-t) from client as fixed-length message
-    duration = int(duration_from_client.decode('utf-8'))    #Convert duration string to int
-    start_time_from_client = connectionSocket.recv(16)  #Server receives start time from client as fixed-length message
-    start_time = float(start_time_from_client.decode('utf-8').strip('\0'))  #Convert start time string (minus any trailing zeroes) to float
-    results = generate_table()                          #Create empty table ready to hold data rows
-
-    #Only if -n is selected and client sends message:
-    if b'NUM' in connectionSocket.recv(16):              
-        num = True                                      #Set num to True if client sends message 
-    else:
-        num = False                                     #Otherwise set num to False
+#header: Test parameters received from the client, which serve() has already read
+#This function handles the code that is performed server side for each connection that is established, except --crr transactions (see serve())
+def connHandler(connectionSocket, addr, header):
+    #The test is timed with the server's own clock from the moment the header arrives, so clock differences between client and server do not
+    #change the receiver's duration
+    start_time = time.monotonic()
+    #If the client asked for a test this server cannot run, tell the client and drop the connection
+    try:
+        check_header(header)
+    except ValueError as e:
+        print(f'Error: client {addr[0]}:{addr[1]} asked for an unsupported test ({e})', file=get_message_file())
+        connectionSocket.sendall(pack_results(STATUS_UNSUPPORTED))
+        connectionSocket.close()
+        return
+    print(f'A simpleperf client with {addr[0]}:{addr[1]} is connected with {args.bind}:{args.port}', file=get_message_file())     #Print confirmation of client connection
+    if args.json or args.csv:
+        emit_record({'type': 'start', 'id': f'{addr[0]}:{addr[1]}', **header, 'mode': MODE_NAMES.get(header['mode'], header['mode'])})     #Record the test parameters of the connection
+
+    #UDP, latency and transaction tests are handled separately
+    if header['mode'] in (MODE_UDP, MODE_UDP_LATENCY):
+        udp_connHandler(connectionSocket, addr, header)
+        return
+    if header['mode'] == MODE_LATENCY:
+        latency_connHandler(connectionSocket, addr, header)
+        return
+    if header['mode'] == MODE_RR:
+        rr_connHandler(connectionSocket, addr, header)
+        return
+    if header['mode'] == MODE_REVERSE:
+        reverse_connHandler(connectionSocket, addr, header)
+        return
     
-    #While the client is connected:
-    while True:                                                            
-        packet = connectionSocket.recv(1000)            #Receive packets of data from client
-        data.extend(packet)                             #Add packets to byte array (length of array gives number of bytes received) 
-        #When the server recvs BYE message from client:
-        if b'BYE' in packet:                            
-            stop_time = time.time()                     #Stop timer when BYE received
-            server_duration = stop_time - start_time    #Calculate server duration
-            connectionSocket.send('ACK: BYE'.encode())  #Server sends ACK to client
-            break  
-       
-    #If client has selected -n (and sent message to server):
-    if num:
-        generate_row(len(data), server_duration, addr[0], addr[1], 0, server_duration, results)     #Display stats with actual server duration
-    else:   
-        generate_row(len(data), server_duration, addr[0], addr[1], 0, duration, results)            #Otherwise display -t duration
-    display_results(results)                            #Print complete table
+    counter = [0]                                       #Running count of bytes received, shared with the timer thread
+    intervals = start_server_intervals(lambda: counter[0], f'{addr[0]}:{addr[1]}', connectionSocket if args.tcpinfo else None, get_server_fields(header))  #Prints interval rows with -i
+    series, recorder = start_recorder(lambda: counter[0], header)   #Records intervals for the client if it has selected -i
+    storage_time = None                                 #Time spent writing to storage with --output-dir
+    #Receive and count data until the client half-closes the connection
+    if args.output_dir is not None:
+        path = os.path.join(args.output_dir, f'{addr[0]}_{addr[1]}.dat')
+        bytes_received, storage_time = receive_to_file(connectionSocket, path, counter)
+    elif args.splice:
+        bytes_received = receive_splice(connectionSocket, counter)
+    else:
+        bytes_received = receive_data(connectionSocket, get_block_size(), counter)
+    stop_server_intervals(intervals)
+    stop_server_intervals(recorder)
+    stop_time = time.monotonic()                        #Stop timer when client has finished sending
+    server_duration = stop_time - start_time            #Calculate server duration
+    tcpinfo = read_tcp_info(connectionSocket) if args.tcpinfo else None     #Final kernel TCP statistics
+    connectionSocket.sendall(pack_results(STATUS_OK, bytes_received, server_duration, intervals=series))    #Server sends results to client (acts as ACK)
+    connectionSocket.close()                            #Close connection socket when the test is finished
+    display_server_results(header, bytes_received, server_duration, f'{addr[0]}:{addr[1]}', tcpinfo=tcpinfo)
+    if storage_time is not None:
+        display_storage_results(f'{addr[0]}:{addr[1]}', bytes_received, storage_time, 'write')
     
     
+#FUNCTION: Receives a message of an exact length in the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket: A non-blocking socket with a connection to a client
+#size: Number of bytes to receive
+#Same as recv_exact(), but waits for data through the event loop instead of blocking the thread.
+async def async_recv_exact(connectionSocket, size):
+    loop = asyncio.get_running_loop()
+    message = bytearray(size)                           #Buffer which holds exactly one message
+    view = memoryview(message)
+    received = 0                                        #Initialize counter for number of bytes received so far
+    while received < size:
+        n = await loop.sock_recv_into(connectionSocket, view[received:])
+        if n == 0:
+            raise ConnectionError('connection closed before the whole message was received')
+        received += n
+    return message
+
+
+#FUNCTION: Prints a row after each interval for a connection in the event-loop server (only used in conjunction with -i)
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received (or sent, in reverse mode) so far
+#id: Client IP:remote port
+#sending: True if the server is the sending side (reverse mode)
+#sock: Socket whose kernel TCP statistics are added to each row (None if --tcpinfo is not selected, or for UDP tests)
+#fields: Other fields of the interval records (see get_server_fields())
+#Does the same as run_timer() without a duration, but as a task which sleeps in the event loop. When the task is cancelled at the end of the test,
+#it prints the row for the last interval.
+async def async_report_intervals(sample, id, sending=False, sock=None, fields=None):
+    display_results(generate_table(sending=sending, tcpinfo=sock is not None))    #Print headers in empty table, interval rows are printed underneath as they come in
+    start_time = time.monotonic()
+    last = [start_time, 0, 0]                           #Time, byte count and position at the end of the previous interval
+    k = 1                                               #Number of the next interval boundary
+    try:
+        while True:
+            boundary = start_time + k*args.interval
+            await asyncio.sleep(max(boundary - time.monotonic(), 0))
+            display_interval(sample, id, start_time, last, k*args.interval, sock, fields)
+            k += 1
+    except asyncio.CancelledError:
+        stop = time.monotonic() - start_time
+        if stop - last[2] >= 0.01*args.interval:
+            display_interval(sample, id, start_time, last, stop, sock, fields)
+
+
+#FUNCTION: Records the bytes received in each interval in the event-loop server, to be sent back to the client
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received so far
+#interval: Length of each interval in seconds (the client's -i value)
+#series: List which (start, stop, bytes) is appended to after each interval
+#Does the same as record_intervals(), but as a task which sleeps in the event loop. When the task is cancelled at the end of the test, it adds
+#the last interval.
+async def async_record_intervals(sample, interval, series):
+    start_time = time.monotonic()
+    last = [0, 0]                                       #Byte count and position at the end of the previous interval
+    k = 1                                               #Number of the next interval boundary
+    try:
+        while True:
+            await asyncio.sleep(max(start_time + k*interval - time.monotonic(), 0))
+            bytes = sample()
+            series.append((last[1], k*interval, bytes - last[0]))
+            last = [bytes, k*interval]
+            k += 1
+    except asyncio.CancelledError:
+        stop = time.monotonic() - start_time
+        if stop - last[1] >= 0.01*interval:
+            series.append((last[1], stop, sample() - last[0]))
+
+
+#FUNCTION: Starts recording the bytes received in each interval for the client in the event-loop server
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received so far
+#header: Test parameters received from the client
+#Returns the list the intervals are recorded in, and the task to pass to stop_async_intervals() (None if the client has not selected -i).
+def start_async_recorder(sample, header):
+    series = []
+    if not header['interval']:
+        return series, None
+    return series, asyncio.create_task(async_record_intervals(sample, header['interval'], series))
+
+
+#FUNCTION: Starts and stops interval rows in the event-loop server
+#ARGUMENTS:
+#sample: Function which returns the number of bytes received so far
+#id: Client IP:remote port
+#sending: True if the server is the sending side (reverse mode)
+#sock: Socket whose kernel TCP statistics are added to each row (None if --tcpinfo is not selected, or for UDP tests)
+#fields: Other fields of the interval records (see get_server_fields())
+#start_async_intervals() returns the task, or None if -i is not selected; stop_async_intervals() cancels it and waits for the last row (stopping
+#the task again has no effect).
+def start_async_intervals(sample, id, sending=False, sock=None, fields=None):
+    if args.interval is None:
+        return None
+    return asyncio.create_task(async_report_intervals(sample, id, sending, sock, fields))
+
+
+async def stop_async_intervals(task):
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+#FUNCTION: Connection handler for the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket, addr: The value returned by sock_accept(), where connectionSocket is a non-blocking socket object and addr is the client's host/port
+#active: Dictionary of the connections currently being served, which this handler adds itself to while it is receiving data
+#Does the same as connHandler(), but as a coroutine, so that one thread can serve many connections at once. The byte count of the connection is
+#kept in the active dictionary, so that if the server is shut down during the test, the results so far can still be printed (see async_serve()).
+async def async_connHandler(connectionSocket, addr, active):
+    loop = asyncio.get_running_loop()
+    id = f'{addr[0]}:{addr[1]}'                         #Label for the ID column
+    try:
+        #EXCEPTION HANDLING
+        try:
+            header = parse_header(await async_recv_exact(connectionSocket, HEADER.size))    #Receive test parameters from client
+        except (ValueError, ConnectionError) as e:
+            print(f'Error: client {id} sent an invalid header ({e})', file=get_message_file())     #Print error message and drop the connection
+            return
+        start_time = time.monotonic()                   #Server's own start time of the test (see connHandler())
+        #If the client asked for a test this server cannot run, tell the client and drop the connection
+        try:
+            check_header(header)
+        except ValueError as e:
+            print(f'Error: client {id} asked for an unsupported test ({e})', file=get_message_file())
+            await loop.sock_sendall(connectionSocket, pack_results(STATUS_UNSUPPORTED))
+            return
+        if header['mode'] == MODE_CRR:
+            await async_crr_handler(connectionSocket, header)   #One transaction per connection, handled without messages or records
+            return
+        print(f'A simpleperf client with {id} is connected with {args.bind}:{args.port}', file=get_message_file())     #Print confirmation of client connection
+        if args.json or args.csv:
+            emit_record({'type': 'start', 'id': id, **header, 'mode': MODE_NAMES.get(header['mode'], header['mode'])})     #Record the test parameters of the connection
+
+        #UDP, latency and transaction tests are handled separately
+        if header['mode'] in (MODE_UDP, MODE_UDP_LATENCY):
+            await async_udp_handler(connectionSocket, id, header, active)
+            return
+        if header['mode'] == MODE_LATENCY:
+            await async_latency_handler(connectionSocket, id, header)
+            return
+        if header['mode'] == MODE_RR:
+            await async_rr_handler(connectionSocket, id, header)
+            return
+        if header['mode'] == MODE_REVERSE:
+            await async_reverse_handler(connectionSocket, id, header, active)
+            return
+
+        stats = {'header': header, 'bytes': 0, 'start': start_time}     #Byte counter of this connection
+        active[id] = stats
+        view = memoryview(bytearray(get_block_size()))  #Preallocated receive buffer, reused for every read
+        intervals = start_async_intervals(lambda: stats['bytes'], id, sock=connectionSocket if args.tcpinfo else None, fields=get_server_fields(header))   #Prints interval rows with -i
+        series, recorder = start_async_recorder(lambda: stats['bytes'], header)     #Records intervals for the client if it has selected -i
+        #Until the client closes its side of the connection:
+        while True:
+            n = await loop.sock_recv_into(connectionSocket, view)
+            if n == 0:                                  #0 bytes means end of stream
+                break
+            stats['bytes'] += n
+        await stop_async_intervals(intervals)
+        await stop_async_intervals(recorder)
+        del active[id]                                  #Test finished, so the results no longer need to be printed at shutdown
+        server_duration = time.monotonic() - start_time     #Calculate server duration
+        tcpinfo = read_tcp_info(connectionSocket) if args.tcpinfo else None     #Final kernel TCP statistics
+        await loop.sock_sendall(connectionSocket, pack_results(STATUS_OK, stats['bytes'], server_duration, intervals=series))    #Server sends results to client
+        display_server_results(header, stats['bytes'], server_duration, id, tcpinfo=tcpinfo)
+    except OSError as e:
+        active.pop(id, None)
+        print(f'Error: connection with client {id} failed ({e})', file=get_message_file())
+    finally:
+        connectionSocket.close()                        #Close connection socket when the test is finished
+
+
+#FUNCTION: Server-side code for a UDP test in the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket: The control connection with the client (non-blocking)
+#id: Client IP:remote port
+#header: Test parameters received from the client
+#active: Dictionary of the connections currently being served
+#Does the same as udp_connHandler(), but as a coroutine. Datagrams are received by a reader callback of the event loop while the handler waits for
+#the client's trailer. loop.add_reader() is used rather than loop.sock_recvfrom_into() and loop.sock_sendto(), which only exist from Python 3.11.
+async def async_udp_handler(connectionSocket, id, header, active):
+    loop = asyncio.get_running_loop()
+    echo = header['mode'] == MODE_UDP_LATENCY           #Send probes back in a latency test
+    udpSocket = socket(AF_INET, SOCK_DGRAM)             #Prepare a UDP (SOCK_DGRAM) server socket using IPv4 (AF_INET)
+    udpSocket.bind((args.bind, 0))                      #Bind to any free port
+    udpSocket.setblocking(False)
+    stats = new_udp_stats(header)
+    active[id] = stats
+    view = memoryview(bytearray(65536))                 #Preallocated receive buffer large enough for any datagram
+
+    #FUNCTION: Reads datagrams until none are left, called by the event loop whenever the UDP socket is readable
+    def receive():
+        while True:
+            try:
+                n, peer = udpSocket.recvfrom_into(view)
+            except BlockingIOError:
+                return
+            record_datagram(stats, view, n, time.monotonic())
+            if echo:
+                try:
+                    udpSocket.sendto(view[:n], peer)
+                except BlockingIOError:
+                    pass                                #Reply is dropped, the client will count the probe as lost
+
+    loop.add_reader(udpSocket.fileno(), receive)
+    intervals = start_async_intervals(lambda: stats['bytes'], id, fields=get_server_fields(header))   #Prints interval rows with -i
+    series, recorder = start_async_recorder(lambda: stats['bytes'], header)     #Records intervals for the client if it has selected -i
+    try:
+        await loop.sock_sendall(connectionSocket, UDP_READY.pack(udpSocket.getsockname()[1]))     #Tell client which port to send datagrams to
+        datagrams_sent, = UDP_TRAILER.unpack(await async_recv_exact(connectionSocket, UDP_TRAILER.size))   #Wait until client has finished sending
+        await stop_async_intervals(intervals)           #The last interval ends here, not after the grace period
+        await stop_async_intervals(recorder)
+        #Keep receiving until no datagram has arrived for UDP_GRACE seconds
+        while True:
+            received = stats['datagrams']
+            await asyncio.sleep(UDP_GRACE)
+            if stats['datagrams'] == received:
+                break
+    finally:
+        loop.remove_reader(udpSocket.fileno())
+        await stop_async_intervals(intervals)
+        await stop_async_intervals(recorder)
+        udpSocket.close()
+    del active[id]
+    server_duration = finish_udp_stats(stats, datagrams_sent)
+    await loop.sock_sendall(connectionSocket, pack_results(STATUS_OK, stats['bytes'], server_duration, stats, series))    #Server sends results and statistics to client
+    display_server_results(header, stats['bytes'], server_duration, id, udp=stats)
+
+
+#FUNCTION: Server-side code for a TCP latency test in the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket: The connection with the client (non-blocking)
+#id: Client IP:remote port
+#header: Test parameters received from the client
+#Does the same as latency_connHandler(), but as a coroutine.
+async def async_latency_handler(connectionSocket, id, header):
+    loop = asyncio.get_running_loop()
+    connectionSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  #Send each reply at once
+    probes = 0                                          #Initialize counter for number of probes echoed
+    start_time = time.monotonic()
+    #Until the client closes its side of the connection:
+    while True:
+        try:
+            probe = await async_recv_exact(connectionSocket, PROBE.size)
+        except ConnectionError:                         #End of stream
+            break
+        await loop.sock_sendall(connectionSocket, probe)     #Send probe back unchanged
+        probes += 1
+    server_duration = time.monotonic() - start_time
+    await loop.sock_sendall(connectionSocket, pack_results(STATUS_OK, probes*PROBE.size, server_duration))    #Server sends results to client
+    display_server_results(header, probes*PROBE.size, server_duration, id)
+
+
+#FUNCTION: Server-side code for a --rr test in the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket: The connection with the client (non-blocking)
+#id: Client IP:remote port
+#header: Test parameters received from the client
+#Does the same as rr_connHandler(), but as a coroutine, so thousands of connections can be served by one thread.
+async def async_rr_handler(connectionSocket, id, header):
+    loop = asyncio.get_running_loop()
+    connectionSocket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  #Send each response at once
+    request = memoryview(bytearray(header['block_size']))    #Preallocated request buffer
+    response = bytes(header['response_size'])
+    transactions = 0                                    #Initialize counter for number of transactions answered
+    start_time = time.monotonic()
+    #Until the client closes its side of the connection:
+    while True:
+        received = 0
+        while received < len(request):
+            n = await loop.sock_recv_into(connectionSocket, request[received:])
+            if n == 0:
+                break
+            received += n
+        if received < len(request):                     #End of stream
+            break
+        await loop.sock_sendall(connectionSocket, response)
+        transactions += 1
+    server_duration = time.monotonic() - start_time
+    await loop.sock_sendall(connectionSocket, pack_results(STATUS_OK, transactions*len(request), server_duration))    #Server sends results to client
+    display_server_transactions(header, transactions, server_duration, id)
+
+
+#FUNCTION: Server-side code for one --crr transaction in the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket: The connection with the client (non-blocking), which is closed by async_connHandler() afterwards
+#header: Test parameters received from the client
+#Does the same as dispatch_connection() does for a --crr connection in the threaded server, but as a coroutine.
+async def async_crr_handler(connectionSocket, header):
+    loop = asyncio.get_running_loop()
+    await async_recv_exact(connectionSocket, header['block_size'])
+    await loop.sock_sendall(connectionSocket, bytes(header['response_size']))
+
+
+#FUNCTION: Server-side code for a reverse test in the event-loop server (-e)
+#ARGUMENTS:
+#connectionSocket: The connection with the client (non-blocking)
+#id: Client IP:remote port
+#header: Test parameters received from the client
+#active: Dictionary of the connections currently being served
+#Does the same as reverse_connHandler(), but as a coroutine. On a fast link sock_sendall() can complete without ever waiting, so the send loop
+#yields to the event loop once every ASYNC_SLICE seconds to let other connections and the interval task run. Yielding after every block instead
+#would cost a trip through the event loop per block, which dominates with small blocks. The slice is kept short, because a connection which has to
+#wait for room in its send buffer only gets its next turn after the slice of every other connection. A paced stream sleeps in the event loop
+#instead.
+async def async_reverse_handler(connectionSocket, id, header, active):
+    loop = asyncio.get_running_loop()
+    stats = {'header': header, 'bytes': 0, 'start': time.monotonic()}     #Byte counter of this connection
+    active[id] = stats
+    block_size = header['block_size']
+    view = memoryview(bytearray(block_size))            #Preallocated zero-filled buffer, reused for every block
+    bytes_to_send = header['num'] if header['num'] > 0 else None
+    pacer = get_pacer(connectionSocket, header['rate'], block_size, header['burst'], header['pacing_offload'])    #Token-bucket pacer (None if not paced in simpleperf)
+    start_time = time.monotonic()
+    deadline = start_time + header['duration'] if bytes_to_send is None else float('inf')    #End of a timed test
+    intervals = start_async_intervals(lambda: stats['bytes'], id, sending=True, sock=connectionSocket if args.tcpinfo else None,
+                                      fields=get_server_fields(header))    #Prints interval rows with -i
+    next_yield = start_time + ASYNC_SLICE               #Time the send loop next yields to the event loop
+    #Until the byte target or the end of the test is reached:
+    while (stats['bytes'] < bytes_to_send if bytes_to_send is not None else time.monotonic() < deadline):
+        n = min(bytes_to_send - stats['bytes'], block_size) if bytes_to_send is not None else block_size
+        delay = pacer_wait(pacer, n) if pacer is not None else 0
+        if delay:
+            await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))   #Sleep until the pacer has tokens for the block
+            continue
+        await loop.sock_sendall(connectionSocket, view[:n])
+        stats['bytes'] += n
+        now = time.monotonic()
+        if now >= next_yield:
+            await asyncio.sleep(0)                      #Yield to the event loop
+            next_yield = now + ASYNC_SLICE
+    await stop_async_intervals(intervals)
+    connectionSocket.shutdown(SHUT_WR)                  #Finished sending data - half-close the connection to signal end of test to client
+    await async_recv_exact(connectionSocket, RESULTS.size)    #Wait for results message from client (acts as ACK)
+    del active[id]
+    tcpinfo = read_tcp_info(connectionSocket) if args.tcpinfo else None     #Final kernel TCP statistics, once all data has been acknowledged
+    display_server_results(header, stats['bytes'], time.monotonic() - start_time, id, tcpinfo=tcpinfo)
+
+
+#FUNCTION: Accepts and serves client connections in an event loop (-e)
+#ARGUMENTS:
+#serverSocket: A listening server socket
+#Accepts connections and runs async_connHandler() for each of them as a task in the same thread. A semaphore limits the number of connections
+#served at once to --max-clients; further connections wait in the socket backlog until a test finishes. On SIGINT or SIGTERM the server stops
+#accepting, prints the results so far of every test still in progress, and closes all connections.
+async def async_serve(serverSocket):
+    loop = asyncio.get_running_loop()
+    serverSocket.setblocking(False)                     #The event loop needs a non-blocking socket
+    stop = asyncio.Event()                              #Set when the server should shut down
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    limit = asyncio.Semaphore(args.max_clients)         #Limits the number of connections served at once
+    active = {}                                         #Connections currently receiving data, by client IP:port
+    tasks = set()                                       #Handler tasks still running
+
+    #FUNCTION: Accepts connections until the server is shut down
+    async def accept_loop():
+        while True:
+            await limit.acquire()                       #Wait for a free slot before accepting another connection
+            connectionSocket,addr = await loop.sock_accept(serverSocket)
+            task = asyncio.create_task(async_connHandler(connectionSocket, addr, active))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)       #Forget task when finished
+            task.add_done_callback(lambda _: limit.release())   #Free the slot when finished
+
+    acceptor = asyncio.create_task(accept_loop())
+    await stop.wait()                                   #Run until SIGINT/SIGTERM
+    acceptor.cancel()                                   #Stop accepting new connections
+    #Print the results so far of every test still in progress
+    for id, stats in list(active.items()):
+        print(f'Shutting down: test with {id} still in progress', file=get_message_file())
+        display_server_results(stats['header'], stats['bytes'], time.monotonic() - stats['start'], id, partial=True)
+    for task in list(tasks):
+        task.cancel()                                   #Stop handlers, which close their connections
+    await asyncio.gather(acceptor, *tasks, return_exceptions=True)
+
+
+#FUNCTION: Moves a new connection on by one step in the threaded server
+#ARGUMENTS:
+#dispatcher: The selector of serve()
+#connectionSocket: A non-blocking connection with a client, registered with the dispatcher
+#state: Dictionary with the client's host/port, the bytes of the message being received, the header once it is complete, and the response still
+#to be sent in a --crr transaction
+#Reads the header without blocking, at most up to its end, so that no test data is taken from the socket. Once the header is complete, every test
+#except --crr gets a thread of its own which runs connHandler() on a blocking socket. A --crr connection is a single transaction, so the
+#dispatcher serves it itself: it reads the request, sends the response and closes the connection, without a thread. The server closes first, so
+#the TIME_WAIT state is held here and the client does not run out of ports. Nothing is printed for these connections, since a test opens
+#thousands of them per second.
+def dispatch_connection(dispatcher, connectionSocket, state):
+    addr = state['addr']
+    #EXCEPTION HANDLING
+    try:
+        if state['response'] is not None:               #Sending the response of a --crr transaction
+            state['response'] = state['response'][connectionSocket.send(state['response']):]
+            if not state['response']:
+                dispatcher.unregister(connectionSocket)
+                connectionSocket.close()
+            return
+        size = HEADER.size if state['header'] is None else state['header']['block_size']   #Size of the message being received
+        data = connectionSocket.recv(size - len(state['message']))
+        if not data:
+            raise ConnectionError('connection closed before the whole message was received')
+        state['message'] += data
+        if len(state['message']) < size:
+            return
+        if state['header'] is not None:                 #The --crr request is complete
+            state['response'] = memoryview(bytes(state['header']['response_size']))
+            dispatcher.modify(connectionSocket, selectors.EVENT_WRITE, state)
+            return
+        header = parse_header(bytes(state['message']))
+    except BlockingIOError:
+        return                                          #Nothing to read or send yet
+    except (ValueError, OSError) as e:
+        dispatcher.unregister(connectionSocket)
+        connectionSocket.close()
+        if state['header'] is None:
+            print(f'Error: client {addr[0]}:{addr[1]} sent an invalid header ({e})', file=get_message_file())     #Print error message and drop the connection
+        return                                          #Otherwise the client gave up on the --crr transaction
+    state['message'] = bytearray()
+    if header['mode'] == MODE_CRR:
+        try:
+            check_header(header)
+            state['header'] = header                    #Wait for the request
+            return
+        except ValueError:
+            pass                                        #connHandler() rejects the test
+    dispatcher.unregister(connectionSocket)
+    connectionSocket.setblocking(True)
+    thread.start_new_thread(connHandler,(connectionSocket,addr,header))    #Spawn a new thread for each test
+
+
+#FUNCTION: Accepts client connections on the server socket for as long as the server runs
+#ARGUMENTS:
+#serverSocket: A listening server socket
+#worker: Number of this server process (only used in conjunction with -w and -A)
+#Accepts connections and reads their headers with a selector in this thread, then spawns a new thread for each test (see dispatch_connection()),
+#or with -e, serves all connections from one event loop. With -w, several processes run this function on the same listening socket, and the
+#kernel hands each new connection to one of them; the socket is non-blocking, so a worker which loses the race for a connection does not hang.
+def serve(serverSocket, worker=0):
+    if args.affinity:
+        pin_cpu(worker)                                         #Pin worker to its own core
+    if args.eventloop:
+        asyncio.run(async_serve(serverSocket))                  #Returns after a graceful shutdown
+        return
+    serverSocket.setblocking(False)
+    dispatcher = selectors.DefaultSelector()
+    dispatcher.register(serverSocket, selectors.EVENT_READ)
+    #While server socket is open and listening:
+    while True:
+        for key, _ in dispatcher.select():
+            if key.fileobj is not serverSocket:
+                dispatch_connection(dispatcher, key.fileobj, key.data)
+                continue
+            try:
+                connectionSocket,addr = serverSocket.accept()   #Accept connection request from client and create new connection socket with info about the client (addr)
+            except BlockingIOError:
+                continue                                        #Another worker accepted the connection first
+            connectionSocket.setblocking(False)
+            dispatcher.register(connectionSocket, selectors.EVENT_READ, {'addr': addr, 'message': bytearray(), 'header': None, 'response': None})
+
+
 #MAIN FUNCTION
 def main():
+    global start_barrier
+    if args.json and args.csv:
+        sys.exit('Error: --json and --csv cannot be used together')
+    if args.csv:
+        csv.writer(sys.stdout).writerow(RECORD_FIELDS)          #Column names, written once before any record
+        sys.stdout.flush()
     #ERROR HANDLING IF NEITHER/BOTH MODES SELECTED
     if (not args.client and not args.server) or (args.client and args.server):
         sys.exit('Error: you must run either in server or client mode')
@@ -278,6 +2551,21 @@ def main():
     elif args.server:
         check_port(args.port)                                   #Check port
         validate_ip(args.bind)                                  #Check IP address
+        #EXCEPTION HANDLING
+        if args.workers < 1:
+            raise ValueError('Number of server workers must be at least 1')     #Print error message if -w is less than 1
+        if args.max_clients < 1:
+            raise ValueError('Maximum number of clients must be at least 1')    #Print error message if --max-clients is less than 1
+        if args.tcpinfo and 'TCP_INFO' not in globals():
+            raise ValueError('--tcpinfo is not supported on this platform')     #Print error message if the OS has no TCP_INFO socket option
+        if args.output_dir is not None and args.splice:
+            raise ValueError('--output-dir and --splice cannot be used together')
+        if (args.output_dir is not None or args.splice) and args.eventloop:
+            raise ValueError('--output-dir and --splice cannot be used with -e')    #Storage writes and splice() would block the event loop
+        if args.output_dir is not None and not os.path.isdir(args.output_dir):
+            raise ValueError(f'{args.output_dir} is not a directory')      #Print error message if --output-dir does not exist
+        if args.splice and not hasattr(os, 'splice'):
+            raise ValueError('--splice is not supported on this platform')     #Print error message if the OS (or Python before 3.10) has no splice()
         serverSocket = socket(AF_INET, SOCK_STREAM)             #Prepare a TCP (SOCK_STREAM) server socket using IPv4 (AF_INET)
         try:
             serverSocket.bind((args.bind, args.port))                       
@@ -285,14 +2573,17 @@ def main():
         except:
             print('Bind failed. Error: ')                       #Print error message and terminate program if socket binding fails 
             sys.exit()
-        serverSocket.listen(5)                                  #Listen for incoming connection requests to socket (max 5)
+        serverSocket.listen(args.backlog)                       #Listen for incoming connection requests to socket (--backlog, system maximum by default)
         print_msg(f'A simpleperf server is listening on port {args.port}')    #Print message when socket ready to receive
-        #While server socket is open and listening:
-        while True:
-            connectionSocket,addr = serverSocket.accept()       #Accept connection request from client and create new connection socket with info about the client (addr)
-            print(f'A simpleperf client with {addr[0]}:{addr[1]} is connected with {args.bind}:{args.port}')     #Print confirmation of client connection
-            thread.start_new_thread(connHandler,(connectionSocket,addr))    #Spawn a new thread for each client connection accepted
-        connectionSocket.close()                                #Close connection socket when all client sockets are closed
+        workers = []                                            #List to keep track of extra worker processes
+        #Start the extra worker processes, which inherit the listening socket
+        for worker in range(1, args.workers):
+            p = multiprocessing.Process(target=serve, args=(serverSocket, worker), daemon=True)
+            workers.append(p)
+            p.start()
+        serve(serverSocket)                                     #Main process is worker 0
+        for p in workers:
+            p.join(timeout=5)                                   #Give the other workers time to print their results on shutdown
         serverSocket.close()                                    #Close server socket
     #Then run client
     else:
@@ -300,25 +2591,105 @@ def main():
         #EXCEPTION HANDLING
         if args.time <= 0:
             raise ValueError('Total duration in seconds must be greater than 0')     #Print error message if duration (-t) is less than 0
+        if args.parallel < 1:
+            raise ValueError('Number of parallel connections must be at least 1')     #Print error message if -P is less than 1
         
-        conn = []                                               #List to keep track of all the newly joined connections
-
-        #For each parallel connection specified in -P:
-        for p in range(args.parallel):
-            clientSocket = socket(AF_INET, SOCK_STREAM)         #Prepare a TCP (SOCK_STREAM) client socket using IPv4 (AF_INET)
-            clientSocket.connect((args.serverip,args.port))     #Connect client socket to specified server IP/port and initiate three-way handshake
-            print(f'Client {clientSocket.getsockname()} connected with server {args.serverip}, port {args.port}')    #Print message when client successfully connected      
-            conn.append(clientSocket)                           #Add new connection to the list
-    
-        threads = []                                            #List to keep track of threads
-        #For each active client socket:
-        for clientSocket in conn:
-            t = threading.Thread(target=send_data, args=(clientSocket,))    #Create a new thread to send data from the client socket
-            threads.append(t)                                   #Add new thread to the list
-            t.start()                                           #Start all the threads so they run concurrently
-        for t in threads:
-            t.join()                                            #Wait for all threads to complete before continuing
+        if args.probe_interval <= 0:
+            raise ValueError('Time between latency probes must be greater than 0')     #Print error message if --probe-interval is not positive
+        if (args.reverse or args.bidir) and (args.udp or args.latency):
+            raise ValueError('-R and --bidir can only be used with TCP throughput tests')   #Print error message if -R/--bidir is combined with -u or -L
+        get_target_rate()                                       #Check -r and --burst before any stream starts
+        get_burst()
+        if args.tcpinfo and (args.udp or args.latency):
+            raise ValueError('--tcpinfo can only be used with TCP throughput tests')      #Print error message if --tcpinfo is combined with -u or -L
+        if args.tcpinfo and 'TCP_INFO' not in globals():
+            raise ValueError('--tcpinfo is not supported on this platform')     #Print error message if the OS has no TCP_INFO socket option
+        if args.rr and args.crr:
+            raise ValueError('--rr and --crr cannot be used together')     #Print error message if both transaction modes are selected
+        if (args.rr or args.crr) and (args.udp or args.latency or args.reverse or args.bidir or args.probe or args.num is not None
+                                      or args.interval is not None or args.tcpinfo):
+            raise ValueError('--rr and --crr cannot be used with -u, -L, -R, --bidir, --probe, -n, -i or --tcpinfo')
+        if args.pool < 1:
+            raise ValueError('Number of pooled connections must be at least 1')     #Print error message if --pool is less than 1
+        get_message_size(args.request_size)                     #Check --request-size and --response-size before any stream starts
+        get_message_size(args.response_size)
+        if args.file is not None:
+            if not os.path.isfile(args.file):
+                raise ValueError(f'{args.file} is not a file')     #Print error message if -F is not a regular file
+            if (args.num is not None or args.udp or args.latency or args.reverse or args.bidir or args.rr or args.crr or args.zerocopy):
+                raise ValueError('-F cannot be used with -n, -u, -L, -R, --bidir, --rr, --crr or -Z')
+            if os.path.getsize(args.file) < args.parallel:
+                raise ValueError('-F file must have at least one byte per parallel connection')
+            file_read = measure_file_read(args.file)          #Read pass over the file, for the storage throughput
+        
+        group_id = random.getrandbits(32)                       #ID shared by all parallel connections, so the server can tell which belong together
+        #One job per connection: stream ID, group ID and kind of stream. With --bidir, a reverse stream is added for each -P stream, and with --probe,
+        #a latency stream is added to the -P streams.
+        if args.latency:
+            kind = 'latency'
+        elif args.rr or args.crr:
+            kind = 'transactions'
+        elif args.reverse:
+            kind = 'reverse'
+        else:
+            kind = 'send'
+        jobs = [(stream_id, group_id, kind) for stream_id in range(args.parallel)]
+        if args.bidir:
+            jobs += [(args.parallel + stream_id, group_id, 'reverse') for stream_id in range(args.parallel)]
+        if args.probe and not args.latency:
+            jobs.append((len(jobs), group_id, 'latency'))
+        if args.json or args.csv:
+            if args.latency:
+                mode = MODE_UDP_LATENCY if args.udp else MODE_LATENCY
+            elif args.rr or args.crr:
+                mode = MODE_RR if args.rr else MODE_CRR
+            elif args.reverse:
+                mode = MODE_REVERSE
+            elif args.udp:
+                mode = MODE_UDP
+            else:
+                mode = MODE_NUM if args.num is not None or args.file is not None else MODE_TIME
+            #Record the test parameters of the run (byte target 0 and rate 0 mean none)
+            emit_record({'type': 'start', 'id': f'{args.serverip}:{args.port}', 'mode': MODE_NAMES[mode], 'duration': args.time,
+                         'num': os.path.getsize(args.file) if args.file is not None else get_bytes_to_send(args.num) if args.num is not None else 0,
+                         'block_size': get_message_size(args.request_size) if args.rr or args.crr else get_block_size(), 'group_id': group_id,
+                         'start_time': time.time(), 'parallel': args.parallel, 'rate': get_target_rate() or 0, 'burst': get_burst() or 0,
+                         **({'request_size': get_message_size(args.request_size), 'response_size': get_message_size(args.response_size),
+                             'pool': args.pool} if args.rr or args.crr else {})})
+
+        #If -M selected, run each parallel connection in its own process:
+        if args.multiprocess:
+            start_barrier = multiprocessing.Barrier(len(jobs))
+            #The barrier is handed to each worker process explicitly, because with the spawn and forkserver start methods the workers do not
+            #inherit globals set in main()
+            with multiprocessing.Pool(len(jobs), initializer=set_start_barrier, initargs=(start_barrier,)) as pool:
+                job_results = pool.starmap(run_stream, jobs)        #Results are sent back to the parent
+        #Otherwise run each parallel connection in a thread:
+        else:
+            start_barrier = threading.Barrier(len(jobs))
+            job_results = [None]*len(jobs)                          #List to collect the results of each thread
+            threads = []                                            #List to keep track of threads
+
+            #FUNCTION: Runs a stream in a thread and stores its results in the list
+            def run_stream_thread(index):
+                job_results[index] = run_stream(*jobs[index])
+
+            #For each parallel connection specified in -P:
+            for index in range(len(jobs)):
+                t = threading.Thread(target=run_stream_thread, args=(index,))    #Create a new thread to connect and send data
+                threads.append(t)                                   #Add new thread to the list
+                t.start()                                           #Start all the threads so they run concurrently
+            for t in threads:
+                t.join()                                            #Wait for all threads to complete before continuing
+        #Print per-stream rows and SUM row in one table for throughput streams, and another for latency or transaction streams
+        print_stream_results([result for job, result in zip(jobs, job_results) if job[2] not in ('latency', 'transactions')])
+        print_latency_results([result for job, result in zip(jobs, job_results) if job[2] == 'latency'])
+        print_transaction_results([result for job, result in zip(jobs, job_results) if job[2] == 'transactions'])
+        if args.file is not None:
+            display_storage_results(os.path.basename(args.file), *file_read, 'read')
+        if None in job_results:
+            sys.exit(1)                                             #Exit with an error if any stream failed
           
           
 if __name__ == '__main__':
-    main()                                                      #Execution of module begins with main()
\ No newline at end of file
+    main()                                                      #Execution of module begins with main()
@@ -0,0 +1,136 @@
+"""
+TESTS: Loopback tests of simpleperf.
+Each test starts a simpleperf server and runs a simpleperf client against it over the loopback interface, both with --json, and checks the records
+they write. Run with: python3 -m unittest test_simpleperf (or pytest).
+"""
+
+#Import libraries required for the tests
+import unittest
+import subprocess
+import sys
+import os
+import json
+import socket
+import time
+
+
+SIMPLEPERF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simpleperf.py')
+TIMEOUT = 30                                            #Seconds a client may run before the test fails
+
+
+#FUNCTION: Finds a free TCP port on the loopback interface
+#ARGUMENTS: None
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+#FUNCTION: Starts a server on a free port
+#ARGUMENTS:
+#server_args: Extra arguments of the server
+#Returns the server process and its port once the server is listening.
+def start_server(server_args=()):
+    port = str(free_port())
+    server = subprocess.Popen([sys.executable, '-u', SIMPLEPERF, '-s', '-p', port, '--json', *server_args],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in server.stderr:                          #Messages go to stderr with --json
+        if 'listening' in line:
+            break
+    return server, port
+
+
+#FUNCTION: Stops a server started by start_server()
+#ARGUMENTS:
+#server: The server process
+#Returns the records written by the server and its remaining messages.
+def stop_server(server):
+    server.terminate()
+    output, messages = server.communicate()
+    return [json.loads(line) for line in output.splitlines()], messages
+
+
+#FUNCTION: Runs a client against a new server
+#ARGUMENTS:
+#client_args: Extra arguments of the client
+#server_args: Extra arguments of the server
+#Returns the exit code of the client and the records written by the client and by the server.
+def run_simpleperf(client_args, server_args=()):
+    server, port = start_server(server_args)
+    try:
+        client = subprocess.run([sys.executable, SIMPLEPERF, '-c', '-p', port, '--json', *client_args],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=TIMEOUT)
+    finally:
+        server_records, _ = stop_server(server)
+    return client.returncode, [json.loads(line) for line in client.stdout.splitlines()], server_records
+
+
+class LoopbackTest(unittest.TestCase):
+
+    #A UDP test with -n ends when the bytes are sent, even if that takes longer than -t
+    def test_udp_num_longer_than_time(self):
+        returncode, client, _ = run_simpleperf(['-u', '-r', '1M', '-n', '200KB', '-t', '1'])
+        self.assertEqual(returncode, 0)
+        sender = [record for record in client if record['type'] == 'stream' and record['role'] == 'sender']
+        self.assertEqual(len(sender), 1)
+        self.assertGreaterEqual(sender[0]['bytes'], 200000)
+        self.assertGreater(sender[0]['seconds'], 1)
+
+    #A UDP test whose client is killed is reported as partial by the server, which keeps running
+    def test_udp_client_killed(self):
+        server, port = start_server()
+        try:
+            client = subprocess.Popen([sys.executable, SIMPLEPERF, '-c', '-p', port, '-u', '-r', '1M', '-t', '10'],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            time.sleep(1)
+            client.kill()
+            client.wait()
+            time.sleep(0.5)
+            self.assertIsNone(server.poll())
+        finally:
+            records, messages = stop_server(server)
+        self.assertNotIn('Traceback', messages)
+        streams = [record for record in records if record['type'] == 'stream']
+        self.assertEqual(len(streams), 1)
+        self.assertTrue(streams[0]['partial'])
+        self.assertGreater(streams[0]['bytes'], 0)
+
+    #A client whose streams cannot connect stops with an error instead of waiting at the start barrier
+    def test_no_server(self):
+        for extra in ([], ['-M']):
+            client = subprocess.run([sys.executable, SIMPLEPERF, '-c', '-p', str(free_port()), '-P', '3', '-t', '1', *extra],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=TIMEOUT)
+            self.assertNotEqual(client.returncode, 0)
+            self.assertNotIn('Traceback', client.stderr)
+            self.assertEqual(client.stdout.count('Connection refused'), 3)
+
+    #The interval and stream records of both sides carry the fields which identify the stream, so they can be joined
+    def test_record_fields(self):
+        keys = {'stream_id', 'group_id', 'direction', 'role'}
+        for server_args in ([], ['-e']):
+            for client_args in ([], ['-R'], ['-u', '-r', '10M']):
+                with self.subTest(server=server_args, client=client_args):
+                    returncode, client, server = run_simpleperf([*client_args, '-t', '2', '-i', '1'], [*server_args, '-i', '1'])
+                    self.assertEqual(returncode, 0)
+                    for side, records in (('client', client), ('server', server)):
+                        records = [record for record in records if record['type'] in ('interval', 'stream')]
+                        self.assertEqual({record['type'] for record in records}, {'interval', 'stream'}, side)
+                        for record in records:
+                            self.assertLessEqual(keys, record.keys(), f'{side} {record["type"]} record')
+                    ids = {(record['group_id'], record['stream_id']) for record in client + server if 'stream_id' in record}
+                    self.assertEqual(len(ids), 1)
+
+    #The receiver's intervals of a UDP test end with the last datagram, not after the grace period for datagrams still in flight
+    def test_udp_no_empty_interval(self):
+        for server_args in ([], ['-e']):
+            with self.subTest(server=server_args):
+                returncode, client, server = run_simpleperf(['-u', '-r', '10M', '-t', '2', '-i', '1'], [*server_args, '-i', '1'])
+                self.assertEqual(returncode, 0)
+                receiver = [record for record in client + server if record['type'] == 'interval' and record['role'] == 'receiver']
+                self.assertTrue(receiver)
+                for record in receiver:
+                    self.assertGreater(record['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()